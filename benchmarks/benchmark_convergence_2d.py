@@ -0,0 +1,106 @@
+import time
+
+import numpy as np
+
+from meent.rcwa import call_solver
+
+
+def pillar(kind, size=128):
+    y, x = np.indices((size, size))
+    x = x - size / 2 + 0.5
+    y = y - size / 2 + 0.5
+
+    if kind == 'disk':  # dielectric, high contrast
+        ucell = (x ** 2 + y ** 2 < (0.3 * size) ** 2).astype(int)
+        ucell_materials = [1, 3.48]
+    else:  # lossy dielectric rectangle
+        ucell = ((abs(x) < 0.3 * size) & (abs(y) < 0.2 * size)).astype(int)
+        ucell_materials = [1, 2.5 - 0.2j]  # absorbing: losses have a negative imaginary part here
+
+    return ucell[None], ucell_materials
+
+
+def run(ucell, ucell_materials, fourier_order, factorization):
+    solver = call_solver(mode=0, grating_type=2, pol=1, n_I=1, n_II=1.45, theta=0, phi=0, psi=0,
+                         fourier_order=fourier_order, wavelength=1000, period=[600, 600], ucell=ucell,
+                         ucell_materials=ucell_materials, thickness=[200], factorization=factorization)
+    de_ri, de_ti = solver.run_ucell()
+
+    return de_ti.sum()
+
+
+def check_energy_conservation(size=64, fourier_orders=(3, 5, 8, 11), tol=1E-10):
+    # lossless square ring with a hole: R + T must be 1 for every factorization, also on multiply-connected layers
+    y, x = np.indices((size, size))
+    x = abs(x - size / 2 + 0.5)
+    y = abs(y - size / 2 + 0.5)
+    ucell = ((np.maximum(x, y) < 0.35 * size) & (np.maximum(x, y) > 0.15 * size)).astype(int)[None]
+
+    for factorization in (None, 'normal_vector'):
+        for fourier_order in fourier_orders:
+            for pol in (0, 1):
+                solver = call_solver(mode=0, grating_type=2, pol=pol, n_I=1, n_II=1, theta=10, phi=20,
+                                     fourier_order=fourier_order, wavelength=900, period=[700, 700], ucell=ucell,
+                                     ucell_materials=[1, 3.48], thickness=[300], factorization=factorization)
+                de_ri, de_ti = solver.run_ucell()
+                error = de_ri.sum() + de_ti.sum() - 1
+                assert abs(error) < tol, (factorization, fourier_order, pol, error)
+
+    print(f'R + T = 1 within {tol:.0e} on a lossless ring for both factorizations')
+
+
+def order_needed(errors, tol):
+    # smallest order from which the error stays below tol
+    for fourier_order in sorted(errors):
+        if all(errors[fo] < tol for fo in errors if fo >= fourier_order):
+            return fourier_order
+    return None
+
+
+def extrapolated_reference(values):
+    """
+    Limit shared by the factorizations, so that none of them is scored against its own: a least squares fit of
+    t = t_inf + slope / M with one slope per factorization and M = 2 * fourier_order + 1 harmonics per direction.
+
+    Args:
+        values: {factorization: {fourier_order: total transmission}}
+    """
+    rows, rhs = [], []
+    for idx, factorization in enumerate(values):
+        for fourier_order, value in values[factorization].items():
+            row = np.zeros(1 + len(values))
+            row[0], row[1 + idx] = 1, 1 / (2 * fourier_order + 1)
+            rows.append(row)
+            rhs.append(value)
+
+    return np.linalg.lstsq(np.array(rows), np.array(rhs), rcond=None)[0][0]
+
+
+def convergence(kind, max_order=12, reference_orders=(12, 14, 16), tol=1E-3):
+    ucell, ucell_materials = pillar(kind)
+    factorizations = None, 'normal_vector'
+
+    values = {factorization: {fourier_order: run(ucell, ucell_materials, fourier_order, factorization)
+                              for fourier_order in reference_orders} for factorization in factorizations}
+    reference = extrapolated_reference(values)
+    print(f'{kind}: total transmission {reference:.6f}, extrapolated from fourier_order {reference_orders} '
+          f'of both factorizations')
+
+    errors = {factorization: {} for factorization in factorizations}
+    for fourier_order in range(1, max_order + 1):
+        line = f'fourier_order {fourier_order:3d}'
+        for factorization in errors:
+            t0 = time.time()
+            error = abs(run(ucell, ucell_materials, fourier_order, factorization) - reference)
+            errors[factorization][fourier_order] = error
+            line += f' | {str(factorization):>13s}: {error:.1e} ({time.time() - t0:6.2f}s)'
+        print(line)
+
+    for factorization in errors:
+        print(f'{str(factorization):>13s}: order needed for {tol:.0e}: {order_needed(errors[factorization], tol)}')
+
+
+if __name__ == '__main__':
+    check_energy_conservation()
+    for kind in ('disk', 'lossy'):
+        convergence(kind)
@@ -0,0 +1,156 @@
+import time
+
+import jax
+import jax.numpy as jnp
+import numpy as np
+import torch
+
+from meent.rcwa import call_solver
+from meent.on_numpy.convolution_matrix import put_permittivity_in_ucell, to_conv_mat_piecewise_constant
+from meent.on_numpy.transfer_method import transfer_2d_1, transfer_2d_wv, transfer_2d_big_wv
+from meent.on_numpy.transfer_method import transfer_2d_2 as transfer_2d_2_numpy
+from meent.on_jax.transfer_method import transfer_2d_2 as transfer_2d_2_jax
+from meent.on_torch.transfer_method import transfer_2d_2 as transfer_2d_2_torch
+
+jax.config.update('jax_enable_x64', True)
+
+
+def transfer_2d_2_inv(xp, k0, d, q, big_W, big_V, big_F, big_G, big_T):
+    # transfer_2d_2 with explicit inverses in place of the LU solves, for comparison.
+    # xp is the array module of the backend: numpy, jax.numpy or torch.
+
+    big_I = xp.eye(q.shape[-1], dtype=big_F.dtype)
+    big_X = xp.exp(-k0 * q * d)
+
+    big_W_i_F = xp.linalg.inv(big_W) @ big_F
+    big_V_i_G = xp.linalg.inv(big_V) @ big_G
+
+    big_A = 0.5 * (big_W_i_F + big_V_i_G)
+    big_B = 0.5 * (big_W_i_F - big_V_i_G)
+
+    big_A_i = xp.linalg.inv(big_A)
+    big_B_A_i, big_T_A_i = big_B @ big_A_i, big_T @ big_A_i
+
+    big_X_B_A_i_X = big_X[:, None] * big_B_A_i * big_X[None, :]
+
+    big_F = big_W @ (big_I + big_X_B_A_i_X)
+    big_G = big_V @ (big_I - big_X_B_A_i_X)
+
+    big_T = big_T_A_i * big_X[None, :]
+
+    return big_X, big_F, big_G, big_T, big_A, big_B
+
+
+def big_wv(xp, W, V, center, varphi):
+    # big_W and big_V from W and V, as the JAX and torch transfer_2d_2 build them before the cascade step
+    F_c = xp.cos(varphi)[:, None]
+    F_s = xp.sin(varphi)[:, None]
+
+    W_11, W_12, W_21, W_22 = W[:center, :center], W[:center, center:], W[center:, :center], W[center:, center:]
+    V_11, V_12, V_21, V_22 = V[:center, :center], V[:center, center:], V[center:, :center], V[center:, center:]
+
+    big_W = xp.concatenate([
+        xp.concatenate([F_c * W_21 - F_s * W_11, F_c * W_22 - F_s * W_12], axis=1),
+        xp.concatenate([F_c * W_11 + F_s * W_21, F_c * W_12 + F_s * W_22], axis=1)], axis=0)
+    big_V = xp.concatenate([
+        xp.concatenate([F_c * V_11 + F_s * V_21, F_c * V_12 + F_s * V_22], axis=1),
+        xp.concatenate([F_c * V_21 - F_s * V_11, F_c * V_22 - F_s * V_12], axis=1)], axis=0)
+
+    return big_W, big_V
+
+
+def transfer_2d_2_inv_wv(xp, k0, d, W, V, center, q, varphi, big_F, big_G, big_T):
+    # reference for the JAX and torch transfer_2d_2, which take W and V
+    big_W, big_V = big_wv(xp, W, V, center, varphi)
+
+    return transfer_2d_2_inv(xp, k0, d, q, big_W, big_V, big_F, big_G, big_T)
+
+
+def timed(func, n_iter, sync=lambda res: None):
+    sync(func())  # warm-up, and compilation for JAX
+
+    t0 = time.time()
+    for _ in range(n_iter):
+        res = func()
+    sync(res)
+
+    return res, (time.time() - t0) / n_iter
+
+
+def layer(fourier_order):
+    ucell = np.array([
+        [
+            [0, 0, 1, 1, 1, 0],
+            [0, 1, 1, 1, 1, 0],
+            [0, 1, 1, 1, 0, 0],
+        ],
+    ])
+
+    solver = call_solver(mode=0, grating_type=2, pol=1, n_I=1, n_II=1.5, theta=10, phi=20, psi=0,
+                         fourier_order=fourier_order, wavelength=900, period=[700, 600], ucell=ucell,
+                         ucell_materials=[1, 3.48], thickness=[500])
+
+    pmt = put_permittivity_in_ucell(solver.ucell, solver.ucell_materials, solver.mat_table, solver.wavelength)
+    E_conv = to_conv_mat_piecewise_constant(pmt, fourier_order)[0]
+    o_E_conv = to_conv_mat_piecewise_constant(1 / pmt, fourier_order)[0]
+
+    k0 = 2 * np.pi / solver.wavelength
+    center = solver.ff ** 2
+    fourier_indices = np.arange(-fourier_order, fourier_order + 1)
+
+    solver.get_kx_vector()
+    _, _, Kx, Ky, _, _, varphi, _, _, _, _, big_F, big_G, big_T \
+        = transfer_2d_1(solver.ff, k0, solver.n_I, solver.n_II, solver.kx_vector, solver.period, fourier_indices,
+                        solver.theta, solver.phi, solver.wavelength)
+
+    W, V, q = transfer_2d_wv(solver.ff, Kx, np.linalg.inv(E_conv), Ky, np.linalg.inv(o_E_conv), E_conv)
+
+    return solver, k0, W, V, center, q, varphi, big_F, big_G, big_T
+
+
+def report(backend, res_inv, res_solve, t_inv, t_solve):
+    err = max(float(abs(res_inv[i] - res_solve[i]).max() / abs(res_inv[i]).max()) for i in (1, 2, 3))
+
+    return f' | {backend} inv: {t_inv:7.3f}s solve: {t_solve:7.3f}s (x{t_inv / t_solve:.2f}, rel. diff {err:.1e})'
+
+
+def run(fourier_order, n_iter=3, d=500):
+    solver, k0, W, V, center, q, varphi, big_F, big_G, big_T = layer(fourier_order)
+    line = f'fourier_order {fourier_order:3d}'
+
+    # numpy: transfer_2d_2 takes big_W and big_V
+    big_W, big_V = transfer_2d_big_wv(W, V, center, varphi)[8:10]
+    args = k0, d, q, big_W, big_V, big_F, big_G, big_T
+    res_inv, t_inv = timed(lambda: transfer_2d_2_inv(np, *args), n_iter)
+    res_solve, t_solve = timed(lambda: transfer_2d_2_numpy(k0, d, q, center, big_W, big_V, None, None,
+                                                           big_F, big_G, big_T), n_iter)
+    line += report('numpy', res_inv, res_solve, t_inv, t_solve)
+
+    # JAX, jitted as in the solver
+    args = (k0, d) + tuple(jnp.asarray(a) for a in (W, V)) + (center,) \
+        + tuple(jnp.asarray(a) for a in (q, varphi, big_F, big_G, big_T))
+    step_inv = jax.jit(lambda *a: transfer_2d_2_inv_wv(jnp, *a), static_argnums=(4,))
+    step_solve = jax.jit(lambda *a: transfer_2d_2_jax(*a)[:6], static_argnums=(4,))
+    sync = jax.block_until_ready
+    res_inv, t_inv = timed(lambda: step_inv(*args), n_iter, sync)
+    res_solve, t_solve = timed(lambda: step_solve(*args), n_iter, sync)
+    line += report('jax', res_inv, res_solve, t_inv, t_solve)
+
+    # torch, on the CPU
+    args = (k0, d) + tuple(torch.from_numpy(a) for a in (W, V)) + (center,) \
+        + tuple(torch.from_numpy(a) for a in (q, varphi, big_F, big_G, big_T))
+    res_inv, t_inv = timed(lambda: transfer_2d_2_inv_wv(torch, *args), n_iter)
+    res_solve, t_solve = timed(lambda: transfer_2d_2_torch(*args), n_iter)
+    line += report('torch', res_inv, res_solve, t_inv, t_solve)
+
+    t0 = time.time()
+    solver.run_ucell()
+    line += f' | numpy run_ucell: {time.time() - t0:7.3f}s'
+
+    print(line)
+
+
+if __name__ == '__main__':
+    # order 18 and up hold several 2738 x 2738 complex matrices per backend: more than 6 GB
+    for fourier_order in range(10, 17, 2):
+        run(fourier_order)
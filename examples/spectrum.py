@@ -53,13 +53,13 @@ t0 = time.perf_counter()
 solver = call_solver(mode=0, grating_type=grating_type, pol=pol, n_I=n_I, n_II=n_II, theta=theta, phi=phi, psi=psi,
                      fourier_order=fourier_order, period=period, ucell=ucell, ucell_materials=ucell_materials, thickness=thickness)
 
-spectrum_r = np.zeros([len(wavelength_array)] + [2 * fourier_order + 1] * (grating_type // 2 + 1))
-spectrum_t = np.zeros([len(wavelength_array)] + [2 * fourier_order + 1] * (grating_type // 2 + 1))
+spectrum_r, spectrum_t = solver.solve_spectrum(wavelength_array)
 
-for i, wavelength in enumerate(wavelength_array):
-    solver.wavelength = wavelength
-    de_ri, de_ti = solver.run_ucell()
-
-    spectrum_r[i] = de_ri
-    spectrum_t[i] = de_ti
+# equivalent to
+# for i, wavelength in enumerate(wavelength_array):
+#     solver.wavelength = wavelength
+#     de_ri, de_ti = solver.run_ucell()
+#     spectrum_r[i] = de_ri
+#     spectrum_t[i] = de_ti
 
+print(time.perf_counter() - t0)
@@ -0,0 +1,157 @@
+import os
+import hashlib
+
+import numpy as np
+
+from collections.abc import Mapping
+from pathlib import Path
+
+NK_PATH = Path(__file__).resolve().parent / 'nk_data'
+
+_tables = {}
+
+
+def material_table(nk_path=None, cache_dir=None):
+    """
+    Process-wide material table of nk_path, shared by all solvers and backends.
+
+    Args:
+        nk_path: directory of .txt and .mat files with wavelength, n and k columns. None for meent/nk_data.
+        cache_dir: where parsed tables are kept as .npy. None for ~/.cache/meent/nk_data.
+
+    Returns:
+        MaterialTable
+    """
+    if nk_path is None:
+        nk_path = NK_PATH
+
+    key = (str(nk_path), str(cache_dir))
+    if key not in _tables:
+        _tables[key] = MaterialTable(nk_path, cache_dir)
+
+    return _tables[key]
+
+
+def material_dispersion(material, mat_table):
+    """
+    MaterialDispersion of a material name of mat_table. A '__real' suffix keeps the real index n only.
+    Cached when mat_table is a MaterialTable.
+    """
+    n_only = material[-6:] == '__real'
+    name = (material[:-6] if n_only else material).upper()
+
+    if isinstance(mat_table, MaterialTable):
+        return mat_table.dispersion(name, n_only)
+
+    return MaterialDispersion(mat_table[name], n_only)
+
+
+class MaterialDispersion:
+    """
+    n + ik of one material, interpolated linearly in wavelength and constant outside the table, as np.interp.
+
+    The segments are computed once: x0, y0 and slope of segment i hold on [wavelength[i - 1], wavelength[i]),
+    with a constant segment at each end. Evaluating a wavelength array is then one searchsorted and one gather,
+    which the backends repeat with their own arrays to stay traceable and differentiable.
+    """
+
+    def __init__(self, data, n_only=False):
+        wavelength, n, k = np.array(np.real(data).T[:3])
+        nk = n if n_only else n + 1j * k
+
+        step = np.diff(wavelength)
+        slope = np.divide(np.diff(nk), step, out=np.zeros(len(step), dtype=nk.dtype), where=step != 0)
+
+        self.n_only = n_only
+        self.wavelength = wavelength
+        self.x0 = np.concatenate([wavelength[:1], wavelength[:-1], wavelength[-1:]])
+        self.y0 = np.concatenate([nk[:1], nk[:-1], nk[-1:]])
+        self.slope = np.concatenate([[0], slope, [0]])
+
+    def __call__(self, wl):
+        index = np.searchsorted(self.wavelength, wl, side='right')
+
+        return self.y0[index] + self.slope[index] * (wl - self.x0[index])
+
+
+def parse_material_file(path):
+    # (wavelength, n, k) rows
+    path = Path(path)
+
+    if path.suffix == '.txt':
+        return np.loadtxt(path, skiprows=1)
+
+    from scipy.io import loadmat
+
+    data = loadmat(str(path))
+    return np.array([data['WL'], data['n'], data['k']])[:, :, 0].T
+
+
+class MaterialTable(Mapping):
+    """
+    Read-only mapping from upper-case material name to its (wavelength, n, k) table.
+
+    Nothing is read on construction: nk_path is listed on the first lookup and each material is parsed on its own
+    first lookup. Parsed tables are written to cache_dir as .npy, keyed by the source file's path, size and mtime,
+    and memory-mapped from there by later processes.
+    """
+
+    def __init__(self, nk_path, cache_dir=None):
+        self.nk_path = Path(nk_path)
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else Path.home() / '.cache' / 'meent' / 'nk_data'
+
+        self._paths = None
+        self._data = {}
+        self._dispersions = {}
+
+    @property
+    def paths(self):
+        if self._paths is None:
+            paths = {}
+            for dirpath, dirnames, filenames in os.walk(self.nk_path):
+                for filename in filenames:
+                    if filename[-3:] in ('txt', 'mat'):
+                        paths[filename[:-4].upper()] = Path(dirpath) / filename
+            self._paths = paths
+
+        return self._paths
+
+    def __getitem__(self, name):
+        if name not in self._data:
+            self._data[name] = self._load(self.paths[name])
+
+        return self._data[name]
+
+    def dispersion(self, name, n_only=False):
+        if (name, n_only) not in self._dispersions:
+            self._dispersions[(name, n_only)] = MaterialDispersion(self[name], n_only)
+
+        return self._dispersions[(name, n_only)]
+
+    def __iter__(self):
+        return iter(self.paths)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def _load(self, path):
+        stat = path.stat()
+        key = hashlib.sha1(f'{path.resolve()}|{stat.st_size}|{stat.st_mtime_ns}'.encode()).hexdigest()[:16]
+        cache_path = self.cache_dir / f'{path.stem}-{key}.npy'
+
+        if cache_path.exists():
+            return np.load(cache_path, mmap_mode='r')
+
+        data = parse_material_file(path)
+
+        # written aside and renamed, so that concurrent processes never read a partial file
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = cache_path.with_suffix(f'.{os.getpid()}.tmp')
+            with open(tmp_path, 'wb') as f:
+                np.save(f, data)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            pass  # not writable: parsed again by the next process
+
+        return data
@@ -1,34 +1,44 @@
-from functools import partial
+from functools import lru_cache, partial
 
 import jax
 
 import jax.numpy as jnp
 import numpy as np
 
-from os import walk
-from pathlib import Path
-from scipy.io import loadmat
+from ..material_table import material_table, material_dispersion
 
 
 def put_permittivity_in_ucell(ucell, mat_list, mat_table, wl, type_complex=jnp.complex128):
+    """
+    Permittivity of each cell of ucell, gathered from a table with one entry per material of mat_list.
+    The traced program does not depend on the size of ucell, and wl may be traced (jit, vmap, grad);
+    an array of wavelengths puts its axes first: (..., Z, Y, X).
+
+    Args:
+        ucell: indices into mat_list. Real values are interpolated linearly between neighbouring materials,
+            which makes the result differentiable with respect to them.
+    """
+    permittivity = []
+    for material in mat_list:
+        if type(material) == str:
+            eps = find_nk_index(material, mat_table, wl, type_complex=type_complex) ** 2
+        else:
+            eps = material ** 2
+        permittivity.append(jnp.broadcast_to(jnp.asarray(eps, dtype=type_complex), jnp.shape(wl)))
 
-    res = jnp.zeros(ucell.shape, dtype=type_complex)
-
-    for z in range(ucell.shape[0]):
-        for y in range(ucell.shape[1]):
-            for x in range(ucell.shape[2]):
-                material = mat_list[int(ucell[z, y, x])]
-                assign_index = (z, y, x)
+    # (..., material)
+    permittivity = jnp.stack(permittivity, axis=-1)
 
-                if type(material) == str:
-                    assign_value = find_nk_index(material, mat_table, wl, type_complex=type_complex) ** 2
-                else:
-                    assign_value = type_complex(material ** 2)  # TODO: need type complex?
+    ucell = jnp.asarray(ucell)
+    if jnp.issubdtype(ucell.dtype, jnp.integer):
+        return permittivity[..., ucell]
 
-                res = res.at[assign_index].set(assign_value)
-                # res = ee.assign(res, assign_index, assign_value)
+    index = jnp.clip(ucell, 0, len(mat_list) - 1)
+    lower = jnp.floor(index).astype(int)
+    upper = jnp.minimum(lower + 1, len(mat_list) - 1)
+    weight = index - lower
 
-    return res
+    return permittivity[..., lower] * (1 - weight) + permittivity[..., upper] * weight
 
 
 def put_permittivity_in_ucell_object(ucell_size, mat_list, obj_list, mat_table, wl,
@@ -46,51 +56,22 @@ def put_permittivity_in_ucell_object(ucell_size, mat_list, obj_list, mat_table,
 
 
 def find_nk_index(material, mat_table, wl, type_complex=jnp.complex128):
-    if material[-6:] == '__real':
-        material = material[:-6]
-        n_only = True
-    else:
-        n_only = False
-
-    mat_data = mat_table[material.upper()]
+    # wl may be traced and an array of wavelengths
+    dispersion = material_dispersion(material, mat_table)
+    x0, y0, slope = jnp.asarray(dispersion.x0), jnp.asarray(dispersion.y0), jnp.asarray(dispersion.slope)
 
-    n_index = jnp.interp(wl, mat_data[:, 0], mat_data[:, 1])
+    index = jnp.searchsorted(jnp.asarray(dispersion.wavelength), wl, side='right')
+    nk = y0[index] + slope[index] * (wl - x0[index])
 
-    if n_only:
-        return n_index
+    if dispersion.n_only:
+        return nk
 
-    k_index = jnp.interp(wl, mat_data[:, 0], mat_data[:, 2])
-    nk = (n_index + 1j * k_index).astype(type_complex)
-
-    return nk
+    return nk.astype(type_complex)
 
 
 def read_material_table(nk_path=None, type_complex=jnp.complex128):
-
-    mat_table = {}
-
-    if nk_path is None:
-        nk_path = str(Path(__file__).resolve().parent.parent) + '/nk_data'
-
-    full_path_list, name_list, _ = [], [], []
-    for (dirpath, dirnames, filenames) in walk(nk_path):
-        full_path_list.extend([f'{dirpath}/{filename}' for filename in filenames])
-        name_list.extend(filenames)
-    for path, name in zip(full_path_list, name_list):
-        if name[-3:] == 'txt':
-            data = np.loadtxt(path, skiprows=1)
-            mat_table[name[:-4].upper()] = type_complex(data)
-
-        elif name[-3:] == 'mat':
-            data = loadmat(path)
-
-            # TODO: need astype?
-            # data = jnp.array([data['WL'], data['n'], data['k']])[:, :, 0].T
-            data['WL'], data['n'], data['k'] = data['WL'].astype(type_complex), data['n'].astype(type_complex), data['k'].astype(type_complex)
-
-            data = jnp.array([data['WL'], data['n'], data['k']])[:, :, 0].T
-            mat_table[name[:-4].upper()] = data
-    return mat_table
+    # shared with the other backends; the tables are real and find_nk_index casts its result to type_complex
+    return material_table(nk_path)
 
 
 # can't jit
@@ -194,52 +175,46 @@ def fft_piecewise_constant(cell, fourier_order, type_complex=jnp.complex128):
     return f_coeffs_xy.T
 
 
+@lru_cache(maxsize=16)
+def conv_index(fourier_order, shape):
+    """
+    Flat gather index of the convolution matrix in fftshifted Fourier coefficients of shape (y, x):
+    entry (i, j) points at the coefficient of the order difference between harmonics i and j.
+    Computed once per order and shape, for the few most recent ones; y of 1 for 1D. A numpy array, hence a
+    constant under jit.
+    """
+    order = np.arange(-fourier_order, fourier_order + 1)
+
+    if shape[0] == 1:  # 1D
+        order_x, order_y = order, np.zeros_like(order)
+    else:
+        order_y, order_x = (o.flatten() for o in np.meshgrid(order, order, indexing='ij'))
+
+    center_y, center_x = shape[0] // 2, shape[1] // 2
+    index = (center_y + order_y[:, None] - order_y[None, :]) * shape[1] + center_x + order_x[:, None] - order_x[None, :]
+    index.flags.writeable = False
+
+    return index
+
+
+def gather_conv(f_coeffs, fourier_order):
+    # convolution matrices of fftshifted coefficients (..., y, x)
+    index = conv_index(fourier_order, tuple(f_coeffs.shape[-2:]))
+
+    return f_coeffs.reshape(f_coeffs.shape[:-2] + (-1,))[..., index]
+
+
 def to_conv_mat_piecewise_constant(pmt, fourier_order, type_complex=jnp.complex128):
 
     if len(pmt.shape) == 2:
         print('shape is 2')
         raise ValueError
-    ff = 2 * fourier_order + 1
 
-    if pmt.shape[1] == 1:  # 1D
-        res = jnp.zeros((pmt.shape[0], ff, ff)).astype(type_complex)
-
-        for i, layer in enumerate(pmt):
-            f_coeffs = fft_piecewise_constant(layer, fourier_order, type_complex=type_complex)
-            center = f_coeffs.shape[1] // 2
-            conv_idx = jnp.arange(-ff + 1, ff, 1)
-            conv_idx = circulant(conv_idx)
-            e_conv = f_coeffs[0, center + conv_idx]
-            res = res.at[i].set(e_conv)
-            # res = ee.assign(res, i, e_conv)
-
-    else:  # 2D
-        # attention on the order of axis (Z Y X)
-        res = jnp.zeros((pmt.shape[0], ff ** 2, ff ** 2)).astype(type_complex)
-
-        for i, layer in enumerate(pmt):
-            f_coeffs = fft_piecewise_constant(layer, fourier_order, type_complex=type_complex)
-            center = jnp.array(f_coeffs.shape) // 2
-
-            conv_idx = jnp.arange(-ff + 1, ff, 1)
-            conv_idx = circulant(conv_idx)
-            conv_i = jnp.repeat(conv_idx, ff, 1)
-            conv_i = jnp.repeat(conv_i, ff, axis=0)
-            conv_j = jnp.tile(conv_idx, (ff, ff))
-            e_conv = f_coeffs[center[0] + conv_i, center[1] + conv_j]
-            res = res.at[i].set(e_conv)
-            # res = res.at[i].set(f_coeffs[center[0] + conv_i, center[1] + conv_j])
-            # assign_value = f_coeffs[center[0] + conv_i, center[1] + conv_j]
-            # res = ee.assign(res, i, assign_value)
-
-    # import matplotlib.pyplot as plt
-    #
-    # plt.figure()
-    # plt.imshow(abs(res[0]), cmap='jet')
-    # plt.colorbar()
-    # plt.show()
-    # print('conv time: ', time.time() - t0)
-    return res
+    # attention on the order of axis (Z Y X)
+    f_coeffs = jnp.stack([fft_piecewise_constant(layer, fourier_order, type_complex=type_complex) for layer in pmt])
+    res = gather_conv(f_coeffs, fourier_order)
+
+    return res.astype(type_complex)
 
 
 @partial(jax.jit, static_argnums=(1,2))
@@ -250,72 +225,24 @@ def to_conv_mat(pmt, fourier_order, type_complex=jnp.complex128):
         raise ValueError
     ff = 2 * fourier_order + 1
 
-    if pmt.shape[1] == 1:  # 1D
-        res = jnp.zeros((pmt.shape[0], ff, ff)).astype(type_complex)
-
-        # extend array for FFT
-        # minimum_pattern_size = (4 * fourier_order + 1) * pmt.shape[2]
-        minimum_pattern_size = 2 * ff
-
-        if pmt.shape[2] < minimum_pattern_size:
-            n = minimum_pattern_size // pmt.shape[2]
-            pmt = np.repeat(pmt, n+1, axis=2)
-
-        for i, layer in enumerate(pmt):
-            f_coeffs = jnp.fft.fftshift(jnp.fft.fft(layer / layer.size))
-            center = f_coeffs.shape[1] // 2
-
-            conv_idx = jnp.arange(-ff + 1, ff, 1)
-            conv_idx = circulant(conv_idx)
-            e_conv = f_coeffs[0, center + conv_idx]
-            res = res.at[i].set(e_conv)
-            # res = ee.assign(res, i, e_conv)
-
-    else:  # 2D
-        # attention on the order of axis (Z Y X)
-        res = jnp.zeros((pmt.shape[0], ff ** 2, ff ** 2)).astype(type_complex)
-
-        # extend array
-        minimum_pattern_size = 2 * ff
-        if pmt.shape[1] < minimum_pattern_size:
-            n = minimum_pattern_size // pmt.shape[1]
-            pmt = jnp.repeat(pmt, n+1, axis=1)
-        if pmt.shape[2] < minimum_pattern_size:
-            n = minimum_pattern_size // pmt.shape[2]
-            pmt = np.repeat(pmt, n+1, axis=2)
-
-        for i, layer in enumerate(pmt):
-            f_coeffs = jnp.fft.fftshift(jnp.fft.fft2(layer / layer.size))
-            center = jnp.array(f_coeffs.shape) // 2
-
-            conv_idx = jnp.arange(-ff + 1, ff, 1)
-            conv_idx = circulant(conv_idx)
-
-            conv_i = jnp.repeat(conv_idx, ff, 1)
-            conv_i = jnp.repeat(conv_i, ff, axis=0)
-            conv_j = jnp.tile(conv_idx, (ff, ff))
-            e_conv = f_coeffs[center[0] + conv_i, center[1] + conv_j]
-            res = res.at[i].set(e_conv)
-
-            # res = res.at[i].set(f_coeffs[center[0] + conv_i, center[1] + conv_j])
-            # res = ee.assign(res, i, assign_value)
-
-    # import matplotlib.pyplot as plt
-    #
-    # plt.figure()
-    # plt.imshow(abs(res[0]), cmap='jet')
-    # plt.colorbar()
-    # plt.show()
-    # print('conv time: ', time.time() - t0)
-    return res
+    # extend array for FFT
+    minimum_pattern_size = 2 * ff
+    if pmt.shape[1] != 1 and pmt.shape[1] < minimum_pattern_size:  # 2D
+        n = minimum_pattern_size // pmt.shape[1]
+        pmt = jnp.repeat(pmt, n+1, axis=1)
+    if pmt.shape[2] < minimum_pattern_size:
+        n = minimum_pattern_size // pmt.shape[2]
+        pmt = jnp.repeat(pmt, n+1, axis=2)
+
+    # all layers at once
+    f_coeffs = jnp.fft.fftshift(jnp.fft.fft2(pmt / (pmt.shape[1] * pmt.shape[2])), axes=(-2, -1))
+    res = gather_conv(f_coeffs, fourier_order)
+
+    return res.astype(type_complex)
 
 
 def circulant(c):
     center = c.shape[0] // 2
-    circ = jnp.zeros((center + 1, center + 1), int)
-
-    for r in range(center+1):
-        idx = jnp.arange(r, r - center - 1, -1)
-        circ = circ.at[r].set(c[center + idx])
+    idx = jnp.arange(center + 1)
 
-    return circ
+    return c[center + idx[:, None] - idx[None, :]]
@@ -1,5 +1,6 @@
 import jax
 import jax.numpy as jnp
+import numpy as np
 
 from functools import partial
 
@@ -51,3 +52,20 @@ def eig_bwd(type_complex, perturbation, res, g):
 
 
 eig.defvjp(eig_fwd, eig_bwd)
+
+
+def homogeneous_layers(ucell):
+    """
+    Which layers of ucell are uniform, from its values before tracing. The solvers take the closed form of those
+    layers from this static description: a traced predicate would become a select under vmap that still runs eig.
+
+    Returns:
+        tuple of bool per layer, or None when ucell is traced (e.g. differentiated): every layer then takes eig.
+    """
+    if ucell is None or isinstance(ucell, jax.core.Tracer):
+        return None
+
+    ucell = np.asarray(ucell)
+    ucell = ucell.reshape(len(ucell), -1)
+
+    return tuple((ucell == ucell[:, :1]).all(axis=1).tolist())
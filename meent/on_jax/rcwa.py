@@ -8,7 +8,9 @@ import numpy as np
 from ._base import _BaseRCWA
 from .convolution_matrix import to_conv_mat, put_permittivity_in_ucell, read_material_table, \
     to_conv_mat_piecewise_constant
-from .field_distribution import field_dist_1d, field_dist_1d_conical, field_dist_2d, field_plot
+from .primitives import homogeneous_layers
+from .field_distribution import field_dist_1d, field_dist_1d_conical, field_dist_2d, field_plot, field_at_points, \
+    interface_flux
 
 
 class RCWAJax(_BaseRCWA):
@@ -34,9 +36,11 @@ class RCWAJax(_BaseRCWA):
         self.layer_info_list = []
 
     def _tree_flatten(self):
-        children = (self.n_I, self.n_II, self.theta, self.phi, self.psi,
-                    self.period, self.wavelength, self.ucell, self.thickness, self.perturbation)
+        # angles back in degrees, as __init__ takes them in _tree_unflatten
+        children = (self.n_I, self.n_II, self.theta * 180 / jnp.pi, self.phi * 180 / jnp.pi, self.psi * 180 / jnp.pi,
+                    self.period, self.wavelength, self.ucell, self.thickness)
         aux_data = {
+            'perturbation': self.perturbation,
             'mode': self.mode,
             'grating_type': self.grating_type,
             'pol': self.pol,
@@ -54,25 +58,30 @@ class RCWAJax(_BaseRCWA):
     def _tree_unflatten(cls, aux_data, children):
         return cls(*children, **aux_data)
 
-    @jax.jit
-    def solve(self, wavelength, e_conv_all, o_e_conv_all):
+    def solve(self, wavelength, e_conv_all, o_e_conv_all, homogeneous_layers=None):
+        # the jitted solve works on a copy of self rebuilt from the pytree, so its layers are kept here
+        de_ri, de_ti, self.layer_info_list, self.T1, self.kx_vector = \
+            self._solve(wavelength, e_conv_all, o_e_conv_all, homogeneous_layers=homogeneous_layers)
+
+        return de_ri, de_ti
+
+    @partial(jax.jit, static_argnames=('homogeneous_layers',))
+    def _solve(self, wavelength, e_conv_all, o_e_conv_all, homogeneous_layers=None):
 
         self.get_kx_vector()
         # self.kx_vector = self.get_kx_vector()
 
         if self.grating_type == 0:
-            de_ri, de_ti, layer_info_list, T1 = self.solve_1d(wavelength, e_conv_all, o_e_conv_all)
+            de_ri, de_ti, layer_info_list, T1 = self.solve_1d(wavelength, e_conv_all, o_e_conv_all, homogeneous_layers)
         elif self.grating_type == 1:
-            de_ri, de_ti, layer_info_list, T1 = self.solve_1d_conical(wavelength, e_conv_all, o_e_conv_all)
+            de_ri, de_ti, layer_info_list, T1 = self.solve_1d_conical(wavelength, e_conv_all, o_e_conv_all,
+                                                                      homogeneous_layers)
         elif self.grating_type == 2:
-            de_ri, de_ti, layer_info_list, T1 = self.solve_2d(wavelength, e_conv_all, o_e_conv_all)
+            de_ri, de_ti, layer_info_list, T1 = self.solve_2d(wavelength, e_conv_all, o_e_conv_all, homogeneous_layers)
         else:
             raise ValueError
 
-        self.layer_info_list = layer_info_list
-        self.T1 = T1
-
-        return de_ri.real, de_ti.real
+        return de_ri.real, de_ti.real, layer_info_list, T1, self.kx_vector
 
     @jax.jit
     def conv_solve(self, ucell):
@@ -90,7 +99,7 @@ class RCWAJax(_BaseRCWA):
         E_conv_all = to_conv_mat_piecewise_constant(ucell, self.fourier_order, type_complex=self.type_complex)
         o_E_conv_all = to_conv_mat_piecewise_constant(1 / ucell, self.fourier_order, type_complex=self.type_complex)
 
-        de_ri, de_ti = self.solve(self.wavelength, E_conv_all, o_E_conv_all)
+        de_ri, de_ti = self.solve(self.wavelength, E_conv_all, o_E_conv_all, homogeneous_layers(self.ucell))
 
         # de_ri, de_ti = self.aaa(ucell)
 
@@ -125,7 +134,8 @@ class RCWAJax(_BaseRCWA):
         b = jnp.array([E_conv_all, E_conv_all1, E_conv_all2, E_conv_all3])
         c = jnp.array([o_E_conv_all, o_E_conv_all1, o_E_conv_all2, o_E_conv_all3])
 
-        de_ri, de_ti = jax.vmap(self.solve)(a, b, c)
+        _solve = partial(self._solve, homogeneous_layers=homogeneous_layers(self.ucell))
+        de_ri, de_ti = jax.vmap(_solve)(a, b, c)[:2]
 
         return de_ri, de_ti
 
@@ -158,32 +168,69 @@ class RCWAJax(_BaseRCWA):
         b = jnp.array([E_conv_all, E_conv_all1, E_conv_all2, E_conv_all3])
         c = jnp.array([o_E_conv_all, o_E_conv_all1, o_E_conv_all2, o_E_conv_all3])
 
-        de_ri, de_ti = jax.pmap(self.solve)(a, b, c)
+        _solve = partial(self._solve, homogeneous_layers=homogeneous_layers(self.ucell))
+        de_ri, de_ti = jax.pmap(_solve)(a, b, c)[:2]
 
         return de_ri, de_ti
 
-    def calculate_field(self, resolution=None, plot=True):
+    def calculate_field(self, resolution=None, plot=True, synthesis='dense', z_step=None, z=None):
+        """
+        Fields of the last run_ucell on a uniform grid in every layer.
+        synthesis is 'dense' (matrix products) or 'fft' (inverse FFT per plane). z_step or z sample z by a step or at
+        given depths through the stack instead of resolution_z per layer, see layer_depths; z may reach into the
+        incidence and transmission half-spaces, negative above the stack and beyond its thickness below it.
+        """
 
         if self.grating_type == 0:
             resolution = [100, 1, 100] if not resolution else resolution
             field_cell = field_dist_1d(self.wavelength, self.kx_vector, self.n_I, self.theta, self.fourier_order, self.T1,
                                        self.layer_info_list, self.period, self.pol, resolution=resolution,
-                                       type_complex=self.type_complex)
+                                       type_complex=self.type_complex, synthesis=synthesis, z_step=z_step, z=z,
+                                       n_II=self.n_II)
         elif self.grating_type == 1:
             resolution = [100, 1, 100] if not resolution else resolution
             field_cell = field_dist_1d_conical(self.wavelength, self.kx_vector, self.n_I, self.theta, self.phi, self.fourier_order, self.T1,
                                                self.layer_info_list, self.period, resolution=resolution,
-                                               type_complex=self.type_complex)
+                                               type_complex=self.type_complex, synthesis=synthesis, z_step=z_step, z=z,
+                                               n_II=self.n_II)
 
         else:
             resolution = [10, 10, 10] if not resolution else resolution
             field_cell = field_dist_2d(self.wavelength, self.kx_vector, self.n_I, self.theta, self.phi, self.fourier_order, self.T1,
                                        self.layer_info_list, self.period, resolution=resolution,
-                                       type_complex=self.type_complex)
+                                       type_complex=self.type_complex, synthesis=synthesis, z_step=z_step, z=z,
+                                       n_II=self.n_II)
         if plot:
             field_plot(field_cell, self.pol)
         return field_cell
 
+    def field_at(self, x, y, z):
+        """
+        Fields of the last run_ucell at the points (x, y, z), broadcast together, computing only the layers that hold
+        them: e.g. a plane under the structure from x and y grids at one z, or a few probe points. See field_at_points.
+        """
+        return field_at_points(self.grating_type, self.wavelength, self.kx_vector, self.n_I, self.theta, self.phi,
+                               self.fourier_order, self.T1, self.layer_info_list, self.period, x, y, z, pol=self.pol,
+                               type_complex=self.type_complex, n_II=self.n_II)
+
+    def flux_at_interfaces(self):
+        """
+        Power flowing down through the top of each layer of the last run_ucell, from the top layer down, and through
+        the bottom of the stack, per unit incident power. Computed from the modal amplitudes on the interfaces, without
+        any field grid; see interface_flux.
+        """
+        return interface_flux(self.grating_type, self.wavelength, self.kx_vector, self.n_I, self.theta, self.phi,
+                              self.fourier_order, self.T1, self.layer_info_list, self.period, pol=self.pol,
+                              type_complex=self.type_complex)
+
+    def absorption_per_layer(self):
+        """
+        Fraction of the incident power absorbed in each layer of the last run_ucell, from the top layer down: the
+        difference of the fluxes through its top and bottom. They add up to 1 - sum(de_ri) - sum(de_ti).
+        """
+        flux = self.flux_at_interfaces()
+        return flux[:-1] - flux[1:]
+
 
 if __name__ == '__main__':
     pass
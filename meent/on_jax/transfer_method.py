@@ -3,11 +3,41 @@ from functools import partial
 
 import jax
 import jax.numpy as jnp
+import numpy as np
 
 # import meent.on_jax.jitted as ee
 # from . import jitted as ee
 from .primitives import eig
 
+# Diagonal operators (Kx, Ky, Y_I, Z_I, X, F_c, F_s, ...) are carried as their diagonals
+# and applied by broadcasting: diag(d) @ m == d[:, None] * m and m @ diag(d) == m * d[None, :].
+
+
+def solve_right(a, *b_list):
+    # b @ a^-1 for every b in b_list, sharing one LU factorization of a
+    b = jnp.concatenate(b_list, axis=0)
+    x = jnp.linalg.solve(a.T, b.T).T
+
+    return jnp.split(x, np.cumsum([b.shape[0] for b in b_list])[:-1], axis=0)
+
+
+def solve_left(a, b, a_i=None):
+    # a^-1 @ b without forming the inverse, unless it is already known (e.g. in closed form)
+    if a_i is not None:
+        return a_i @ b
+    return jnp.linalg.solve(a, b)
+
+
+def block_diag(a, b, c, d):
+    # [[diag(a), diag(b)], [diag(c), diag(d)]]
+    return jnp.block([[jnp.diag(a), jnp.diag(b)], [jnp.diag(c), jnp.diag(d)]])
+
+
+def block_diag_inv(a, b, c, d):
+    # inverse of block_diag(a, b, c, d) in closed form
+    det = a * d - b * c
+    return block_diag(d / det, -b / det, -c / det, a / det)
+
 
 def transfer_1d_1(ff, polarization, k0, n_I, n_II, kx_vector, theta, delta_i0, fourier_order,
                   type_complex=jnp.complex128):
@@ -20,24 +50,24 @@ def transfer_1d_1(ff, polarization, k0, n_I, n_II, kx_vector, theta, delta_i0, f
     k_I_z = k_I_z.conjugate()
     k_II_z = k_II_z.conjugate()
 
-    Kx = jnp.diag(kx_vector / k0)
+    Kx = kx_vector / k0
 
     f = jnp.eye(ff).astype(type_complex)
 
     if polarization == 0:  # TE
-        Y_I = jnp.diag(k_I_z / k0)
-        Y_II = jnp.diag(k_II_z / k0)
+        Y_I = k_I_z / k0
+        Y_II = k_II_z / k0
 
         YZ_I = Y_I
-        g = 1j * Y_II
+        g = jnp.diag(1j * Y_II)
         inc_term = 1j * n_I * jnp.cos(theta) * delta_i0
 
     elif polarization == 1:  # TM
-        Z_I = jnp.diag(k_I_z / (k0 * n_I ** 2))
-        Z_II = jnp.diag(k_II_z / (k0 * n_II ** 2))
+        Z_I = k_I_z / (k0 * n_I ** 2)
+        Z_II = k_II_z / (k0 * n_II ** 2)
 
         YZ_I = Z_I
-        g = 1j * Z_II
+        g = jnp.diag(1j * Z_II)
         inc_term = 1j * delta_i0 * jnp.cos(theta) / n_I
 
     else:
@@ -48,28 +78,52 @@ def transfer_1d_1(ff, polarization, k0, n_I, n_II, kx_vector, theta, delta_i0, f
     return kx_vector, Kx, k_I_z, k_II_z, Kx, f, YZ_I, g, inc_term, T
 
 
-def transfer_1d_2(k0, q, d, W, V, f, g, fourier_order, T, type_complex=jnp.complex128):
+def transfer_1d_wv_homogeneous(polarization, Kx, eps, type_complex=jnp.complex128):
+    # uniform layer: A (or o_E_conv_i @ B) is diagonal, so W = I and q is known
+
+    q = (Kx ** 2 - eps) ** 0.5
+    W = jnp.eye(len(q), dtype=type_complex)
+
+    if polarization == 0:
+        E_conv_i = None
+        V = jnp.diag(q)
+        V_i = jnp.diag(1 / q)
+
+    elif polarization == 1:
+        E_conv_i = jnp.diag(jnp.ones_like(q) / eps)
+        V = jnp.diag(q / eps)
+        V_i = jnp.diag(eps / q)
+
+    else:
+        raise ValueError
+
+    return E_conv_i, q, W, V, W, V_i
+
 
-    X = jnp.diag(jnp.exp(-k0 * q * d))
+def transfer_1d_2(k0, q, d, W, V, f, g, fourier_order, T, type_complex=jnp.complex128, W_i=None, V_i=None):
 
-    W_i = jnp.linalg.inv(W)
-    V_i = jnp.linalg.inv(V)
+    X = jnp.exp(-k0 * q * d)
 
-    a = 0.5 * (W_i @ f + V_i @ g)
-    b = 0.5 * (W_i @ f - V_i @ g)
+    W_i_f = solve_left(W, f, W_i)
+    V_i_g = solve_left(V, g, V_i)
 
-    a_i = jnp.linalg.inv(a)
+    a = 0.5 * (W_i_f + V_i_g)
+    b = 0.5 * (W_i_f - V_i_g)
 
-    f = W @ (jnp.eye(2 * fourier_order + 1).astype(type_complex) + X @ b @ a_i @ X)
-    g = V @ (jnp.eye(2 * fourier_order + 1).astype(type_complex) - X @ b @ a_i @ X)
-    T = T @ a_i @ X
+    b_a_i, T_a_i = solve_right(a, b, T)
 
-    return X, f, g, T, a_i, b
+    X_b_a_i_X = X[:, None] * b_a_i * X[None, :]
+
+    f = W @ (jnp.eye(2 * fourier_order + 1).astype(type_complex) + X_b_a_i_X)
+    g = V @ (jnp.eye(2 * fourier_order + 1).astype(type_complex) - X_b_a_i_X)
+    T = T_a_i * X[None, :]
+
+    return X, f, g, T, a, b
 
 
 def transfer_1d_3(g, YZ_I, f, delta_i0, inc_term, T, k_I_z, k0, n_I, n_II, theta, polarization, k_II_z):
 
-    T1 = jnp.linalg.inv(g + 1j * YZ_I @ f) @ (1j * YZ_I @ delta_i0 + inc_term)
+    T1 = jnp.linalg.solve(g + 1j * YZ_I[:, None] * f, 1j * YZ_I * delta_i0 + inc_term)
     R = f @ T1 - delta_i0
     T = T @ T1
 
@@ -102,86 +156,122 @@ def transfer_1d_conical_1(ff, k0, n_I, n_II, kx_vector, theta, phi, type_complex
     k_I_z = k_I_z.conjugate()
     k_II_z = k_II_z.conjugate()
 
-    Kx = jnp.diag(kx_vector / k0)
+    Kx = kx_vector / k0
     varphi = jnp.arctan(ky / kx_vector)
 
-    Y_I = jnp.diag(k_I_z / k0)
-    Y_II = jnp.diag(k_II_z / k0)
+    Y_I = k_I_z / k0
+    Y_II = k_II_z / k0
 
-    Z_I = jnp.diag(k_I_z / (k0 * n_I ** 2))
-    Z_II = jnp.diag(k_II_z / (k0 * n_II ** 2))
+    Z_I = k_I_z / (k0 * n_I ** 2)
+    Z_II = k_II_z / (k0 * n_II ** 2)
 
-    big_F = jnp.block([[I, O], [O, 1j * Z_II]])
-    big_G = jnp.block([[1j * Y_II, O], [O, I]])
+    big_F = jnp.block([[I, O], [O, jnp.diag(1j * Z_II)]])
+    big_G = jnp.block([[jnp.diag(1j * Y_II), O], [O, I]])
 
     big_T = jnp.eye(2 * ff).astype(type_complex)
 
     return Kx, ky, k_I_z, k_II_z, varphi, Y_I, Y_II, Z_I, Z_II, big_F, big_G, big_T
 
 
-def transfer_1d_conical_2(k0, Kx, ky, E_conv, E_conv_i, o_E_conv_i, ff, d, varphi, big_F, big_G, big_T,
-                          type_complex=jnp.complex128, perturbation=1E-10):
+def transfer_1d_conical_wv(k0, Kx, ky, E_conv, o_E_conv, ff, varphi, type_complex=jnp.complex128,
+                           perturbation=1E-10):
 
     I = jnp.eye(ff).astype(type_complex)
-    O = jnp.zeros((ff, ff)).astype(type_complex)
 
-    A = Kx ** 2 - E_conv
-    B = Kx @ E_conv_i @ Kx - I
-    A_i = jnp.linalg.inv(A)
-    B_i = jnp.linalg.inv(B)
+    E_conv_i = jnp.linalg.inv(E_conv)
+    o_E_conv_i = jnp.linalg.inv(o_E_conv)
+
+    A = jnp.diag(Kx ** 2) - E_conv
+    B = Kx[:, None] * E_conv_i * Kx[None, :] - I
 
     to_decompose_W_1 = ky ** 2 * I + A
     to_decompose_W_2 = ky ** 2 * I + B @ o_E_conv_i
 
-    # TODO: separate to an independent func (like 2D case).
     eigenvalues_1, W_1 = eig(to_decompose_W_1, type_complex=type_complex, perturbation=perturbation)
     eigenvalues_2, W_2 = eig(to_decompose_W_2, type_complex=type_complex, perturbation=perturbation)
 
     q_1 = eigenvalues_1 ** 0.5
     q_2 = eigenvalues_2 ** 0.5
 
-    Q_1 = jnp.diag(q_1)
-    Q_2 = jnp.diag(q_2)
-
-    V_11 = A_i @ W_1 @ Q_1
-    V_12 = (ky / k0) * A_i @ Kx @ W_2
-    V_21 = (ky / k0) * B_i @ Kx @ E_conv_i @ W_1
-    V_22 = B_i @ W_2 @ Q_2
+    # one factorization of A and of B each, for two right-hand sides
+    A_i_rhs = jnp.linalg.solve(A, jnp.hstack([W_1 * q_1[None, :], Kx[:, None] * W_2]))
+    B_i_rhs = jnp.linalg.solve(B, jnp.hstack([Kx[:, None] * (E_conv_i @ W_1), W_2 * q_2[None, :]]))
 
-    X_1 = jnp.diag(jnp.exp(-k0 * q_1 * d))
-    X_2 = jnp.diag(jnp.exp(-k0 * q_2 * d))
+    V_11 = A_i_rhs[:, :ff]
+    V_12 = (ky / k0) * A_i_rhs[:, ff:]
+    V_21 = (ky / k0) * B_i_rhs[:, :ff]
+    V_22 = B_i_rhs[:, ff:]
 
-    F_c = jnp.diag(jnp.cos(varphi))
-    F_s = jnp.diag(jnp.sin(varphi))
+    F_c = jnp.cos(varphi)[:, None]
+    F_s = jnp.sin(varphi)[:, None]
 
-    V_ss = F_c @ V_11
-    V_sp = F_c @ V_12 - F_s @ W_2
-    W_ss = F_c @ W_1 + F_s @ V_21
-    W_sp = F_s @ V_22
-    W_ps = F_s @ V_11
-    W_pp = F_c @ W_2 + F_s @ V_12
-    V_ps = F_c @ V_21 - F_s @ W_1
-    V_pp = F_c @ V_22
+    V_ss = F_c * V_11
+    V_sp = F_c * V_12 - F_s * W_2
+    W_ss = F_c * W_1 + F_s * V_21
+    W_sp = F_s * V_22
+    W_ps = F_s * V_11
+    W_pp = F_c * W_2 + F_s * V_12
+    V_ps = F_c * V_21 - F_s * W_1
+    V_pp = F_c * V_22
 
-    big_I = jnp.eye(2 * (len(I))).astype(type_complex)
-    big_X = jnp.block([[X_1, O], [O, X_2]])
     big_W = jnp.block([[V_ss, V_sp], [W_ps, W_pp]])
     big_V = jnp.block([[W_ss, W_sp], [V_ps, V_pp]])
 
-    big_W_i = jnp.linalg.inv(big_W)
-    big_V_i = jnp.linalg.inv(big_V)
+    # big_W and big_V are factorized in the cascade (transfer_1d_conical_2)
+    big_W_i = None
+    big_V_i = None
+
+    return E_conv_i, q_1, q_2, W_1, W_2, V_11, V_12, V_21, V_22, big_W, big_V, big_W_i, big_V_i
 
-    big_A = 0.5 * (big_W_i @ big_F + big_V_i @ big_G)
-    big_B = 0.5 * (big_W_i @ big_F - big_V_i @ big_G)
 
-    big_A_i = jnp.linalg.inv(big_A)
+def transfer_1d_conical_wv_homogeneous(k0, Kx, ky, eps, varphi):
+    # uniform layer: every block is diagonal, so the modes and the inverses are elementwise
 
-    big_F = big_W @ (big_I + big_X @ big_B @ big_A_i @ big_X)
-    big_G = big_V @ (big_I - big_X @ big_B @ big_A_i @ big_X)
+    kx = Kx
+    a = kx ** 2 - eps
+    b = kx ** 2 / eps - 1
 
-    big_T = big_T @ big_A_i @ big_X
+    q = (ky ** 2 + a) ** 0.5
+    one = jnp.ones_like(q)
 
-    return big_X, big_F, big_G, big_T, big_A_i, big_B, W_1, W_2, V_11, V_12, V_21, V_22, q_1, q_2
+    v_11 = q / a
+    v_12 = (ky / k0) * kx / a
+    v_21 = (ky / k0) * kx / (eps * b)
+    v_22 = q / b
+
+    c = jnp.cos(varphi)
+    s = jnp.sin(varphi)
+
+    big_W_diag = (c * v_11, c * v_12 - s, s * v_11, c + s * v_12)
+    big_V_diag = (c + s * v_21, s * v_22, c * v_21 - s, c * v_22)
+
+    return jnp.diag(one / eps), q, q, jnp.diag(one), jnp.diag(one), \
+        jnp.diag(v_11), jnp.diag(v_12), jnp.diag(v_21), jnp.diag(v_22), \
+        block_diag(*big_W_diag), block_diag(*big_V_diag), block_diag_inv(*big_W_diag), block_diag_inv(*big_V_diag)
+
+
+def transfer_1d_conical_2(k0, d, q_1, q_2, big_W, big_V, big_W_i, big_V_i, ff, big_F, big_G, big_T,
+                          type_complex=jnp.complex128):
+
+    big_I = jnp.eye(2 * ff).astype(type_complex)
+    big_X = jnp.exp(-k0 * jnp.concatenate([q_1, q_2]) * d)
+
+    big_W_i_F = solve_left(big_W, big_F, big_W_i)
+    big_V_i_G = solve_left(big_V, big_G, big_V_i)
+
+    big_A = 0.5 * (big_W_i_F + big_V_i_G)
+    big_B = 0.5 * (big_W_i_F - big_V_i_G)
+
+    big_B_A_i, big_T_A_i = solve_right(big_A, big_B, big_T)
+
+    big_X_B_A_i_X = big_X[:, None] * big_B_A_i * big_X[None, :]
+
+    big_F = big_W @ (big_I + big_X_B_A_i_X)
+    big_G = big_V @ (big_I - big_X_B_A_i_X)
+
+    big_T = big_T_A_i * big_X[None, :]
+
+    return big_X, big_F, big_G, big_T, big_A, big_B
 
 
 def transfer_1d_conical_3(big_F, big_G, big_T, Z_I, Y_I, psi, theta, ff, delta_i0, k_I_z, k0, n_I, n_II, k_II_z,
@@ -204,21 +294,21 @@ def transfer_1d_conical_3(big_F, big_G, big_T, Z_I, Y_I, psi, theta, ff, delta_i
     final_A = jnp.block(
         [
             [I, O, -big_F_11, -big_F_12],
-            [O, -1j * Z_I, -big_F_21, -big_F_22],
-            [-1j * Y_I, O, -big_G_11, -big_G_12],
+            [O, jnp.diag(-1j * Z_I), -big_F_21, -big_F_22],
+            [jnp.diag(-1j * Y_I), O, -big_G_11, -big_G_12],
             [O, I, -big_G_21, -big_G_22],
         ]
     )
 
     # tODO: correct?
     final_B = jnp.hstack([
-        [-jnp.sin(psi) * delta_i0],
-        [-jnp.cos(psi) * jnp.cos(theta) * delta_i0],
-        [-1j * jnp.sin(psi) * n_I * jnp.cos(theta) * delta_i0],
-        [1j * n_I * jnp.cos(psi) * delta_i0]
-    ]).T
+        -jnp.sin(psi) * delta_i0,
+        -jnp.cos(psi) * jnp.cos(theta) * delta_i0,
+        -1j * jnp.sin(psi) * n_I * jnp.cos(theta) * delta_i0,
+        1j * n_I * jnp.cos(psi) * delta_i0
+    ])[:, None]
 
-    final_RT = jnp.linalg.inv(final_A) @ final_B
+    final_RT = jnp.linalg.solve(final_A, final_B)
 
     R_s = final_RT[:ff, :].flatten()
     R_p = final_RT[ff:2 * ff, :].flatten()
@@ -256,19 +346,19 @@ def transfer_2d_1(ff, k0, n_I, n_II, kx_vector, period, fourier_indices, theta,
     k_I_z = k_I_z.flatten().conjugate()
     k_II_z = k_II_z.flatten().conjugate()
 
-    Kx = jnp.diag(jnp.tile(kx_vector, ff).flatten()) / k0
-    Ky = jnp.diag(jnp.tile(ky_vector.reshape((-1, 1)), ff).flatten()) / k0
+    Kx = jnp.tile(kx_vector, ff).flatten() / k0
+    Ky = jnp.tile(ky_vector.reshape((-1, 1)), ff).flatten() / k0
 
     varphi = jnp.arctan(ky_vector.reshape((-1, 1)) / kx_vector).flatten()
 
-    Y_I = jnp.diag(k_I_z / k0)
-    Y_II = jnp.diag(k_II_z / k0)
+    Y_I = k_I_z / k0
+    Y_II = k_II_z / k0
 
-    Z_I = jnp.diag(k_I_z / (k0 * n_I ** 2))
-    Z_II = jnp.diag(k_II_z / (k0 * n_II ** 2))
+    Z_I = k_I_z / (k0 * n_I ** 2)
+    Z_II = k_II_z / (k0 * n_II ** 2)
 
-    big_F = jnp.block([[I, O], [O, 1j * Z_II]])
-    big_G = jnp.block([[1j * Y_II, O], [O, I]])
+    big_F = jnp.block([[I, O], [O, jnp.diag(1j * Z_II)]])
+    big_G = jnp.block([[jnp.diag(1j * Y_II), O], [O, I]])
 
     big_T = jnp.eye(ff ** 2 * 2).astype(type_complex)
 
@@ -279,36 +369,63 @@ def transfer_2d_wv(ff, Kx, E_conv_i, Ky, o_E_conv_i, E_conv, type_complex=jnp.co
 
     I = jnp.eye(ff ** 2).astype(type_complex)
 
-    B = Kx @ E_conv_i @ Kx - I
-    D = Ky @ E_conv_i @ Ky - I
+    Kx_c, Kx_r = Kx[:, None], Kx[None, :]
+    Ky_c, Ky_r = Ky[:, None], Ky[None, :]
+
+    B = Kx_c * E_conv_i * Kx_r - I
+    D = Ky_c * E_conv_i * Ky_r - I
 
     S2_from_S = jnp.block(
         [
-            [Ky ** 2 + B @ o_E_conv_i, Kx @ (E_conv_i @ Ky @ E_conv - Ky)],
-            [Ky @ (E_conv_i @ Kx @ o_E_conv_i - Kx), Kx ** 2 + D @ E_conv]
+            [jnp.diag(Ky ** 2) + B @ o_E_conv_i, Kx_c * ((E_conv_i * Ky_r) @ E_conv - jnp.diag(Ky))],
+            [Ky_c * ((E_conv_i * Kx_r) @ o_E_conv_i - jnp.diag(Kx)), jnp.diag(Kx ** 2) + D @ E_conv]
         ])
 
     eigenvalues, W = eig(S2_from_S, type_complex=type_complex, perturbation=perturbation)
 
     q = eigenvalues ** 0.5
 
-    Q = jnp.diag(q)
-    Q_i = jnp.linalg.inv(Q)
     U1_from_S = jnp.block(
         [
-            [-Kx @ Ky, Kx ** 2 - E_conv],
-            [o_E_conv_i - Ky ** 2, Ky @ Kx]
+            [jnp.diag(-Kx * Ky), jnp.diag(Kx ** 2) - E_conv],
+            [o_E_conv_i - jnp.diag(Ky ** 2), jnp.diag(Ky * Kx)]
         ]
     )
-    V = U1_from_S @ W @ Q_i
+    V = U1_from_S @ W / q[None, :]
 
     return W, V, q
 
 
-def transfer_2d_2(k0, d, W, V, center, q, varphi, I, O, big_F, big_G, big_T, type_complex=jnp.complex128):
+def transfer_2d_wv_homogeneous(Kx, Ky, eps, varphi, type_complex=jnp.complex128):
+    # uniform layer: S2_from_S is diagonal, so W = I, V is made of diagonal blocks
+    # and so are big_W and big_V, whose inverses are elementwise
+
+    kx = Kx
+    ky = Ky
+
+    q_half = (kx ** 2 + ky ** 2 - eps) ** 0.5
+    q = jnp.concatenate([q_half, q_half])
+    one = jnp.ones_like(q_half)
+
+    v_11 = -kx * ky / q_half
+    v_12 = (kx ** 2 - eps) / q_half
+    v_21 = (eps - ky ** 2) / q_half
+    v_22 = kx * ky / q_half
+
+    c = jnp.cos(varphi)
+    s = jnp.sin(varphi)
 
-    q1 = q[:center]
-    q2 = q[center:]
+    big_W_diag = (-s, c, c, s)
+    big_V_diag = (c * v_11 + s * v_21, c * v_12 + s * v_22, c * v_21 - s * v_11, c * v_22 - s * v_12)
+
+    W = jnp.eye(2 * len(q_half), dtype=type_complex)
+    V = block_diag(v_11, v_12, v_21, v_22)
+
+    return jnp.diag(one / eps), q, W, V, block_diag_inv(*big_W_diag), block_diag_inv(*big_V_diag)
+
+
+def transfer_2d_2(k0, d, W, V, center, q, varphi, big_F, big_G, big_T, type_complex=jnp.complex128,
+                  big_W_i=None, big_V_i=None):
 
     W_11 = W[:center, :center]
     W_12 = W[:center, center:]
@@ -320,41 +437,40 @@ def transfer_2d_2(k0, d, W, V, center, q, varphi, I, O, big_F, big_G, big_T, typ
     V_21 = V[center:, :center]
     V_22 = V[center:, center:]
 
-    X_1 = jnp.diag(jnp.exp(-k0 * q1 * d))
-    X_2 = jnp.diag(jnp.exp(-k0 * q2 * d))
-
-    F_c = jnp.diag(jnp.cos(varphi))
-    F_s = jnp.diag(jnp.sin(varphi))
+    F_c = jnp.cos(varphi)[:, None]
+    F_s = jnp.sin(varphi)[:, None]
 
-    W_ss = F_c @ W_21 - F_s @ W_11
-    W_sp = F_c @ W_22 - F_s @ W_12
-    W_ps = F_c @ W_11 + F_s @ W_21
-    W_pp = F_c @ W_12 + F_s @ W_22
+    W_ss = F_c * W_21 - F_s * W_11
+    W_sp = F_c * W_22 - F_s * W_12
+    W_ps = F_c * W_11 + F_s * W_21
+    W_pp = F_c * W_12 + F_s * W_22
 
-    V_ss = F_c @ V_11 + F_s @ V_21
-    V_sp = F_c @ V_12 + F_s @ V_22
-    V_ps = F_c @ V_21 - F_s @ V_11
-    V_pp = F_c @ V_22 - F_s @ V_12
+    V_ss = F_c * V_11 + F_s * V_21
+    V_sp = F_c * V_12 + F_s * V_22
+    V_ps = F_c * V_21 - F_s * V_11
+    V_pp = F_c * V_22 - F_s * V_12
 
-    big_I = jnp.eye(2 * (len(I))).astype(type_complex)
-    big_X = jnp.block([[X_1, O], [O, X_2]])
+    big_I = jnp.eye(2 * center).astype(type_complex)
+    big_X = jnp.exp(-k0 * q * d)
     big_W = jnp.block([[W_ss, W_sp], [W_ps, W_pp]])
     big_V = jnp.block([[V_ss, V_sp], [V_ps, V_pp]])
 
-    big_W_i = jnp.linalg.inv(big_W)
-    big_V_i = jnp.linalg.inv(big_V)
+    big_W_i_F = solve_left(big_W, big_F, big_W_i)
+    big_V_i_G = solve_left(big_V, big_G, big_V_i)
+
+    big_A = 0.5 * (big_W_i_F + big_V_i_G)
+    big_B = 0.5 * (big_W_i_F - big_V_i_G)
 
-    big_A = 0.5 * (big_W_i @ big_F + big_V_i @ big_G)
-    big_B = 0.5 * (big_W_i @ big_F - big_V_i @ big_G)
+    big_B_A_i, big_T_A_i = solve_right(big_A, big_B, big_T)
 
-    big_A_i = jnp.linalg.inv(big_A)
+    big_X_B_A_i_X = big_X[:, None] * big_B_A_i * big_X[None, :]
 
-    big_F = big_W @ (big_I + big_X @ big_B @ big_A_i @ big_X)
-    big_G = big_V @ (big_I - big_X @ big_B @ big_A_i @ big_X)
+    big_F = big_W @ (big_I + big_X_B_A_i_X)
+    big_G = big_V @ (big_I - big_X_B_A_i_X)
 
-    big_T = big_T @ big_A_i @ big_X
+    big_T = big_T_A_i * big_X[None, :]
 
-    return big_X, big_F, big_G, big_T, big_A_i, big_B, W_11, W_12, W_21, W_22, V_11, V_12, V_21, V_22
+    return big_X, big_F, big_G, big_T, big_A, big_B, W_11, W_12, W_21, W_22, V_11, V_12, V_21, V_22
 
 
 def transfer_2d_3(center, big_F, big_G, big_T, Z_I, Y_I, psi, theta, ff, delta_i0, k_I_z, k0, n_I, n_II, k_II_z,
@@ -377,8 +493,8 @@ def transfer_2d_3(center, big_F, big_G, big_T, Z_I, Y_I, psi, theta, ff, delta_i
     final_A = jnp.block(
         [
             [I, O, -big_F_11, -big_F_12],
-            [O, -1j * Z_I, -big_F_21, -big_F_22],
-            [-1j * Y_I, O, -big_G_11, -big_G_12],
+            [O, jnp.diag(-1j * Z_I), -big_F_21, -big_F_22],
+            [jnp.diag(-1j * Y_I), O, -big_G_11, -big_G_12],
             [O, I, -big_G_21, -big_G_22],
         ]
     )
@@ -392,7 +508,7 @@ def transfer_2d_3(center, big_F, big_G, big_T, Z_I, Y_I, psi, theta, ff, delta_i
         ]
     )
 
-    final_RT = jnp.linalg.inv(final_A) @ final_B
+    final_RT = jnp.linalg.solve(final_A, final_B)
 
     R_s = final_RT[:ff ** 2, :].flatten()
     R_p = final_RT[ff ** 2:2 * ff ** 2, :].flatten()
@@ -4,15 +4,20 @@ from copy import deepcopy
 
 from .scattering_method import scattering_1d_1, scattering_1d_2, scattering_1d_3, scattering_2d_1, scattering_2d_wv, \
     scattering_2d_2, scattering_2d_3
-from .transfer_method import transfer_1d_1, transfer_1d_2, transfer_1d_3, transfer_1d_conical_1, transfer_1d_conical_2, \
-    transfer_1d_conical_3, transfer_2d_1, transfer_2d_wv, transfer_2d_2, transfer_2d_3
+from .transfer_method import transfer_1d_1, transfer_1d_wv, transfer_1d_wv_homogeneous, transfer_1d_2, transfer_1d_3, \
+    transfer_1d_conical_1, transfer_1d_conical_wv, transfer_1d_conical_wv_homogeneous, transfer_1d_conical_2, \
+    transfer_1d_conical_3, transfer_2d_1, transfer_2d_wv, transfer_2d_wv_homogeneous, transfer_2d_big_wv, \
+    transfer_2d_2, transfer_2d_3, diag, homogeneous_permittivity
+from .convolution_matrix import fourier_orders_2d
+from .symmetry import incidence_mirrors, find_mirror_symmetry, mirror_sector_bases, symmetrize_k
 
 
 class _BaseRCWA:
     def __init__(self, grating_type, n_I=1., n_II=1., theta=0., phi=0., psi=0., fourier_order=10,
                  period=0.7, wavelength=np.linspace(0.5, 2.3, 400), pol=0,
                  patterns=None, ucell=None, ucell_materials=None, thickness=None, algo='TMM', perturbation=1E-10,
-                 device='cpu', type_complex=np.complex128):
+                 device='cpu', type_complex=np.complex128, layer_cache=None, mirror_symmetry=None, truncation=None,
+                 factorization=None, keep_cascade=False):
 
         self.device = device
         self.type_complex = type_complex
@@ -34,8 +39,19 @@ class _BaseRCWA:
             print('not implemented yet')
             raise ValueError
 
+        # 2D: fourier_order may be (Nx, Ny), and truncation='circular' drops the harmonics outside the ellipse
         self.fourier_order = fourier_order
-        self.ff = 2 * self.fourier_order + 1
+        self.truncation = truncation
+        self.fourier_order_x, self.fourier_order_y = (int(n) for n in np.broadcast_to(fourier_order, (2,)))
+        self.ff = 2 * self.fourier_order_x + 1
+        self.ff_y = 2 * self.fourier_order_y + 1
+
+        self.orders = fourier_orders_2d(fourier_order, truncation) if grating_type == 2 else None
+
+        # 2D permittivity factorization: None for the fixed rule, 'normal_vector' for Li's rules along the boundaries
+        if factorization not in (None, 'normal_vector'):
+            raise ValueError
+        self.factorization = factorization
 
         self.period = deepcopy(period)
 
@@ -51,13 +67,27 @@ class _BaseRCWA:
 
         self.layer_info_list = []
         self.T1 = None
+        self.amplitudes = None
+
+        # per layer: cascade state at its lower boundary and its modes, for update_layer. Several matrices of the
+        # size of the system per layer, so only kept when asked for; update_layer turns it on
+        self.keep_cascade = keep_cascade
+        self.cascade_states = []
+        self.layer_modes = []
 
         self.kx_vector = None
 
+        self.layer_cache = layer_cache
+
+        # mirror planes ('x', 'y') to look for in 2D layers; True for both. Off by default.
+        if mirror_symmetry is True:
+            mirror_symmetry = ('x', 'y')
+        self.mirror_symmetry = tuple(mirror_symmetry) if mirror_symmetry else ()
+
     def get_kx_vector(self):
 
         k0 = 2 * np.pi / self.wavelength
-        fourier_indices = np.arange(-self.fourier_order, self.fourier_order + 1)
+        fourier_indices = np.arange(-self.fourier_order_x, self.fourier_order_x + 1)
         if self.grating_type == 0:
             kx_vector = k0 * (self.n_I * np.sin(self.theta) - fourier_indices * (self.wavelength / self.period[0])
                               ).astype(self.type_complex)
@@ -66,17 +96,45 @@ class _BaseRCWA:
                     self.wavelength / self.period[0])
                               ).astype(self.type_complex)
 
-        idx = np.nonzero(kx_vector == 0)[0]
-        if len(idx):
-            # TODO: need imaginary part?
-            # TODO: make imaginary part sign consistent
-            kx_vector[idx] = self.perturbation
+        # TODO: need imaginary part?
+        # TODO: make imaginary part sign consistent
+        kx_vector = np.where(kx_vector == 0, self.perturbation, kx_vector)
 
         self.kx_vector = kx_vector
 
-    def solve_1d(self, wl, E_conv_all, o_E_conv_all):
+    def get_layer_modes(self, modes_fn, *key_items):
+        # eigenmodes depend only on key_items; reuse them across layers, runs and designs if cached
+        if self.layer_cache is None:
+            return modes_fn()
+
+        key = self.layer_cache.make_key(self.grating_type, self.type_complex, *key_items)
+        modes = self.layer_cache.get(key)
+        if modes is None:
+            modes = modes_fn()
+            self.layer_cache.put(key, modes)
+
+        return modes
+
+    def cascade_layers(self, count, update_layer=None):
+        """
+        Layers to run, from the last one. The cascade runs upward, so when only layer update_layer has changed
+        the layers below it are skipped: the cascade restarts from the state kept at its lower boundary.
+        """
+        if update_layer is None:
+            self.layer_info_list = []
+            self.cascade_states = [None] * count if self.keep_cascade else []
+            self.layer_modes = [None] * count if self.keep_cascade else []
+            return range(count)[::-1]
+
+        if not 0 <= update_layer < len(self.cascade_states):
+            raise ValueError('update_layer needs a previous solve of all layers')
+
+        # layer_info_list runs from the last layer
+        self.layer_info_list = self.layer_info_list[:count - 1 - update_layer]
+        return range(update_layer + 1)[::-1]
+
+    def solve_1d(self, wl, E_conv_all, o_E_conv_all, update_layer=None):
 
-        self.layer_info_list = []
         self.T1 = None
 
         fourier_indices = np.arange(-self.fourier_order, self.fourier_order + 1)
@@ -94,50 +152,49 @@ class _BaseRCWA:
             Kx, Wg, Vg, Kzg, Wr, Vr, Kzr, Wt, Vt, Kzt, Ar, Br, Sg \
                 = scattering_1d_1(k0, self.n_I, self.n_II, self.theta, self.phi, fourier_indices, self.period,
                                   self.pol, wl=wl)
+            Kx = np.diag(Kx)  # the modal functions take the diagonal
         else:
             raise ValueError
 
         count = min(len(E_conv_all), len(o_E_conv_all), len(self.thickness))
 
+        layers = self.cascade_layers(count, update_layer)
+        if update_layer is not None:
+            f, g, T = self.cascade_states[update_layer]
+
         # From the last layer
-        for layer_index in range(count)[::-1]:
+        for layer_index in layers:
 
             E_conv = E_conv_all[layer_index]
             o_E_conv = o_E_conv_all[layer_index]
             d = self.thickness[layer_index]
 
-            if self.pol == 0:
-                E_conv_i = None
-                A = Kx ** 2 - E_conv
-                eigenvalues, W = np.linalg.eig(A)
-                q = eigenvalues ** 0.5
-
-                Q = np.diag(q)
-                V = W @ Q
-
-            elif self.pol == 1:
-                E_conv_i = np.linalg.inv(E_conv)
-                B = Kx @ E_conv_i @ Kx - np.eye(E_conv.shape[0], dtype=self.type_complex)
-                o_E_conv_i = np.linalg.inv(o_E_conv)
-
-                eigenvalues, W = np.linalg.eig(o_E_conv_i @ B)
-                q = eigenvalues ** 0.5
-
-                Q = np.diag(q)
-                V = o_E_conv @ W @ Q
-
+            if update_layer is not None and layer_index < update_layer:
+                # above the updated layer: same modes, only the cascade step is redone
+                modes = self.layer_modes[layer_index]
             else:
-                raise ValueError
+                eps = homogeneous_permittivity(E_conv, o_E_conv)
+                if eps is not None:
+                    modes = transfer_1d_wv_homogeneous(self.pol, Kx, eps)
+                else:
+                    modes = self.get_layer_modes(
+                        lambda: transfer_1d_wv(self.pol, Kx, E_conv, o_E_conv, type_complex=self.type_complex),
+                        self.pol, Kx, E_conv, o_E_conv)
+                if self.keep_cascade:
+                    self.layer_modes[layer_index] = modes
+            E_conv_i, q, W, V, W_i, V_i = modes
 
             if self.algo == 'TMM':
-                X, f, g, T, a_i, b = transfer_1d_2(k0, q, d, W, V, f, g, self.fourier_order, T,
+                if self.keep_cascade:
+                    self.cascade_states[layer_index] = f, g, T
+                X, f, g, T, a, b = transfer_1d_2(k0, q, d, W, V, W_i, V_i, f, g, self.fourier_order, T,
                                                    type_complex=self.type_complex)
 
-                layer_info = [E_conv_i, q, W, X, a_i, b, d]
+                layer_info = [E_conv_i, q, W, X, a, b, d]
                 self.layer_info_list.append(layer_info)
 
             elif self.algo == 'SMM':
-                A, B, S_dict, Sg = scattering_1d_2(W, Wg, V, Vg, d, k0, Q, Sg)
+                A, B, S_dict, Sg = scattering_1d_2(W, Wg, V, Vg, d, k0, diag(q), Sg)
             else:
                 raise ValueError
 
@@ -155,10 +212,10 @@ class _BaseRCWA:
         return de_ri, de_ti
 
     # TODO: scattering method
-    def solve_1d_conical(self, wl, E_conv_all, o_E_conv_all):
+    def solve_1d_conical(self, wl, E_conv_all, o_E_conv_all, jones=None, update_layer=None):
 
-        self.layer_info_list = []
         self.T1 = None
+        self.amplitudes = None
 
         # fourier_indices = np.arange(-self.fourier_order, self.fourier_order + 1)
 
@@ -179,22 +236,40 @@ class _BaseRCWA:
 
         count = min(len(E_conv_all), len(o_E_conv_all), len(self.thickness))
 
+        layers = self.cascade_layers(count, update_layer)
+        if update_layer is not None:
+            big_F, big_G, big_T = self.cascade_states[update_layer]
+
         # From the last layer
-        for layer_index in range(count)[::-1]:
+        for layer_index in layers:
 
             E_conv = E_conv_all[layer_index]
             o_E_conv = o_E_conv_all[layer_index]
             d = self.thickness[layer_index]
 
-            E_conv_i = np.linalg.inv(E_conv)
-            o_E_conv_i = np.linalg.inv(o_E_conv)
-
             if self.algo == 'TMM':
-                big_X, big_F, big_G, big_T, big_A_i, big_B, W_1, W_2, V_11, V_12, V_21, V_22, q_1, q_2 \
-                    = transfer_1d_conical_2(k0, Kx, ky, E_conv, E_conv_i, o_E_conv_i, self.ff, d,
-                                            varphi, big_F, big_G, big_T,
-                                            type_complex=self.type_complex)
-                layer_info = [E_conv_i, q_1, q_2, W_1, W_2, V_11, V_12, V_21, V_22, big_X, big_A_i, big_B, d]
+                if update_layer is not None and layer_index < update_layer:
+                    # above the updated layer: same modes, only the cascade step is redone
+                    modes = self.layer_modes[layer_index]
+                else:
+                    eps = homogeneous_permittivity(E_conv, o_E_conv)
+                    if eps is not None:
+                        modes = transfer_1d_conical_wv_homogeneous(k0, Kx, ky, eps, varphi)
+                    else:
+                        modes = self.get_layer_modes(
+                            lambda: transfer_1d_conical_wv(k0, Kx, ky, E_conv, o_E_conv, self.ff, varphi,
+                                                           type_complex=self.type_complex),
+                            k0, Kx, ky, E_conv, o_E_conv)
+                    if self.keep_cascade:
+                        self.layer_modes[layer_index] = modes
+                E_conv_i, q_1, q_2, W_1, W_2, V_11, V_12, V_21, V_22, big_W, big_V, big_W_i, big_V_i = modes
+
+                if self.keep_cascade:
+                    self.cascade_states[layer_index] = big_F, big_G, big_T
+                big_X, big_F, big_G, big_T, big_A, big_B \
+                    = transfer_1d_conical_2(k0, d, q_1, q_2, big_W, big_V, big_W_i, big_V_i, self.ff,
+                                            big_F, big_G, big_T, type_complex=self.type_complex)
+                layer_info = [E_conv_i, q_1, q_2, W_1, W_2, V_11, V_12, V_21, V_22, big_X, big_A, big_B, d]
                 self.layer_info_list.append(layer_info)
 
             elif self.algo == 'SMM':
@@ -203,10 +278,17 @@ class _BaseRCWA:
                 raise ValueError
 
         if self.algo == 'TMM':
-            de_ri, de_ti, big_T1 = transfer_1d_conical_3(big_F, big_G, big_T, Z_I, Y_I, self.psi, self.theta, self.ff,
-                                                         delta_i0, k_I_z, k0, self.n_I, self.n_II, k_II_z,
-                                                         type_complex=self.type_complex)
-            self.T1 = big_T1
+            de_ri, de_ti, big_T1, amplitudes \
+                = transfer_1d_conical_3(big_F, big_G, big_T, Z_I, Y_I, self.psi, self.theta, self.ff, delta_i0,
+                                        k_I_z, k0, self.n_I, self.n_II, k_II_z, type_complex=self.type_complex,
+                                        jones=jones)
+            self.T1 = big_T1 if jones is None else None  # the field calculation takes a single incident wave
+
+            if jones is not None:
+                # polarization axis first
+                de_ri, de_ti = np.moveaxis(de_ri, -1, 0), np.moveaxis(de_ti, -1, 0)
+                amplitudes = tuple(np.moveaxis(amplitude, -1, 0) for amplitude in amplitudes)
+            self.amplitudes = amplitudes
 
         elif self.algo == 'SMM':
             raise ValueError
@@ -215,72 +297,135 @@ class _BaseRCWA:
 
         return de_ri, de_ti
 
-    def solve_2d(self, wl, E_conv_all, o_E_conv_all):
+    def solve_2d(self, wl, E_conv_all, o_E_conv_all, n_conv_all=None, jones=None, update_layer=None):
 
-        self.layer_info_list = []
         self.T1 = None
+        self.amplitudes = None
 
-        fourier_indices = np.arange(-self.fourier_order, self.fourier_order + 1)
-
-        delta_i0 = np.zeros((self.ff ** 2, 1), dtype=self.type_complex)
-        delta_i0[self.ff ** 2 // 2, 0] = 1
+        fourier_indices_y = np.arange(-self.fourier_order_y, self.fourier_order_y + 1)
 
-        I = np.eye(self.ff ** 2, dtype=self.type_complex)
-        O = np.zeros((self.ff ** 2, self.ff ** 2), dtype=self.type_complex)
+        order_x, order_y = self.orders
+        center = len(order_x)
 
-        center = self.ff ** 2
+        delta_i0 = np.zeros((center, 1), dtype=self.type_complex)
+        delta_i0[(order_x == 0) & (order_y == 0), 0] = 1
 
         k0 = 2 * np.pi / wl
 
         if self.algo == 'TMM':
             kx_vector, ky_vector, Kx, Ky, k_I_z, k_II_z, varphi, Y_I, Y_II, Z_I, Z_II, big_F, big_G, big_T \
-                = transfer_2d_1(self.ff, k0, self.n_I, self.n_II, self.kx_vector, self.period, fourier_indices,
-                                self.theta, self.phi, wl, type_complex=self.type_complex)
+                = transfer_2d_1(self.ff, k0, self.n_I, self.n_II, self.kx_vector, self.period, fourier_indices_y,
+                                self.theta, self.phi, wl, type_complex=self.type_complex, orders=self.orders)
+
+            # mirror planes that the incidence keeps; each layer then uses those its pattern also has
+            mirrors = tuple(mirror for mirror in incidence_mirrors(self.n_I, self.theta, self.phi)
+                            if mirror in self.mirror_symmetry)
         elif self.algo == 'SMM':
+            if self.ff != self.ff_y or center != self.ff ** 2:
+                raise ValueError('SMM supports only equal x/y orders without truncation')
+            if jones is not None:
+                raise ValueError('SMM solves one polarization at a time')
             Kx, Ky, kz_inc, Wg, Vg, Kzg, Wr, Vr, Kzr, Wt, Vt, Kzt, Ar, Br, Sg \
-                = scattering_2d_1(self.n_I, self.n_II, self.theta, self.phi, k0, self.period, self.fourier_order)
+                = scattering_2d_1(self.n_I, self.n_II, self.theta, self.phi, k0, self.period, self.fourier_order_x)
         else:
             raise ValueError
 
         count = min(len(E_conv_all), len(o_E_conv_all), len(self.thickness))
 
+        layers = self.cascade_layers(count, update_layer)
+        if update_layer is not None:
+            big_F, big_G, big_T = self.cascade_states[update_layer]
+
         # From the last layer
-        for layer_index in range(count)[::-1]:
+        for layer_index in layers:
 
             E_conv = E_conv_all[layer_index]
             o_E_conv = o_E_conv_all[layer_index]
             d = self.thickness[layer_index]
 
-            E_conv_i = np.linalg.inv(E_conv)
-            o_E_conv_i = np.linalg.inv(o_E_conv)
-
             if self.algo == 'TMM':  # TODO: MERGE W V part
-                W, V, q = transfer_2d_wv(self.ff, Kx, E_conv_i, Ky, o_E_conv_i, E_conv, type_complex=self.type_complex)
-
-                big_X, big_F, big_G, big_T, big_A_i, big_B, \
-                W_11, W_12, W_21, W_22, V_11, V_12, V_21, V_22 \
-                    = transfer_2d_2(k0, d, W, V, center, q, varphi, I, O, big_F, big_G, big_T,
+                if update_layer is not None and layer_index < update_layer:
+                    # above the updated layer: same modes, only the cascade step is redone
+                    modes = self.layer_modes[layer_index]
+                else:
+                    eps = homogeneous_permittivity(E_conv, o_E_conv)
+                    if eps is not None:
+                        modes = transfer_2d_wv_homogeneous(Kx, Ky, eps, varphi)
+                    else:
+                        symmetry = find_mirror_symmetry(E_conv, o_E_conv, self.orders, mirrors) if mirrors else ()
+                        normal_vector = None if n_conv_all is None else tuple(n[layer_index] for n in n_conv_all)
+                        modes = self.get_layer_modes(
+                            lambda: self._modes_2d(Kx, Ky, E_conv, o_E_conv, center, varphi, symmetry, normal_vector),
+                            Kx, Ky, E_conv, o_E_conv, varphi, *(normal_vector or ()))
+                    if self.keep_cascade:
+                        self.layer_modes[layer_index] = modes
+                E_conv_i, q, W_11, W_12, W_21, W_22, V_11, V_12, V_21, V_22, big_W, big_V, big_W_i, big_V_i = modes
+
+                if self.keep_cascade:
+                    self.cascade_states[layer_index] = big_F, big_G, big_T
+                big_X, big_F, big_G, big_T, big_A, big_B \
+                    = transfer_2d_2(k0, d, q, center, big_W, big_V, big_W_i, big_V_i, big_F, big_G, big_T,
                                     type_complex=self.type_complex)
 
-                layer_info = [E_conv_i, q, W_11, W_12, W_21, W_22, V_11, V_12, V_21, V_22, big_X, big_A_i, big_B, d]
+                layer_info = [E_conv_i, q, W_11, W_12, W_21, W_22, V_11, V_12, V_21, V_22, big_X, big_A, big_B, d]
                 self.layer_info_list.append(layer_info)
 
             elif self.algo == 'SMM':
+                E_conv_i = np.linalg.inv(E_conv)
+                o_E_conv_i = np.linalg.inv(o_E_conv)
                 W, V, LAMBDA = scattering_2d_wv(self.ff, Kx, Ky, E_conv, o_E_conv, o_E_conv_i, E_conv_i)
                 A, B, Sl_dict, Sg_matrix, Sg = scattering_2d_2(W, Wg, V, Vg, d, k0, Sg, LAMBDA)
             else:
                 raise ValueError
 
         if self.algo == 'TMM':
-            de_ri, de_ti, big_T1 = transfer_2d_3(center, big_F, big_G, big_T, Z_I, Y_I, self.psi, self.theta, self.ff,
-                                                 delta_i0, k_I_z, k0, self.n_I, self.n_II, k_II_z,
-                                                 type_complex=self.type_complex)
-            self.T1 = big_T1
+            de_ri, de_ti, big_T1, amplitudes \
+                = transfer_2d_3(center, big_F, big_G, big_T, Z_I, Y_I, self.psi, self.theta, self.ff, delta_i0,
+                                k_I_z, k0, self.n_I, self.n_II, k_II_z, type_complex=self.type_complex, jones=jones)
+            self.T1 = big_T1 if jones is None else None  # the field calculation takes a single incident wave
+
+            if jones is not None:
+                # polarization axis first
+                de_ri, de_ti = np.moveaxis(de_ri, -1, 0), np.moveaxis(de_ti, -1, 0)
+                amplitudes = tuple(np.moveaxis(amplitude, -1, 0) for amplitude in amplitudes)
 
         elif self.algo == 'SMM':
             de_ri, de_ti = scattering_2d_3(Wt, Wg, Vt, Vg, Sg, Wr, Kx, Ky, Kzr, Kzt, kz_inc, self.n_I,
-                                           self.pol, self.theta, self.phi, self.fourier_order, self.ff)
+                                           self.pol, self.theta, self.phi, self.fourier_order_x, self.ff)
         else:
             raise ValueError
 
-        return de_ri.reshape((self.ff, self.ff)).real, de_ti.reshape((self.ff, self.ff)).real
+        # (ff_y, ff_x) layout, with a leading wavelength axis when solving a spectrum at once
+        # and a polarization axis before it when solving several polarizations.
+        batch_shape = np.shape(wl)[:-1] if jones is None else (len(jones[0]),) + np.shape(wl)[:-1]
+
+        if self.algo == 'TMM':
+            self.amplitudes = tuple(self._to_grid(amplitude, batch_shape) for amplitude in amplitudes)
+
+        return self._to_grid(de_ri.real, batch_shape), self._to_grid(de_ti.real, batch_shape)
+
+    def _to_grid(self, x, batch_shape):
+        # values per kept harmonic to the (ff_y, ff_x) grid; harmonics dropped by the truncation are left 0
+        order_x, order_y = self.orders
+        grid_index = (order_y + self.fourier_order_y) * self.ff + order_x + self.fourier_order_x
+
+        grid = np.zeros(batch_shape + (self.ff_y * self.ff,), dtype=x.dtype)
+        grid[..., grid_index] = x.reshape(batch_shape + (-1,))
+
+        return grid.reshape(batch_shape + (self.ff_y, self.ff))
+
+    def _modes_2d(self, Kx, Ky, E_conv, o_E_conv, center, varphi, symmetry=(), normal_vector=None):
+        # both inverses appear as terms of S2_from_S and U1_from_S, not only in products, so they are formed
+        E_conv_i = np.linalg.inv(E_conv)
+        o_E_conv_i = np.linalg.inv(o_E_conv)
+
+        # symmetric layers are solved per mirror-symmetry sector, giving an equivalent set of modes
+        sector_bases = None
+        if symmetry:
+            Kx, Ky = symmetrize_k(self.orders, Kx, Ky, symmetry)
+            sector_bases = mirror_sector_bases(self.orders, symmetry)
+
+        W, V, q = transfer_2d_wv(self.ff, Kx, E_conv_i, Ky, o_E_conv_i, E_conv, type_complex=self.type_complex,
+                                 sector_bases=sector_bases, normal_vector=normal_vector)
+
+        return (E_conv_i, q) + transfer_2d_big_wv(W, V, center, varphi)
@@ -3,25 +3,98 @@ import time
 
 import numpy as np
 
-from os import walk
-from scipy.io import loadmat
-from pathlib import Path
+from functools import lru_cache
 
+from ..material_table import material_table, material_dispersion
 
-def put_permittivity_in_ucell(ucell, mat_list, mat_table, wl, type_complex=np.complex128):
 
-    res = np.zeros(ucell.shape, dtype=type_complex)
+def fourier_orders_2d(fourier_order, truncation=None):
+    """
+    Harmonics kept in a 2D grating, flattened y major and x minor.
 
-    for z in range(ucell.shape[0]):
-        for y in range(ucell.shape[1]):
-            for x in range(ucell.shape[2]):
-                material = mat_list[ucell[z, y, x]]
-                if type(material) == str:
-                    res[z, y, x] = find_nk_index(material, mat_table, wl) ** 2
-                else:
-                    res[z, y, x] = material ** 2
+    Args:
+        fourier_order: N, or (Nx, Ny) for independent orders along x and y
+        truncation: None for the full (2Ny+1, 2Nx+1) grid, 'circular' to keep only the orders inside the ellipse
+            (m / Nx) ** 2 + (n / Ny) ** 2 <= 1
 
-    return res
+    Returns:
+        order_x, order_y: x and y order of each harmonic
+    """
+    fourier_order_x, fourier_order_y = (int(n) for n in np.broadcast_to(fourier_order, (2,)))
+
+    order_x, order_y = np.meshgrid(np.arange(-fourier_order_x, fourier_order_x + 1),
+                                   np.arange(-fourier_order_y, fourier_order_y + 1))
+    order_x, order_y = order_x.flatten(), order_y.flatten()
+
+    if truncation == 'circular':
+        keep = (order_x * fourier_order_y) ** 2 + (order_y * fourier_order_x) ** 2 \
+            <= (fourier_order_x * fourier_order_y) ** 2
+        order_x, order_y = order_x[keep], order_y[keep]
+    elif truncation is not None:
+        raise ValueError
+
+    return order_x, order_y
+
+
+def conv_index(fourier_order, shape, truncation=None):
+    """
+    Flat gather index of the convolution matrix in fftshifted Fourier coefficients of shape (y, x):
+    entry (i, j) points at the coefficient of the order difference between harmonics i and j.
+    It depends on the orders and the shape only, so it is computed once and shared read-only by all calls; the
+    few most recent are kept.
+
+    Args:
+        fourier_order: N, or (Nx, Ny) in 2D
+        shape: (y, x) shape of the coefficients; y of 1 for 1D, with harmonics -N..N
+        truncation: as fourier_orders_2d, 2D only
+
+    Returns:
+        (harmonics, harmonics) int array; the matrix is coeffs.reshape(..., -1)[..., index]
+    """
+    fourier_order = tuple(int(n) for n in np.broadcast_to(fourier_order, (2,)))
+
+    return _conv_index(fourier_order, tuple(int(n) for n in shape), truncation)
+
+
+@lru_cache(maxsize=16)
+def _conv_index(fourier_order, shape, truncation):
+    if shape[0] == 1:  # 1D
+        order_x = np.arange(-fourier_order[0], fourier_order[0] + 1)
+        order_y = np.zeros_like(order_x)
+    else:
+        order_x, order_y = fourier_orders_2d(fourier_order, truncation)
+
+    center_y, center_x = shape[0] // 2, shape[1] // 2
+    index = (center_y + order_y[:, None] - order_y[None, :]) * shape[1] + center_x + order_x[:, None] - order_x[None, :]
+    index.flags.writeable = False
+
+    return index
+
+
+def gather_conv(f_coeffs, fourier_order, truncation=None):
+    # convolution matrices of fftshifted coefficients (..., y, x)
+    index = conv_index(fourier_order, f_coeffs.shape[-2:], truncation)
+
+    return f_coeffs.reshape(f_coeffs.shape[:-2] + (-1,))[..., index]
+
+
+def put_permittivity_in_ucell(ucell, mat_list, mat_table, wl, type_complex=np.complex128):
+    """
+    Permittivity of each cell of ucell, an array of indices into mat_list.
+    Each material is evaluated once and looked up by index; wl may be an array of wavelengths,
+    in which case its axes come first: (..., Z, Y, X).
+    """
+    permittivity = []
+    for material in mat_list:
+        if type(material) == str:
+            permittivity.append(find_nk_index(material, mat_table, wl) ** 2)
+        else:
+            permittivity.append(np.broadcast_to(material ** 2, np.shape(wl)))
+
+    # (..., material)
+    permittivity = np.stack(permittivity, axis=-1).astype(type_complex)
+
+    return permittivity[..., np.asarray(ucell)]
 
 
 def put_permittivity_in_ucell_object(ucell_size, mat_list, obj_list, mat_table, wl,
@@ -39,79 +112,42 @@ def put_permittivity_in_ucell_object(ucell_size, mat_list, obj_list, mat_table,
 
 
 def find_nk_index(material, mat_table, wl):
-    if material[-6:] == '__real':
-        material = material[:-6]
-        n_only = True
-    else:
-        n_only = False
-
-    mat_data = mat_table[material.upper()]
-
-    n_index = np.interp(wl, mat_data[:, 0], mat_data[:, 1])
-
-    if n_only:
-        return n_index
-
-    k_index = np.interp(wl, mat_data[:, 0], mat_data[:, 2])
-    nk = n_index + 1j * k_index
-
-    return nk
+    # wl may be an array of wavelengths
+    return material_dispersion(material, mat_table)(wl)
 
 
 def read_material_table(nk_path=None):
-    mat_table = {}
-
-    if nk_path is None:
-        nk_path = str(Path(__file__).resolve().parent.parent) + '/nk_data'
-
-    full_path_list, name_list, _ = [], [], []
-    for (dirpath, dirnames, filenames) in walk(nk_path):
-        full_path_list.extend([f'{dirpath}/{filename}' for filename in filenames])
-        name_list.extend(filenames)
-    for path, name in zip(full_path_list, name_list):
-        if name[-3:] == 'txt':
-            data = np.loadtxt(path, skiprows=1)
-            mat_table[name[:-4].upper()] = data
-
-        elif name[-3:] == 'mat':
-            data = loadmat(path)
-            data = np.array([data['WL'], data['n'], data['k']])[:, :, 0].T
-            mat_table[name[:-4].upper()] = data
-    return mat_table
+    # shared by all solvers and backends, and loaded lazily: see meent.material_table
+    return material_table(nk_path)
 
 
 def cell_compression(cell, type_complex=np.complex128):
+    # cell may be a stack of cells (..., y, x), compressed on the discontinuities of any of them
 
     if type_complex == np.complex128:
         type_float = np.float64
     else:
         type_float = np.float32
 
-    # find discontinuities in x
-    step_y, step_x = 1. / np.array(cell.shape, dtype=type_float)
-    x = []
-    y = []
-    cell_x = []
-    cell_xy = []
+    step_y, step_x = 1. / np.array(cell.shape[-2:], dtype=type_float)
 
-    cell_next = np.roll(cell, -1, axis=1)
+    # find discontinuities in x
+    cell_next = np.roll(cell, -1, axis=-1)
 
-    for col in range(cell.shape[1]):
-        if not (cell[:, col] == cell_next[:, col]).all() or (col == cell.shape[1] - 1):
-            x.append(step_x * (col + 1))
-            cell_x.append(cell[:, col])
+    col = (cell != cell_next).any(axis=tuple(range(cell.ndim - 1)))
+    col[-1] = True
+    col = np.flatnonzero(col)
 
-    cell_x = np.array(cell_x).T
-    cell_x_next = np.roll(cell_x, -1, axis=0)
+    cell_x = cell[..., col]
+    cell_x_next = np.roll(cell_x, -1, axis=-2)
 
-    for row in range(cell_x.shape[0]):
-        if not (cell_x[row, :] == cell_x_next[row, :]).all() or (row == cell_x.shape[0] - 1):
-            y.append(step_y * (row + 1))
-            cell_xy.append(cell_x[row, :])
+    row = (cell_x != cell_x_next).any(axis=tuple(range(cell.ndim - 2)) + (cell.ndim - 1,))
+    row[-1] = True
+    row = np.flatnonzero(row)
 
-    x = np.array(x).reshape((-1, 1))
-    y = np.array(y).reshape((-1, 1))
-    cell_comp = np.array(cell_xy)
+    x = (step_x * (col + 1).astype(type_float)).reshape((-1, 1))
+    y = (step_y * (row + 1).astype(type_float)).reshape((-1, 1))
+    cell_comp = cell_x[..., row, :]
 
     return cell_comp, x, y
 
@@ -119,118 +155,93 @@ def cell_compression(cell, type_complex=np.complex128):
 def fft_piecewise_constant(cell, fourier_order, type_complex=np.complex128):
     """
     reference: reticolo
+
+    cell may be a stack of cells (..., y, x); they then share one compression and one set of exponentials.
     """
 
-    if cell.shape[0] == 1:
-        fourier_order = [0, fourier_order]
+    fourier_order_x, fourier_order_y = np.broadcast_to(fourier_order, (2,))
+
+    if cell.shape[-2] == 1:
+        fourier_order = [0, fourier_order_x]
     else:
-        fourier_order = [fourier_order, fourier_order]
+        fourier_order = [fourier_order_y, fourier_order_x]
     cell, x, y = cell_compression(cell, type_complex=type_complex)
 
     # X axis
-    cell_next_x = np.roll(cell, -1, axis=1)
+    cell_next_x = np.roll(cell, -1, axis=-1)
     cell_diff_x = cell_next_x - cell
 
     modes = np.arange(-2 * fourier_order[1], 2 * fourier_order[1] + 1, 1)
 
     f_coeffs_x = cell_diff_x @ np.exp(-1j * 2 * np.pi * x @ modes[None, :], dtype=type_complex)
-    c = f_coeffs_x.shape[1] // 2
+    c = f_coeffs_x.shape[-1] // 2
 
     # x_next = np.vstack(np.roll(x, -1, axis=0)[:-1]) - x
     x_next = np.vstack((np.roll(x, -1, axis=0)[:-1], 1)) - x
 
-    f_coeffs_x[:, c] = (cell @ np.vstack((x[0], x_next[:-1]))).flatten()
-    mask = np.ones(f_coeffs_x.shape[1], dtype=bool)
+    f_coeffs_x[..., c] = (cell @ np.vstack((x[0], x_next[:-1])))[..., 0]
+    mask = np.ones(f_coeffs_x.shape[-1], dtype=bool)
     mask[c] = False
-    f_coeffs_x[:, mask] /= (1j * 2 * np.pi * modes[mask])
+    f_coeffs_x[..., mask] /= (1j * 2 * np.pi * modes[mask])
 
     # Y axis
-    f_coeffs_x_next_y = np.roll(f_coeffs_x, -1, axis=0)
+    f_coeffs_x_next_y = np.roll(f_coeffs_x, -1, axis=-2)
     f_coeffs_x_diff_y = f_coeffs_x_next_y - f_coeffs_x
 
     modes = np.arange(-2 * fourier_order[0], 2 * fourier_order[0] + 1, 1)
 
-    f_coeffs_xy = f_coeffs_x_diff_y.T @ np.exp(-1j * 2 * np.pi * y @ modes[None, :], dtype=type_complex)
-    c = f_coeffs_xy.shape[1] // 2
+    f_coeffs_xy = np.swapaxes(f_coeffs_x_diff_y, -1, -2) @ np.exp(-1j * 2 * np.pi * y @ modes[None, :],
+                                                                  dtype=type_complex)
+    c = f_coeffs_xy.shape[-1] // 2
 
     y_next = np.vstack((np.roll(y, -1, axis=0)[:-1], 1)) - y
 
-    f_coeffs_xy[:, c] = f_coeffs_x.T @ np.vstack((y[0], y_next[:-1])).flatten()
+    f_coeffs_xy[..., c] = np.swapaxes(f_coeffs_x, -1, -2) @ np.vstack((y[0], y_next[:-1])).flatten()
 
     if c:
-        mask = np.ones(f_coeffs_xy.shape[1], dtype=bool)
+        mask = np.ones(f_coeffs_xy.shape[-1], dtype=bool)
         mask[c] = False
-        f_coeffs_xy[:, mask] /= (1j * 2 * np.pi * modes[mask])
+        f_coeffs_xy[..., mask] /= (1j * 2 * np.pi * modes[mask])
 
-    return f_coeffs_xy.T
+    return np.swapaxes(f_coeffs_xy, -1, -2)
 
 
-def to_conv_mat_piecewise_constant(pmt, fourier_order, type_complex=np.complex128):
-    # TODO: do conv and 1/conv in simultaneously?
+def to_conv_mat_piecewise_constant(pmt, fourier_order, type_complex=np.complex128, truncation=None):
+    # all layers in one pass; pmt may carry more leading axes than the layer axis (..., layer, y, x)
     if len(pmt.shape) == 2:
         print('shape is 2')
         raise ValueError
-    ff = 2 * fourier_order + 1
 
-    if pmt.shape[1] == 1:  # 1D
-        res = np.zeros((pmt.shape[0], ff, ff)).astype(type_complex)
+    # attention on the order of axis (Z Y X)
+    f_coeffs = fft_piecewise_constant(pmt, fourier_order, type_complex=type_complex)
+    res = gather_conv(f_coeffs, fourier_order, truncation)
 
-        for i, layer in enumerate(pmt):
-            f_coeffs = fft_piecewise_constant(layer, fourier_order, type_complex=type_complex)
-            center = f_coeffs.shape[1] // 2
-            conv_idx = np.arange(-ff + 1, ff, 1, dtype=int)
-            conv_idx = circulant(conv_idx)
-            e_conv = f_coeffs[0, center + conv_idx]
-            res[i] = e_conv
+    return res.astype(type_complex, copy=False)
 
-    else:  # 2D
-        # attention on the order of axis (Z Y X)
-        res = np.zeros((pmt.shape[0], ff ** 2, ff ** 2)).astype(type_complex)
-
-        for i, layer in enumerate(pmt):
-            f_coeffs = fft_piecewise_constant(layer, fourier_order, type_complex=type_complex)
-            center = np.array(f_coeffs.shape) // 2
-
-            conv_idx = np.arange(-ff + 1, ff, 1)
-            conv_idx = circulant(conv_idx)
-            conv_i = np.repeat(conv_idx, ff, axis=1)
-            conv_i = np.repeat(conv_i, [ff] * ff, axis=0)
-            conv_j = np.tile(conv_idx, (ff, ff))
-            e_conv = f_coeffs[center[0] + conv_i, center[1] + conv_j]
-            res[i] = e_conv
-
-    # import matplotlib.pyplot as plt
-    #
-    # plt.figure()
-    # plt.imshow(abs(res[0]), cmap='jet')
-    # plt.colorbar()
-    # plt.show()
-
-    # import matplotlib.pyplot as plt
-    #
-    # plt.figure()
-    # plt.imshow(abs(pmtvy_fft), cmap='jet')
-    # plt.colorbar()
-    # plt.show()
-    #
-    # plt.figure()
-    # plt.imshow(abs(res[0]), cmap='jet')
-    # plt.colorbar()
-    # plt.show()
 
-    return res
+def to_conv_mat_pair_piecewise_constant(pmt, fourier_order, type_complex=np.complex128, truncation=None):
+    """
+    Convolution matrices of pmt and 1 / pmt for all layers in one pass. Both change at the same places,
+    so they share the compression, the exponentials and the gather indices.
+
+    Returns:
+        E_conv_all, o_E_conv_all
+    """
+    res = to_conv_mat_piecewise_constant(np.stack([pmt, 1 / pmt]), fourier_order, type_complex=type_complex,
+                                         truncation=truncation)
+
+    return res[0], res[1]
 
 
-def to_conv_mat(pmt, fourier_order, type_complex=np.complex128):
+def to_conv_mat(pmt, fourier_order, type_complex=np.complex128, truncation=None):
     # TODO: large minimum size shows good convergence to piecewise_constant method. Add an option?
 
     if len(pmt.shape) == 2:
         print('shape is 2')
         raise ValueError
-    ff = 2 * fourier_order + 1
 
     if pmt.shape[1] == 1:  # 1D
-        res = np.zeros((pmt.shape[0], ff, ff)).astype(type_complex)
+        ff = 2 * fourier_order + 1
 
         # extend array
         minimum_pattern_size = 2 * ff
@@ -238,70 +249,104 @@ def to_conv_mat(pmt, fourier_order, type_complex=np.complex128):
             n = minimum_pattern_size // pmt.shape[2]
             pmt = np.repeat(pmt, n+1, axis=2)
 
-        for i, layer in enumerate(pmt):
-            f_coeffs = np.fft.fftshift(np.fft.fftn(layer / layer.size))
-            # FFT scaling:
-            # https://kr.mathworks.com/matlabcentral/answers/15770-scaling-the-fft-and-the-ifft?s_tid=srchtitle
-
-            center = f_coeffs.shape[1] // 2
-
-            conv_idx = np.arange(-ff + 1, ff, 1, dtype=int)
-            conv_idx = circulant(conv_idx)
-            e_conv = f_coeffs[0, center + conv_idx]
-            res[i] = e_conv
-
     else:  # 2D
         # attention on the order of axis (Z Y X)
-        # TODO: separate fourier order
-        res = np.zeros((pmt.shape[0], ff ** 2, ff ** 2)).astype(type_complex)
+        order_x, order_y = fourier_orders_2d(fourier_order, truncation)
 
         # extend array
-        minimum_pattern_size = 2 * ff
+        minimum_pattern_size_y = 2 * (2 * order_y.max() + 1)
+        minimum_pattern_size_x = 2 * (2 * order_x.max() + 1)
 
-        if pmt.shape[1] < minimum_pattern_size:
-            n = minimum_pattern_size // pmt.shape[1]
+        if pmt.shape[1] < minimum_pattern_size_y:
+            n = minimum_pattern_size_y // pmt.shape[1]
             pmt = np.repeat(pmt, n+1, axis=1)
-        if pmt.shape[2] < minimum_pattern_size:
-            n = minimum_pattern_size // pmt.shape[2]
+        if pmt.shape[2] < minimum_pattern_size_x:
+            n = minimum_pattern_size_x // pmt.shape[2]
             pmt = np.repeat(pmt, n+1, axis=2)
 
-        for i, layer in enumerate(pmt):
-            f_coeffs = np.fft.fftshift(np.fft.fft2(layer / layer.size))
-            center = np.array(f_coeffs.shape) // 2
-
-            conv_idx = np.arange(-ff + 1, ff, 1)
-            conv_idx = circulant(conv_idx)
-
-            conv_i = np.repeat(conv_idx, ff, axis=1)
-            conv_i = np.repeat(conv_i, [ff] * ff, axis=0)
-            conv_j = np.tile(conv_idx, (ff, ff))
-            res[i] = f_coeffs[center[0] + conv_i, center[1] + conv_j]
-
-    # import matplotlib.pyplot as plt
-    #
-    # plt.figure()
-    # plt.imshow(abs(pmtvy_fft), cmap='jet')
-    # plt.colorbar()
-    # plt.show()
-    #
-    # plt.figure()
-    # plt.imshow(abs(res[0]), cmap='jet')
-    # plt.colorbar()
-    # plt.show()
-
-    #
-    return res
+    # all layers at once. FFT scaling:
+    # https://kr.mathworks.com/matlabcentral/answers/15770-scaling-the-fft-and-the-ifft?s_tid=srchtitle
+    f_coeffs = np.fft.fftshift(np.fft.fft2(pmt / (pmt.shape[1] * pmt.shape[2])), axes=(-2, -1))
+    res = gather_conv(f_coeffs, fourier_order, truncation)
 
+    return res.astype(type_complex, copy=False)
 
-def circulant(c):
 
-    center = c.shape[0] // 2
-    circ = np.zeros((center + 1, center + 1), dtype=int)
+def normal_vector_field(ucell_layer, period, gradient_scale=None, integration_scale=None):
+    """
+    Normal direction n = (cos t, sin t) of the material boundaries in one rasterized 2D layer.
 
-    for r in range(center+1):
-        idx = np.arange(r, r - center - 1, -1, dtype=int)
+    t is the principal direction of the structure tensor: the outer product of the gradients of the
+    material indicators (smoothed over gradient_scale), averaged over integration_scale. It needs no sign convention,
+    follows the boundaries closely and varies smoothly in between. Both scales are lengths in the units of period;
+    by default one pixel and a tenth of the smaller period.
+
+    Returns:
+        nx ** 2, nx * ny, ny ** 2 on the pixel grid
+    """
+    pixel_y, pixel_x = ucell_layer.shape
+    if gradient_scale is None:
+        gradient_scale = max(period[0] / pixel_x, period[1] / pixel_y)
+    if integration_scale is None:
+        integration_scale = min(period[0], period[1]) / 10
 
-        assign_value = c[center + idx]
-        circ[r] = assign_value
+    freq_x = np.fft.fftfreq(pixel_x, d=period[0] / pixel_x)[None, :]
+    freq_y = np.fft.fftfreq(pixel_y, d=period[1] / pixel_y)[:, None]
+
+    def gaussian(scale):
+        return np.exp(-2 * np.pi ** 2 * scale ** 2 * (freq_x ** 2 + freq_y ** 2))
+
+    # structure tensor [[a, b], [b, c]] summed over the materials
+    a, b, c = 0, 0, 0
+    for material in np.unique(ucell_layer):
+        indicator_f = np.fft.fft2((ucell_layer == material).astype(float)) * gaussian(gradient_scale)
+        grad_x = np.fft.ifft2(2j * np.pi * freq_x * indicator_f).real
+        grad_y = np.fft.ifft2(2j * np.pi * freq_y * indicator_f).real
+        a, b, c = a + grad_x ** 2, b + grad_x * grad_y, c + grad_y ** 2
+
+    a, b, c = (np.fft.ifft2(np.fft.fft2(t) * gaussian(integration_scale)).real for t in (a, b, c))
+
+    t = 0.5 * np.arctan2(2 * b, a - c)
+
+    return np.cos(t) ** 2, np.cos(t) * np.sin(t), np.sin(t) ** 2
+
+
+def to_conv_mat_normal_vector(ucell, period, fourier_order, type_complex=np.complex128, truncation=None):
+    """
+    Convolution matrices of nx ** 2, nx * ny and ny ** 2 (see normal_vector_field) for each layer of a 2D ucell
+    of material indices, used by the normal-vector factorization of the in-plane permittivity.
+
+    Returns:
+        N_xx, N_xy, N_yy each of shape (layer, harmonics, harmonics)
+    """
+    order_x, order_y = fourier_orders_2d(fourier_order, truncation)
+
+    # resolve the order differences up to 2N, as to_conv_mat
+    minimum_pattern_size_y = 2 * (2 * order_y.max() + 1)
+    minimum_pattern_size_x = 2 * (2 * order_x.max() + 1)
+    if ucell.shape[1] < minimum_pattern_size_y:
+        ucell = np.repeat(ucell, minimum_pattern_size_y // ucell.shape[1] + 1, axis=1)
+    if ucell.shape[2] < minimum_pattern_size_x:
+        ucell = np.repeat(ucell, minimum_pattern_size_x // ucell.shape[2] + 1, axis=2)
+
+    pixel_y, pixel_x = ucell.shape[1:]
+    conv_i = order_y[:, None] - order_y[None, :]
+    conv_j = order_x[:, None] - order_x[None, :]
+
+    # the samples sit at the pixel centers, like the pixels of the piecewise constant permittivity
+    shift = np.exp(-1j * np.pi * (conv_i / pixel_y + conv_j / pixel_x))
+
+    # (3, layer, y, x)
+    fields = np.stack([normal_vector_field(layer, period) for layer in ucell], axis=1)
+    f_coeffs = np.fft.fftshift(np.fft.fft2(fields / (pixel_y * pixel_x)), axes=(-2, -1))
+    res = (gather_conv(f_coeffs, fourier_order, truncation) * shift).astype(type_complex)
+
+    return res[0], res[1], res[2]
+
+
+def circulant(c):
+
+    center = c.shape[0] // 2
+    idx = np.arange(center + 1)
 
-    return circ
+    return c[center + idx[:, None] - idx[None, :]]
@@ -3,6 +3,10 @@ import time
 import numpy as np
 import matplotlib.pyplot as plt
 
+from functools import partial
+
+from .convolution_matrix import fourier_orders_2d
+
 
 def field_distribution(grating_type, *args, **kwargs):
     if grating_type == 0:
@@ -15,75 +19,111 @@ def field_distribution(grating_type, *args, **kwargs):
 
 
 def field_dist_1d(wavelength, n_I, theta, fourier_order, T1, layer_info_list, period, pol, resolution=(100, 1, 100),
-                  type_complex=np.complex128):
+                  type_complex=np.complex128, synthesis='dense', z_step=None, z=None, n_II=1.):
 
-    k0 = 2 * np.pi / wavelength
-    fourier_indices = np.arange(-fourier_order, fourier_order + 1)
+    resolution_z, resolution_y, resolution_x = resolution
+    field_cell = np.zeros((field_rows(layer_info_list, resolution_z, z_step, z), resolution_y, resolution_x, 3),
+                          dtype=type_complex)
 
-    kx_vector = k0 * (n_I * np.sin(theta) - fourier_indices * (wavelength / period[0])).astype(type_complex)
-    Kx = np.diag(kx_vector / k0)
+    slabs = field_slabs_1d(wavelength, n_I, theta, fourier_order, T1, layer_info_list, period, pol,
+                           resolution=resolution, type_complex=type_complex, synthesis=synthesis, z_step=z_step,
+                           z=z, n_II=n_II)
+    row = 0
+    for slab in slabs:
+        field_cell[row:row + len(slab)] = slab
+        row += len(slab)
 
-    resolution_z, resolution_y, resolution_x = resolution
+    return field_cell
 
-    field_cell = np.zeros((resolution_z * len(layer_info_list), resolution_y, resolution_x, 3), dtype=type_complex)
 
-    T_layer = T1
+def field_dist_1d_conical(wavelength, n_I, theta, phi, fourier_order, T1, layer_info_list, period,
+                          resolution=(100, 100, 100), type_complex=np.complex128, synthesis='dense', z_step=None,
+                          z=None, n_II=1.):
 
-    # From the first layer
-    for idx_layer, (E_conv_i, q, W, X, a_i, b, d) in enumerate(layer_info_list[::-1]):
+    resolution_z, resolution_y, resolution_x = resolution
+    field_cell = np.zeros((field_rows(layer_info_list, resolution_z, z_step, z), resolution_y, resolution_x, 6),
+                          dtype=type_complex)
 
-        c1 = T_layer[:, None]
-        c2 = b @ a_i @ X @ T_layer[:, None]
+    slabs = field_slabs_1d_conical(wavelength, n_I, theta, phi, fourier_order, T1, layer_info_list, period,
+                                   resolution=resolution, type_complex=type_complex, synthesis=synthesis, z_step=z_step,
+                                   z=z, n_II=n_II)
+    row = 0
+    for slab in slabs:
+        field_cell[row:row + len(slab)] = slab
+        row += len(slab)
 
-        Q = np.diag(q)
+    return field_cell
 
-        if pol == 0:
-            V = W @ Q
 
-        else:
-            V = E_conv_i @ W @ Q
-            EKx = E_conv_i @ Kx
+def field_dist_2d(wavelength, n_I, theta, phi, fourier_order, T1, layer_info_list, period, resolution=(100, 100, 100),
+                  type_complex=np.complex128, truncation=None, synthesis='dense', z_step=None, z=None, n_II=1.):
+    """
+    Fields of all layers on the uniform grid x = i * period[0] / resolution_x, y = j * period[1] / resolution_y and
+    z = k * d / resolution_z in each layer of thickness d, from the top layer down.
+
+    Args:
+        z_step, z: other z samples, see layer_depths. The rows then follow the depths, resolution_z is unused.
+            z may extend above and below the stack into the incidence and transmission half-spaces, of index n_I
+            and n_II, see half_space_coefficients.
+        synthesis: 'dense' to sum the Fourier series with matrix products, 'fft' with an inverse FFT per plane,
+            which scales better with the number of harmonics
+
+    Returns:
+        (resolution_z * layers, resolution_y, resolution_x, 6) array of Ex, Ey, Ez, Hx, Hy, Hz, with one row per
+        depth when z_step or z is given
+    """
+    resolution_z, resolution_y, resolution_x = resolution
+    field_cell = np.zeros((field_rows(layer_info_list, resolution_z, z_step, z), resolution_y, resolution_x, 6),
+                          dtype=type_complex)
 
-        for k in range(resolution_z):
-            z = k / resolution_z * d
+    slabs = field_slabs_2d(wavelength, n_I, theta, phi, fourier_order, T1, layer_info_list, period,
+                           resolution=resolution, type_complex=type_complex, truncation=truncation, synthesis=synthesis,
+                           z_step=z_step, z=z, n_II=n_II)
+    row = 0
+    for slab in slabs:
+        field_cell[row:row + len(slab)] = slab
+        row += len(slab)
 
-            if pol == 0:  # TE
-                Sy = W @ (expm(-k0 * Q * z) @ c1 + expm(k0 * Q * (z - d)) @ c2)
-                Ux = V @ (-expm(-k0 * Q * z) @ c1 + expm(k0 * Q * (z - d)) @ c2)
-                f_here = (-1j) * Kx @ Sy
+    return field_cell
 
-                for j in range(resolution_y):
-                    for i in range(resolution_x):
-                        x = i * period[0] / resolution_x
 
-                        Ey = Sy.T @ np.exp(-1j * kx_vector.reshape((-1, 1)) * x)
-                        Hx = -1j * Ux.T @ np.exp(-1j * kx_vector.reshape((-1, 1)) * x)
-                        Hz = f_here.T @ np.exp(-1j * kx_vector.reshape((-1, 1)) * x)
+def field_slabs_1d(wavelength, n_I, theta, fourier_order, T1, layer_info_list, period, pol, resolution=(100, 1, 100),
+                   type_complex=np.complex128, synthesis='dense', z_step=None, z=None, n_II=1.):
+    # field_dist_1d one layer at a time, from the top layer down, between the half-spaces if z reaches them
 
-                        field_cell[resolution_z * idx_layer + k, j, i] = [Ey[0, 0], Hx[0, 0], Hz[0, 0]]
-            else:  # TM
-                Uy = W @ (expm(-k0 * Q * z) @ c1 + expm(k0 * Q * (z - d)) @ c2)
-                Sx = V @ (-expm(-k0 * Q * z) @ c1 + expm(k0 * Q * (z - d)) @ c2)
+    k0 = 2 * np.pi / wavelength
+    fourier_indices = np.arange(-fourier_order, fourier_order + 1)
 
-                f_here = (-1j) * EKx @ Uy  # there is a better option for convergence
+    kx_vector = k0 * (n_I * np.sin(theta) - fourier_indices * (wavelength / period[0])).astype(type_complex)
+    Kx = kx_vector / k0
 
-                for j in range(resolution_y):
-                    for i in range(resolution_x):
-                        x = i * period[0] / resolution_x
+    resolution_z, resolution_y, resolution_x = resolution
+    x = np.arange(resolution_x) * period[0] / resolution_x
 
-                        Hy = Uy.T @ np.exp(-1j * kx_vector.reshape((-1, 1)) * x)
-                        Ex = 1j * Sx.T @ np.exp(-1j * kx_vector.reshape((-1, 1)) * x)
-                        Ez = f_here.T @ np.exp(-1j * kx_vector.reshape((-1, 1)) * x)
+    coefficients = partial(field_coefficients_1d, pol, k0, Kx)
+    half_space = partial(half_space_coefficients, 0, pol, k0, Kx, 0)
 
-                        field_cell[resolution_z * idx_layer + k, j, i] = [Hy[0, 0], Ex[0, 0], Ez[0, 0]]
+    slabs = slab_coefficients(coefficients, half_space, layer_info_list, T1,
+                              layer_depths(layer_info_list, resolution_z, z_step, z),
+                              *half_space_depths(layer_info_list, z), n_I=n_I, n_II=n_II, incidence=fourier_order)
+    for coeffs in slabs:
 
-        T_layer = a_i @ X @ T_layer
+        if synthesis == 'fft':
+            slab = fourier_series_grid(coeffs, fourier_indices, 0 * fourier_indices, k0 * n_I * np.sin(theta), 0,
+                                       (period[0], 1), (1, resolution_x))
+        elif synthesis == 'dense':
+            slab = fourier_series_1d(coeffs, kx_vector, x)[:, None]
+        else:
+            raise ValueError
 
-    return field_cell
+        # the field does not depend on y
+        yield np.broadcast_to(slab, (len(coeffs), resolution_y, resolution_x, 3))
 
 
-def field_dist_1d_conical(wavelength, n_I, theta, phi, fourier_order, T1, layer_info_list, period,
-                          resolution=(100, 100, 100), type_complex=np.complex128):
+def field_slabs_1d_conical(wavelength, n_I, theta, phi, fourier_order, T1, layer_info_list, period,
+                           resolution=(100, 100, 100), type_complex=np.complex128, synthesis='dense', z_step=None,
+                           z=None, n_II=1.):
+    # field_dist_1d_conical one layer at a time, from the top layer down, between the half-spaces if z reaches them
 
     k0 = 2 * np.pi / wavelength
     fourier_indices = np.arange(-fourier_order, fourier_order + 1)
@@ -92,150 +132,561 @@ def field_dist_1d_conical(wavelength, n_I, theta, phi, fourier_order, T1, layer_
             wavelength / period[0])).astype(type_complex)
     ky = k0 * n_I * np.sin(theta) * np.sin(phi)
 
-    Kx = np.diag(kx_vector / k0)
+    Kx = kx_vector / k0
 
     resolution_z, resolution_y, resolution_x = resolution
-    field_cell = np.zeros((resolution_z * len(layer_info_list), resolution_y, resolution_x, 6), dtype=type_complex)
+    x = np.arange(resolution_x) * period[0] / resolution_x
+
+    coefficients = partial(field_coefficients_1d_conical, k0, Kx, ky / k0)
+    half_space = partial(half_space_coefficients, 1, 0, k0, Kx, ky / k0)
 
-    T_layer = T1
+    slabs = slab_coefficients(coefficients, half_space, layer_info_list, T1,
+                              layer_depths(layer_info_list, resolution_z, z_step, z),
+                              *half_space_depths(layer_info_list, z), n_I=n_I, n_II=n_II, incidence=fourier_order)
+    for coeffs in slabs:
 
-    big_I = np.eye((len(T1)), dtype=type_complex)
+        if synthesis == 'fft':
+            slab = fourier_series_grid(coeffs, fourier_indices, 0 * fourier_indices,
+                                       k0 * n_I * np.sin(theta) * np.cos(phi), 0, (period[0], 1), (1, resolution_x))
+        elif synthesis == 'dense':
+            slab = fourier_series_1d(coeffs, kx_vector, x)[:, None]
+        else:
+            raise ValueError
 
-    # From the first layer
-    for idx_layer, [E_conv_i, q_1, q_2, W_1, W_2, V_11, V_12, V_21, V_22, big_X, big_A_i, big_B, d] \
-            in enumerate(layer_info_list[::-1]):
+        # evaluated at y = 0 for every y
+        yield np.broadcast_to(slab, (len(coeffs), resolution_y, resolution_x, 6))
 
-        c = np.block([[big_I], [big_B @ big_A_i @ big_X]]) @ T_layer
 
-        cut = len(c) // 4
+def field_slabs_2d(wavelength, n_I, theta, phi, fourier_order, T1, layer_info_list, period, resolution=(100, 100, 100),
+                   type_complex=np.complex128, truncation=None, synthesis='dense', z_step=None, z=None, n_II=1.):
+    # field_dist_2d one layer at a time, from the top layer down, between the half-spaces if z reaches them
 
-        c1_plus = c[0*cut:1*cut]
-        c2_plus = c[1*cut:2*cut]
-        c1_minus = c[2*cut:3*cut]
-        c2_minus = c[3*cut:4*cut]
+    k0 = 2 * np.pi / wavelength
 
-        big_Q1 = np.diag(q_1)
-        big_Q2 = np.diag(q_2)
+    # wavevector of each kept harmonic
+    order_x, order_y = fourier_orders_2d(fourier_order, truncation)
 
-        for k in range(resolution_z):
-            z = k / resolution_z * d
+    kx_vector = k0 * (n_I * np.sin(theta) * np.cos(phi) - order_x * (
+            wavelength / period[0])).astype(type_complex)
+    ky_vector = k0 * (n_I * np.sin(theta) * np.sin(phi) - order_y * (
+            wavelength / period[1])).astype(type_complex)
 
-            Sx = W_2 @ (expm(-k0 * big_Q2 * z) @ c2_plus + expm(k0 * big_Q2 * (z-d)) @ c2_minus)
+    Kx = kx_vector / k0
+    Ky = ky_vector / k0
 
-            Sy = V_11 @ (expm(-k0 * big_Q1 * z) @ c1_plus + expm(k0 * big_Q1 * (z-d)) @ c1_minus) \
-                 + V_12 @ (expm(-k0 * big_Q2 * z) @ c2_plus + expm(k0 * big_Q2 * (z-d)) @ c2_minus)
+    resolution_z, resolution_y, resolution_x = resolution
+    x = np.arange(resolution_x) * period[0] / resolution_x
+    y = np.arange(resolution_y) * period[1] / resolution_y
+
+    coefficients = partial(field_coefficients_2d, k0, Kx, Ky)
+    half_space = partial(half_space_coefficients, 2, 0, k0, Kx, Ky)
+
+    slabs = slab_coefficients(coefficients, half_space, layer_info_list, T1,
+                              layer_depths(layer_info_list, resolution_z, z_step, z),
+                              *half_space_depths(layer_info_list, z), n_I=n_I, n_II=n_II,
+                              incidence=np.flatnonzero((order_x == 0) & (order_y == 0))[0])
+    for coeffs in slabs:
+
+        if synthesis == 'fft':
+            yield fourier_series_grid(coeffs, order_x, order_y, k0 * n_I * np.sin(theta) * np.cos(phi),
+                                      k0 * n_I * np.sin(theta) * np.sin(phi), period, (resolution_y, resolution_x))
+        elif synthesis == 'dense':
+            yield fourier_series_2d(coeffs, order_x, order_y, kx_vector, ky_vector, x, y)
+        else:
+            raise ValueError
 
-            Ux = W_1 @ (-expm(-k0 * big_Q1 * z) @ c1_plus + expm(k0 * big_Q1 * (z-d)) @ c1_minus)
 
-            Uy = V_21 @ (-expm(-k0 * big_Q1 * z) @ c1_plus + expm(k0 * big_Q1 * (z-d)) @ c1_minus) \
-                 + V_22 @ (-expm(-k0 * big_Q2 * z) @ c2_plus + expm(k0 * big_Q2 * (z-d)) @ c2_minus)
+def locate_layers(layer_info_list, z):
+    """
+    Layer of each depth z below the top of the first layer, counted from the top layer down, and the depth of the top
+    of each layer and of the transmission half-space. A depth on an interface belongs to the layer below, the bottom
+    of the stack to the last layer; depths above the stack get -1, those below it the number of layers.
+    """
+    thickness = [layer_info[-1] for layer_info in layer_info_list[::-1]]
+    top = np.cumsum([0] + thickness).real
+
+    z = np.asarray(z)
+    layer = np.where(z > top[-1], len(thickness), np.searchsorted(top[:-1], z, side='right') - 1)
+
+    return layer, top
+
+
+def layer_depths(layer_info_list, resolution_z=100, z_step=None, z=None):
+    """
+    Depths of the field samples in each layer below its top, from the top layer down.
+
+    Args:
+        resolution_z: uniform samples per layer, whatever its thickness. Used when z_step and z are None.
+        z_step: one sample every z_step through the whole stack from its top, so that a thin layer gets few samples
+            and the step is the same across interfaces
+        z: ascending depths below the top of the first layer, each sampled in the layer holding it (see locate_layers).
+            Those outside the stack are left to half_space_depths.
+
+    Returns:
+        list of arrays of depths, one per layer
+    """
+    if z_step is None and z is None:
+        return [np.arange(resolution_z) / resolution_z * layer_info[-1] for layer_info in layer_info_list[::-1]]
+
+    if z is None:
+        z = np.arange(0, np.sum([layer_info[-1] for layer_info in layer_info_list]).real, z_step)
+    if np.any(np.diff(z) < 0):
+        raise ValueError('z must be ascending')
+
+    layer, top = locate_layers(layer_info_list, z)
+
+    return [np.asarray(z)[layer == idx_layer] - top[idx_layer] for idx_layer in range(len(layer_info_list))]
+
+
+def half_space_depths(layer_info_list, z=None):
+    """
+    The depths z (see layer_depths) above and below the stack, as signed distances from its top and bottom:
+    negative in the incidence half-space, positive in the transmission one. Empty when z is None.
+    """
+    if z is None:
+        return np.zeros(0), np.zeros(0)
+
+    z = np.asarray(z)
+    layer, top = locate_layers(layer_info_list, z)
+
+    return z[layer == -1], z[layer == len(layer_info_list)] - top[-1]
+
+
+def field_rows(layer_info_list, resolution_z=100, z_step=None, z=None):
+    # number of depths of field_dist_*, in the layers and the half-spaces
+    if z is not None:
+        return len(z)
+    return sum(len(depth) for depth in layer_depths(layer_info_list, resolution_z, z_step))
+
+
+def slab_coefficients(coefficients, half_space, layer_info_list, T1, depths, above=(), below=(), n_I=1., n_II=1.,
+                      incidence=0):
+    """
+    Fourier coefficients of the fields of each layer at its depths, from the top layer down, preceded by those of the
+    incidence half-space at the distances above and followed by those of the transmission half-space at the distances
+    below, when there are any. The half-spaces take the fields on the outer interfaces of the stack.
+
+    Args:
+        coefficients: field_coefficients_* with the arguments before layer_info given
+        half_space: half_space_coefficients with the arguments before eps given
+        depths: see layer_depths
+        above, below: see half_space_depths
+        incidence: index of the incident harmonic
+    """
+    if len(above):
+        interface, _ = coefficients(layer_info_list[-1], T1, np.zeros(1))
+        yield half_space(n_I ** 2, interface[0], above, incidence)
+
+    T_layer = T_last = T1
+    for layer_info, depth in zip(layer_info_list[::-1], depths):
+        coeffs, T_next = coefficients(layer_info, T_layer, depth)
+        yield coeffs
+        T_layer, T_last = T_next, T_layer
+
+    if len(below):
+        interface, _ = coefficients(layer_info_list[0], T_last, np.array([layer_info_list[0][-1]]))
+        yield half_space(n_II ** 2, interface[0], below)
+
+
+def field_at_points(grating_type, wavelength, n_I, theta, phi, fourier_order, T1, layer_info_list, period, x, y, z,
+                    pol=0, type_complex=np.complex128, truncation=None, n_II=1.):
+    """
+    Fields at arbitrary points, for monitors such as planes, lines or probes. Only the layers holding some of the
+    points are evaluated, each at the depths of its own points, and the layers below the deepest point are not visited.
+
+    Args:
+        x, y, z: coordinates, broadcast together. z is the depth below the top of the first layer; a point on an
+            interface belongs to the layer below, as in field_dist_2d. Points above or below the stack are in the
+            incidence or transmission half-space, see half_space_coefficients. The incidence phase in y is included,
+            unlike in field_dist_1d_conical.
+
+    Returns:
+        array of the broadcast shape of the coordinates plus one axis of field_components(grating_type, pol)
+    """
+    k0 = 2 * np.pi / wavelength
 
-            Sz = -1j * E_conv_i @ (Kx @ Uy - ky * Ux)
+    if grating_type == 2:
+        order_x, order_y = fourier_orders_2d(fourier_order, truncation)
+    else:
+        order_x = np.arange(-fourier_order, fourier_order + 1)
+        order_y = 0 * order_x
+    if grating_type == 0:
+        phi = 0
 
-            Uz = -1j * (Kx @ Sy - ky * Sx)
+    kx_vector = k0 * (n_I * np.sin(theta) * np.cos(phi) - order_x * (wavelength / period[0])).astype(type_complex)
+    ky_vector = k0 * (n_I * np.sin(theta) * np.sin(phi) - order_y * (wavelength / period[-1])).astype(type_complex)
 
-            for j in range(resolution_y):
-                for i in range(resolution_x):
-                    x = i * period[0] / resolution_x
+    Kx = kx_vector / k0
+    Ky = ky_vector / k0
 
-                    exp_K = np.exp(-1j*kx_vector.reshape((-1, 1)) * x)
-                    # exp_K = exp_K.flatten()
+    if grating_type == 0:
+        coefficients = partial(field_coefficients_1d, pol, k0, Kx)
+    elif grating_type == 1:
+        coefficients = partial(field_coefficients_1d_conical, k0, Kx, Ky[0])
+    else:
+        coefficients = partial(field_coefficients_2d, k0, Kx, Ky)
+    half_space = partial(half_space_coefficients, grating_type, pol, k0, Kx, Ky[0] if grating_type == 1 else Ky)
+
+    x, y, z = np.broadcast_arrays(x, y, z)
+    shape = z.shape
+    x, y, z = x.ravel(), y.ravel(), z.ravel()
+
+    # the region of each point, from -1 above the stack to len(layer_info_list) below it, and its depth there
+    layer, top = locate_layers(layer_info_list, z)
+    z = z - top[np.maximum(layer, 0)]
+    regions = range(-1, len(layer_info_list) + 1)
+
+    # the points of a plane share their depth, one product per depth,
+    index = [np.nonzero(layer == region)[0] for region in regions]
+    depth, inverse, counts = zip(*[np.unique(z[idx], return_inverse=True, return_counts=True) for idx in index])
+
+    slabs = slab_coefficients(coefficients, half_space, layer_info_list, T1, depth[1:-1], depth[0], depth[-1],
+                              n_I=n_I, n_II=n_II, incidence=np.flatnonzero((order_x == 0) & (order_y == 0))[0])
+    visited = [region for region in regions if region <= layer.max(initial=-1)
+               and (len(depth[region + 1]) or 0 <= region < len(layer_info_list))]
+
+    field = np.zeros((len(z), 3 if grating_type == 0 else 6), dtype=type_complex)
+
+    for region, coeffs in zip(visited, slabs):
+        idx, idx_inverse, idx_counts = index[region + 1], inverse[region + 1], counts[region + 1]
+
+        # and those of a grid their x and y
+        x_value, index_x = np.unique(x[idx], return_inverse=True)
+        y_value, index_y = np.unique(y[idx], return_inverse=True)
+        phase = np.exp(-1j * x_value[:, None] * kx_vector)[index_x.ravel()] \
+            * np.exp(-1j * y_value[:, None] * ky_vector)[index_y.ravel()]
+        parts = np.split(np.argsort(idx_inverse.ravel(), kind='stable'), np.cumsum(idx_counts)[:-1])
+        for coeffs_depth, part in zip(coeffs, parts):
+            field[idx[part]] = phase[part] @ coeffs_depth
+
+    return field.reshape(shape + field.shape[-1:])
+
+
+def interface_flux(grating_type, wavelength, n_I, theta, phi, fourier_order, T1, layer_info_list, period, pol=0,
+                   type_complex=np.complex128, truncation=None):
+    """
+    Power flowing down through the top of each layer, from the top layer down, and through the bottom of the stack,
+    per unit incident power: 1 - sum(de_ri) on top and sum(de_ti) at the bottom. By Parseval, the z-component of the
+    Poynting vector averaged over a period is a sum over the harmonics of the field coefficients on the interface, so
+    it takes one product per interface and no field synthesis.
+
+    Returns:
+        array of len(layer_info_list) + 1 fluxes
+    """
+    k0 = 2 * np.pi / wavelength
 
-                    Ex = Sx.T @ exp_K
-                    Ey = Sy.T @ exp_K
-                    Ez = Sz.T @ exp_K
+    if grating_type == 2:
+        order_x, order_y = fourier_orders_2d(fourier_order, truncation)
+    else:
+        order_x = np.arange(-fourier_order, fourier_order + 1)
+        order_y = 0 * order_x
+    if grating_type == 0:
+        phi = 0
 
-                    Hx = -1j * Ux.T @ exp_K
-                    Hy = -1j * Uy.T @ exp_K
-                    Hz = -1j * Uz.T @ exp_K
+    Kx = (n_I * np.sin(theta) * np.cos(phi) - order_x * (wavelength / period[0])).astype(type_complex)
+    Ky = (n_I * np.sin(theta) * np.sin(phi) - order_y * (wavelength / period[-1])).astype(type_complex)
 
-                    field_cell[resolution_z * idx_layer + k, j, i] = [Ex[0, 0], Ey[0, 0], Ez[0, 0], Hx[0, 0], Hy[0, 0], Hz[0, 0]]
+    if grating_type == 0:
+        coefficients = partial(field_coefficients_1d, pol, k0, Kx)
+    elif grating_type == 1:
+        coefficients = partial(field_coefficients_1d_conical, k0, Kx, Ky[0])
+    else:
+        coefficients = partial(field_coefficients_2d, k0, Kx, Ky)
 
-        T_layer = big_A_i @ big_X @ T_layer
+    # the top of each layer, and the bottom of the last one
+    depths = [np.zeros(1)] * (len(layer_info_list) - 1) + [np.array([0, layer_info_list[0][-1]])]
+    interfaces = np.concatenate(list(slab_coefficients(coefficients, None, layer_info_list, T1, depths)))
 
-    return field_cell
+    components = field_components(grating_type, pol)
+    E_x, E_y, H_x, H_y = [interfaces[..., components.index(name)] if name in components else 0
+                          for name in ('Ex', 'Ey', 'Hx', 'Hy')]
+    flux = (E_x * np.conj(H_y) - E_y * np.conj(H_x)).real.sum(-1)
 
+    # that of the incident wave, of unit E (H for TM)
+    incident = n_I * np.cos(theta) if grating_type or pol == 0 else np.cos(theta) / n_I
 
-def field_dist_2d(wavelength, n_I, theta, phi, fourier_order, T1, layer_info_list, period, resolution=(100, 100, 100),
-                  type_complex=np.complex128):
+    return flux / incident
 
-    k0 = 2 * np.pi / wavelength
-    fourier_indices = np.arange(-fourier_order, fourier_order + 1)
-    ff = 2 * fourier_order + 1
 
-    kx_vector = k0 * (n_I * np.sin(theta) * np.cos(phi) - fourier_indices * (
-            wavelength / period[0])).astype(type_complex)
-    ky_vector = k0 * (n_I * np.sin(theta) * np.sin(phi) - fourier_indices * (
-            wavelength / period[1])).astype(type_complex)
+def field_components(grating_type, pol=0):
+    # names of the last axis of the field arrays
+    if grating_type == 0:
+        return ('Ey', 'Hx', 'Hz') if pol == 0 else ('Hy', 'Ex', 'Ez')
+
+    return 'Ex', 'Ey', 'Ez', 'Hx', 'Hy', 'Hz'
+
+
+def select_components(field, names, components=None, dtype=None):
+    """
+    Keep some components of a field array, and cast it for storage.
+
+    Args:
+        field: array whose last axis holds the components names
+        names: see field_components
+        components: names to keep, in order: any of names, and '|E|2' or '|H|2' for the squared norm of the electric or
+            magnetic field. None for all of names.
+        dtype: complex storage dtype, e.g. np.complex64. None to keep that of field.
+
+    Returns:
+        field with len(components) components. Real when only norms are kept.
+    """
+    dtype = np.dtype(field.dtype if dtype is None else dtype)
+    if components is None:
+        return field.astype(dtype, copy=False)
+
+    res = []
+    for component in components:
+        if component in ('|E|2', '|H|2'):
+            index = [i for i, name in enumerate(names) if name[0] == component[1]]
+            res.append((abs(field[..., index]) ** 2).sum(-1))
+        elif component in names:
+            res.append(field[..., names.index(component)])
+        else:
+            raise ValueError(f'unknown field component {component}; use {names}, |E|2 or |H|2')
 
-    Kx = np.diag(np.tile(kx_vector, ff).flatten()) / k0
-    Ky = np.diag(np.tile(ky_vector.reshape((-1, 1)), ff).flatten()) / k0
+    if all(component in ('|E|2', '|H|2') for component in components):
+        dtype = np.empty(0, dtype=dtype).real.dtype
 
-    resolution_z, resolution_y, resolution_x = resolution
-    field_cell = np.zeros((resolution_z * len(layer_info_list), resolution_y, resolution_x, 6), dtype=type_complex)
+    return np.stack(res, axis=-1).astype(dtype, copy=False)
 
-    T_layer = T1
 
-    big_I = np.eye((len(T1)), dtype=type_complex)
+def field_coefficients_1d(pol, k0, Kx, layer_info, T_layer, z):
+    """
+    Fourier coefficients of the fields of one layer of a 1D grating at depths z below its top:
+    (Ey, Hx, Hz) for TE, (Hy, Ex, Ez) for TM.
 
-    # From the first layer
-    for idx_layer, (E_conv_i, q, W_11, W_12, W_21, W_22, V_11, V_12, V_21, V_22, big_X, big_A_i, big_B, d)\
-            in enumerate(layer_info_list[::-1]):
+    Returns:
+        (z, harmonics, 3) coefficients, and T_layer of the next layer
+    """
+    E_conv_i, q, W, X, a, b, d = layer_info
 
-        c = np.block([[big_I], [big_B @ big_A_i @ big_X]]) @ T_layer
+    T_next = np.linalg.solve(a, X * T_layer)
 
-        ff = len(c) // 4
+    c1 = T_layer[:, None]
+    c2 = b @ T_next[:, None]
 
-        c1_plus = c[0*ff:1*ff]
-        c2_plus = c[1*ff:2*ff]
-        c1_minus = c[2*ff:3*ff]
-        c2_minus = c[3*ff:4*ff]
+    # diagonal propagators, (harmonics, z)
+    X_plus = np.exp(-k0 * q[:, None] * z)
+    X_minus = np.exp(k0 * q[:, None] * (z - d))
 
-        q1 = q[:len(q)//2]
-        q2 = q[len(q)//2:]
-        big_Q1 = np.diag(q1)
-        big_Q2 = np.diag(q2)
+    if pol == 0:  # TE
+        V = W * q
 
-        for k in range(resolution_z):
-            z = k / resolution_z * d
+        Sy = W @ (X_plus * c1 + X_minus * c2)
+        Ux = V @ (-X_plus * c1 + X_minus * c2)
 
-            Sx = W_11 @ (expm(-k0 * big_Q1 * z) @ c1_plus + expm(k0 * big_Q1 * (z-d)) @ c1_minus) \
-                 + W_12 @ (expm(-k0 * big_Q2 * z) @ c2_plus + expm(k0 * big_Q2 * (z-d)) @ c2_minus)
+        coeffs = [Sy, -1j * Ux, -1j * Kx[:, None] * Sy]
 
-            Sy = W_21 @ (expm(-k0 * big_Q1 * z) @ c1_plus + expm(k0 * big_Q1 * (z-d)) @ c1_minus) \
-                 + W_22 @ (expm(-k0 * big_Q2 * z) @ c2_plus + expm(k0 * big_Q2 * (z-d)) @ c2_minus)
+    else:  # TM
+        EKx = E_conv_i * Kx
+        # the solver's o_E_conv @ W * q, from its eigenproblem o_E_conv @ W * q ** 2 = (Kx E_conv_i Kx - I) @ W
+        V = (Kx[:, None] * EKx - np.eye(len(Kx))) @ W / q
 
-            Ux = V_11 @ (-expm(-k0 * big_Q1 * z) @ c1_plus + expm(k0 * big_Q1 * (z-d)) @ c1_minus) \
-                 + V_12 @ (-expm(-k0 * big_Q2 * z) @ c2_plus + expm(k0 * big_Q2 * (z-d)) @ c2_minus)
+        Uy = W @ (X_plus * c1 + X_minus * c2)
+        Sx = V @ (-X_plus * c1 + X_minus * c2)
 
-            Uy = V_21 @ (-expm(-k0 * big_Q1 * z) @ c1_plus + expm(k0 * big_Q1 * (z-d)) @ c1_minus) \
-                 + V_22 @ (-expm(-k0 * big_Q2 * z) @ c2_plus + expm(k0 * big_Q2 * (z-d)) @ c2_minus)
+        coeffs = [Uy, 1j * Sx, -1j * EKx @ Uy]  # there is a better option for convergence
 
-            Sz = -1j * E_conv_i @ (Kx @ Uy - Ky @ Ux)
+    return np.stack(coeffs, axis=-1).swapaxes(0, 1), T_next
 
-            Uz = -1j * (Kx @ Sy - Ky @ Sx)
 
-            for j in range(resolution_y):
-                y = j * period[1] / resolution_y
+def field_coefficients_1d_conical(k0, Kx, Ky, layer_info, T_layer, z):
+    """
+    Fourier coefficients of Ex, Ey, Ez, Hx, Hy, Hz of one layer of a conical 1D grating at depths z below its top.
 
-                for i in range(resolution_x):
-                    x = i * period[0] / resolution_x
+    Returns:
+        (z, harmonics, 6) coefficients, and T_layer of the next layer
+    """
+    E_conv_i, q_1, q_2, W_1, W_2, V_11, V_12, V_21, V_22, big_X, big_A, big_B, d = layer_info
 
-                    exp_K = np.exp(-1j*kx_vector.reshape((1, -1)) * x) * np.exp(-1j*ky_vector.reshape((-1, 1)) * y)
-                    exp_K = exp_K.flatten()
+    T_next = np.linalg.solve(big_A, big_X[:, None] * T_layer)
+    c1_plus, c2_plus, c1_minus, c2_minus = np.concatenate([T_layer, big_B @ T_next]).reshape((4, -1, 1))
 
-                    Ex = Sx.T @ exp_K
-                    Ey = Sy.T @ exp_K
-                    Ez = Sz.T @ exp_K
+    # diagonal propagators, (harmonics, z)
+    X1_plus, X1_minus = np.exp(-k0 * q_1[:, None] * z), np.exp(k0 * q_1[:, None] * (z-d))
+    X2_plus, X2_minus = np.exp(-k0 * q_2[:, None] * z), np.exp(k0 * q_2[:, None] * (z-d))
 
-                    Hx = -1j * Ux.T @ exp_K
-                    Hy = -1j * Uy.T @ exp_K
-                    Hz = -1j * Uz.T @ exp_K
+    Sx = W_2 @ (X2_plus * c2_plus + X2_minus * c2_minus)
 
-                    field_cell[resolution_z * idx_layer + k, j, i] = [Ex[0], Ey[0], Ez[0], Hx[0], Hy[0], Hz[0]]
-        T_layer = big_A_i @ big_X @ T_layer
+    Sy = V_11 @ (X1_plus * c1_plus + X1_minus * c1_minus) \
+        + V_12 @ (X2_plus * c2_plus + X2_minus * c2_minus)
 
-    return field_cell
+    Ux = W_1 @ (-X1_plus * c1_plus + X1_minus * c1_minus)
+
+    Uy = V_21 @ (-X1_plus * c1_plus + X1_minus * c1_minus) \
+        + V_22 @ (-X2_plus * c2_plus + X2_minus * c2_minus)
+
+    Sz = -1j * E_conv_i @ (Kx[:, None] * Uy - Ky * Ux)
+
+    Uz = -1j * (Kx[:, None] * Sy - Ky * Sx)
+
+    coeffs = [Sx, Sy, Sz, -1j * Ux, -1j * Uy, -1j * Uz]
+
+    return np.stack(coeffs, axis=-1).swapaxes(0, 1), T_next
+
+
+def field_coefficients_2d(k0, Kx, Ky, layer_info, T_layer, z):
+    """
+    Fourier coefficients of Ex, Ey, Ez, Hx, Hy, Hz of one layer of a 2D grating at depths z below its top.
+
+    Returns:
+        (z, harmonics, 6) coefficients, and T_layer of the next layer
+    """
+    E_conv_i, q, W_11, W_12, W_21, W_22, V_11, V_12, V_21, V_22, big_X, big_A, big_B, d = layer_info
+
+    T_next = np.linalg.solve(big_A, big_X[:, None] * T_layer)
+    c1_plus, c2_plus, c1_minus, c2_minus = np.concatenate([T_layer, big_B @ T_next]).reshape((4, -1, 1))
+
+    q1 = q[:len(q)//2, None]
+    q2 = q[len(q)//2:, None]
+
+    # diagonal propagators, (harmonics, z)
+    X1_plus, X1_minus = np.exp(-k0 * q1 * z), np.exp(k0 * q1 * (z-d))
+    X2_plus, X2_minus = np.exp(-k0 * q2 * z), np.exp(k0 * q2 * (z-d))
+
+    Sx = W_11 @ (X1_plus * c1_plus + X1_minus * c1_minus) \
+        + W_12 @ (X2_plus * c2_plus + X2_minus * c2_minus)
+
+    Sy = W_21 @ (X1_plus * c1_plus + X1_minus * c1_minus) \
+        + W_22 @ (X2_plus * c2_plus + X2_minus * c2_minus)
+
+    Ux = V_11 @ (-X1_plus * c1_plus + X1_minus * c1_minus) \
+        + V_12 @ (-X2_plus * c2_plus + X2_minus * c2_minus)
+
+    Uy = V_21 @ (-X1_plus * c1_plus + X1_minus * c1_minus) \
+        + V_22 @ (-X2_plus * c2_plus + X2_minus * c2_minus)
+
+    Sz = -1j * E_conv_i @ (Kx[:, None] * Uy - Ky[:, None] * Ux)
+
+    Uz = -1j * (Kx[:, None] * Sy - Ky[:, None] * Sx)
+
+    coeffs = [Sx, Sy, Sz, -1j * Ux, -1j * Uy, -1j * Uz]
+
+    return np.stack(coeffs, axis=-1).swapaxes(0, 1), T_next
+
+
+def half_space_coefficients(grating_type, pol, k0, Kx, Ky, eps, interface, z, incidence=None):
+    """
+    Fourier coefficients of the fields in the incidence or transmission half-space, of permittivity eps, at signed
+    distances z from its interface with the stack: negative above the stack, positive below it.
+
+    Each harmonic is a pair of plane waves there, going up and down. Only the waves leaving the stack are kept, and
+    the incident one above it: these are the Rayleigh expansions of the reflected and transmitted orders, so no
+    padding layer is needed to see them. As in the solver, their amplitudes follow from the tangential E on the
+    interface (H for TM), minus the incident wave above the stack.
+
+    Args:
+        interface: (harmonics, components) coefficients on the interface, from field_coefficients_*
+        incidence: index of the incident harmonic above the stack, None below it
+
+    Returns:
+        (z, harmonics, components) coefficients
+    """
+    q = (Kx ** 2 + Ky ** 2 - eps) ** 0.5
+    # the down-going wave decays, or propagates with kz = -1j * k0 * q > 0
+    q = np.where((q.real == 0) & (q.imag < 0), -q, q)
+
+    one, zero = np.ones_like(q), np.zeros_like(q)
+
+    # as in a uniform layer, per harmonic: even = M_even @ (c_plus + c_minus), odd = M_odd @ (c_minus - c_plus)
+    if grating_type == 0:
+        M_even = one[:, None, None]
+        M_odd = (q if pol == 0 else q / eps)[:, None, None]
+        even, odd = interface[:, :1], (1j if pol == 0 else -1j) * interface[:, 1:2]
+    else:
+        if grating_type == 1:
+            a, b = Kx ** 2 - eps, Kx ** 2 / eps - 1
+            M_even = np.array([[zero, one], [q / a, Ky * Kx / a]])
+            M_odd = np.array([[one, zero], [Ky * Kx / (eps * b), q / b]])
+        else:
+            M_even = np.array([[one, zero], [zero, one]])
+            M_odd = np.array([[-Kx * Ky, Kx ** 2 - eps], [eps - Ky ** 2, Kx * Ky]]) / q
+        M_even, M_odd = np.moveaxis(M_even, -1, 0), np.moveaxis(M_odd, -1, 0)
+        even, odd = interface[:, :2], 1j * interface[:, 3:5]
+
+    c_sum = np.linalg.solve(M_even, even[..., None])[..., 0]
+
+    z = np.asarray(z)[:, None, None]
+    q = q[:, None]
+    if incidence is None:  # below the stack, going down
+        plus = c_sum * np.exp(-k0 * q * z)
+        minus = np.zeros_like(plus)
+    else:  # above it, going up, and the incident wave, whose exponent alone is taken not to overflow the others
+        incident = (np.arange(len(q)) == incidence)[:, None]
+        if grating_type == 0:  # unit amplitude, as delta_i0 in the solver
+            c_plus = incident * np.ones_like(c_sum)
+        else:
+            c_plus = incident * (c_sum - np.linalg.solve(M_odd, odd[..., None])[..., 0]) / 2
+        plus = c_plus * np.exp(-k0 * np.where(incident, q, 0) * z)
+        minus = (c_sum - c_plus) * np.exp(k0 * q * z)
+
+    even = (M_even @ (plus + minus)[..., None])[..., 0]
+    odd = (M_odd @ (minus - plus)[..., None])[..., 0]
+
+    if grating_type == 0:
+        if pol == 0:  # TE
+            Sy, Ux = even[..., 0], odd[..., 0]
+            coeffs = [Sy, -1j * Ux, -1j * Kx * Sy]
+        else:  # TM
+            Uy, Sx = even[..., 0], odd[..., 0]
+            coeffs = [Uy, 1j * Sx, -1j * Kx / eps * Uy]
+    else:
+        Sx, Sy = even[..., 0], even[..., 1]
+        Ux, Uy = odd[..., 0], odd[..., 1]
+        Sz = -1j / eps * (Kx * Uy - Ky * Ux)
+        Uz = -1j * (Kx * Sy - Ky * Sx)
+        coeffs = [Sx, Sy, Sz, -1j * Ux, -1j * Uy, -1j * Uz]
+
+    return np.stack(coeffs, axis=-1)
+
+
+def fourier_series_1d(coeffs, kx_vector, x):
+    # (..., harmonics, component) to (..., x, component), in one product
+    exp_K = np.exp(-1j * kx_vector[:, None] * x)
+
+    return (coeffs.swapaxes(-1, -2) @ exp_K).swapaxes(-1, -2)
+
+
+def fourier_series_2d(coeffs, order_x, order_y, kx_vector, ky_vector, x, y):
+    # (..., harmonics, component) to (..., y, x, component).
+    # The basis is separable: scattered onto their (order_y, order_x) grid, the harmonics take two products.
+    index_x, index_y = order_x - order_x.min(), order_y - order_y.min()
+
+    exp_x = np.zeros((index_x.max() + 1, len(x)), dtype=coeffs.dtype)
+    exp_x[index_x] = np.exp(-1j * kx_vector[:, None] * x)
+    exp_y = np.zeros((len(y), index_y.max() + 1), dtype=coeffs.dtype)
+    exp_y[:, index_y] = np.exp(-1j * y[:, None] * ky_vector)
+
+    grid = np.zeros(coeffs.shape[:-2] + coeffs.shape[-1:] + (index_y.max() + 1, index_x.max() + 1), dtype=coeffs.dtype)
+    grid[..., index_y, index_x] = coeffs.swapaxes(-1, -2)
+
+    return np.moveaxis(exp_y @ grid @ exp_x, -3, -1)
+
+
+def fourier_series_grid(coeffs, order_x, order_y, kx0, ky0, period, shape):
+    """
+    fourier_series_2d on the uniform (y, x) grid of the given shape over one period, by inverse FFT.
+    The wavevector of order (m, n) is (kx0 - 2 pi m / period[0], ky0 - 2 pi n / period[1]), so on this grid its
+    exponential is the offset phase exp(-1j (kx0 x + ky0 y)) times a DFT kernel: the coefficients are added into
+    a spectrum of the grid shape, orders beyond the grid onto their alias, and each plane takes one ifft2.
+
+    Returns:
+        (..., y, x, component)
+    """
+    resolution_y, resolution_x = shape
+
+    index = (order_y % resolution_y) * resolution_x + order_x % resolution_x
+    spectrum = np.zeros(coeffs.shape[:-2] + coeffs.shape[-1:] + (resolution_y * resolution_x,), dtype=coeffs.dtype)
+    np.add.at(spectrum, (Ellipsis, index), coeffs.swapaxes(-1, -2))
+
+    spectrum = spectrum.reshape(spectrum.shape[:-1] + (resolution_y, resolution_x))
+    res = np.fft.ifft2(spectrum, norm='forward')
+
+    x = np.arange(resolution_x) * period[0] / resolution_x
+    y = np.arange(resolution_y) * period[1] / resolution_y
+    res *= np.exp(-1j * (kx0 * x + ky0 * y[:, None]))
+
+    return np.moveaxis(res, -3, -1)
 
 
 def field_plot_zx(field_cell, pol=0, plot_indices=(1, 1, 1, 1, 1, 1), y_slice=0, z_slice=-1, zx=True, yx=False):
@@ -0,0 +1,82 @@
+import hashlib
+
+import numpy as np
+
+from collections import OrderedDict
+from pathlib import Path
+
+
+class LayerCache:
+    """
+    LRU cache of per-layer modal data (q, W, V and their inverses).
+
+    Entries are keyed by a content hash of everything the eigenproblem depends on
+    (convolution matrices, wavelength, incidence), so one instance can be shared between solvers and designs.
+    If cache_dir is given, entries are also written there as .npz and reused by later processes.
+    """
+
+    def __init__(self, maxsize=128, cache_dir=None):
+        self.maxsize = maxsize
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    @staticmethod
+    def make_key(*items):
+        h = hashlib.sha1()
+        for item in items:
+            if isinstance(item, np.ndarray):
+                item = np.ascontiguousarray(item)
+                h.update(str((item.shape, item.dtype.str)).encode())
+                h.update(item.tobytes())
+            else:
+                h.update(repr(item).encode())
+            h.update(b'|')
+        return h.hexdigest()
+
+    def get(self, key):
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return self._cache[key]
+
+        if self.cache_dir is not None:
+            path = self.cache_dir / f'{key}.npz'
+            if path.exists():
+                with np.load(path) as data:
+                    value = tuple(data[str(i)] if str(i) in data else None for i in range(int(data['n'])))
+                self._put_memory(key, value)
+                self.hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        value = tuple(value)
+        self._put_memory(key, value)
+
+        if self.cache_dir is not None:
+            arrays = {str(i): v for i, v in enumerate(value) if v is not None}
+            np.savez(self.cache_dir / f'{key}.npz', n=len(value), **arrays)
+
+    def _put_memory(self, key, value):
+        self._cache[key] = value
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+    def clear(self, disk=False):
+        self._cache.clear()
+        self.hits = 0
+        self.misses = 0
+        if disk and self.cache_dir is not None:
+            for path in self.cache_dir.glob('*.npz'):
+                path.unlink()
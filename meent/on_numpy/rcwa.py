@@ -1,20 +1,27 @@
-import time
 import numpy as np
 
+from itertools import product
+
 from ._base import _BaseRCWA
-from .convolution_matrix import to_conv_mat_piecewise_constant, put_permittivity_in_ucell, read_material_table
-from .field_distribution import field_dist_1d, field_dist_1d_conical, field_dist_2d, field_plot_zx
+from .layer_cache import LayerCache
+from .convolution_matrix import to_conv_mat_piecewise_constant, to_conv_mat_pair_piecewise_constant, \
+    to_conv_mat_normal_vector, put_permittivity_in_ucell, read_material_table
+from .field_distribution import field_dist_1d, field_dist_1d_conical, field_dist_2d, field_plot_zx, field_slabs_1d, \
+    field_slabs_1d_conical, field_slabs_2d, field_components, select_components, field_at_points, field_rows, \
+    interface_flux
 
 
 class RCWANumpy(_BaseRCWA):
     def __init__(self, mode=0, grating_type=0, n_I=1., n_II=1., theta=0, phi=0, psi=0, fourier_order=40, period=(100,),
                  wavelength=900, pol=0, patterns=None, ucell=None, ucell_materials=None,
                  thickness=None, algo='TMM', perturbation=1E-10,
-                 device='cpu', type_complex=np.complex128):
+                 device='cpu', type_complex=np.complex128, layer_cache=None, mirror_symmetry=None,
+                 truncation=None, factorization=None, keep_cascade=False):
 
         super().__init__(grating_type, n_I, n_II, theta, phi, psi, fourier_order, period, wavelength, pol, patterns,
                          ucell, ucell_materials,
-                         thickness, algo, perturbation, device, type_complex)
+                         thickness, algo, perturbation, device, type_complex, layer_cache, mirror_symmetry,
+                         truncation, factorization, keep_cascade)
 
         self.device = 'cpu'
         self.mode = mode
@@ -23,64 +30,388 @@ class RCWANumpy(_BaseRCWA):
         self.mat_table = read_material_table()
         self.layer_info_list = []
 
+        # convolution matrices of the last solve, for update_layer
+        self.conv_all = None
+
+        # convolution matrices of the material indicators of each layer of ucell, see ucell_conv
+        self.indicator_conv = None
+
+        # normal-vector convolution matrices of ucell, see normal_vector_conv
+        self.normal_conv = None
+
     def put_permittivity_in_ucell(self):
         ucell = put_permittivity_in_ucell(self.ucell, self.ucell_materials, self.mat_table, self.wavelength,
                                           type_complex=self.type_complex)
         return ucell
 
     def to_conv_mat(self, ucell):
-        E_conv_all = to_conv_mat_piecewise_constant(ucell, self.fourier_order, type_complex=self.type_complex)
+        E_conv_all = to_conv_mat_piecewise_constant(ucell, self.fourier_order, type_complex=self.type_complex,
+                                                    truncation=self.truncation)
         return E_conv_all
 
-    def solve(self, wavelength, e_conv_all, o_e_conv_all):
+    def solve(self, wavelength, e_conv_all, o_e_conv_all, jones=None, update_layer=None):
 
         self.get_kx_vector()
 
         if self.grating_type == 0:
-            de_ri, de_ti = self.solve_1d(wavelength, e_conv_all, o_e_conv_all)
+            if jones is not None:
+                raise ValueError('TE and TM are solved separately in 1D; use grating_type=1 to solve them together')
+            de_ri, de_ti = self.solve_1d(wavelength, e_conv_all, o_e_conv_all, update_layer=update_layer)
         elif self.grating_type == 1:
-            de_ri, de_ti = self.solve_1d_conical(wavelength, e_conv_all, o_e_conv_all)
+            de_ri, de_ti = self.solve_1d_conical(wavelength, e_conv_all, o_e_conv_all, jones=jones,
+                                                 update_layer=update_layer)
         elif self.grating_type == 2:
-            de_ri, de_ti = self.solve_2d(wavelength, e_conv_all, o_e_conv_all)
+            de_ri, de_ti = self.solve_2d(wavelength, e_conv_all, o_e_conv_all, self.normal_vector_conv(), jones=jones,
+                                         update_layer=update_layer)
         else:
             raise ValueError
 
+        self.conv_all = e_conv_all, o_e_conv_all
+
         return de_ri.real, de_ti.real
 
-    def run_ucell(self):
+    def normal_vector_conv(self):
+        # depends on the material layout only, not on the wavelength: kept until ucell changes, as in ucell_conv
+        if self.factorization != 'normal_vector':
+            return None
 
-        ucell = put_permittivity_in_ucell(self.ucell, self.ucell_materials, self.mat_table, self.wavelength,
-                                          type_complex=self.type_complex)
+        ucell = np.asarray(self.ucell)
+        key = ucell.shape, ucell.tobytes(), tuple(self.period), self.fourier_order, self.truncation
+
+        if self.normal_conv is None or self.normal_conv[0] != key:
+            self.normal_conv = key, to_conv_mat_normal_vector(ucell, self.period, self.fourier_order,
+                                                              type_complex=self.type_complex,
+                                                              truncation=self.truncation)
+
+        return self.normal_conv[1]
+
+    def ucell_conv(self, wavelength):
+        """
+        E_conv_all and o_E_conv_all of ucell.
+
+        A scalar wavelength builds them from the permittivity directly. An array of wavelengths uses that both are
+        linear in the permittivity of each material: E_conv = sum_m eps_m * C_m and o_E_conv = sum_m C_m / eps_m,
+        where C_m is the convolution matrix of the indicator of material m in the layer. The C_m of the materials
+        each layer contains depend on the geometry only and are kept until ucell changes, so each wavelength
+        costs a weighted sum.
+
+        Args:
+            wavelength: scalar, or array of wavelengths whose axes then follow the layer axis
+
+        Returns:
+            E_conv_all, o_E_conv_all
+        """
+        if np.ndim(wavelength) == 0:
+            ucell = put_permittivity_in_ucell(self.ucell, self.ucell_materials, self.mat_table, wavelength,
+                                              type_complex=self.type_complex)
+            return to_conv_mat_pair_piecewise_constant(ucell, self.fourier_order, type_complex=self.type_complex,
+                                                       truncation=self.truncation)
+
+        ucell = np.asarray(self.ucell)
+        key = ucell.shape, ucell.tobytes(), self.fourier_order, self.truncation
+
+        if self.indicator_conv is None or self.indicator_conv[0] != key:
+            # indicators of all (layer, material present in it) pairs, converted in one pass
+            materials = [np.unique(layer) for layer in ucell]
+            indicator = np.concatenate([layer == m[:, None, None] for layer, m in zip(ucell, materials)])
+            conv = to_conv_mat_piecewise_constant(indicator.astype(self.type_complex), self.fourier_order,
+                                                  type_complex=self.type_complex, truncation=self.truncation)
+            conv = np.split(conv, np.cumsum([len(m) for m in materials])[:-1])
+            self.indicator_conv = key, list(zip(materials, conv))
+
+        # (..., material)
+        eps = put_permittivity_in_ucell(np.arange(len(self.ucell_materials)), self.ucell_materials, self.mat_table,
+                                        wavelength, type_complex=self.type_complex)
+
+        E_conv_all = np.stack([np.einsum('...m,mij->...ij', eps[..., m], c) for m, c in self.indicator_conv[1]])
+        o_E_conv_all = np.stack([np.einsum('...m,mij->...ij', 1 / eps[..., m], c) for m, c in self.indicator_conv[1]])
+
+        return E_conv_all, o_E_conv_all
+
+    def run_ucell(self):
 
-        E_conv_all = to_conv_mat_piecewise_constant(ucell, self.fourier_order, type_complex=self.type_complex)
-        o_E_conv_all = to_conv_mat_piecewise_constant(1 / ucell, self.fourier_order, type_complex=self.type_complex)
+        E_conv_all, o_E_conv_all = self.ucell_conv(self.wavelength)
 
         # apply to other backends (removing wavelength arg)
-        de_ri, de_ti = self.solve(E_conv_all, o_E_conv_all)
+        de_ri, de_ti = self.solve(self.wavelength, E_conv_all, o_E_conv_all)
+
+        return de_ri, de_ti
+
+    def update_layer(self, layer_index, ucell_layer):
+        """
+        Re-solve after replacing one layer of ucell, with everything else as in the previous run_ucell.
+        The cascade runs from the last layer upward, so the layers below the changed one are not redone:
+        only its modes, the cascade steps from it upward and the final system. That needs the cascade of the
+        previous solve, kept with keep_cascade=True; otherwise the first call solves all layers and turns it on.
+
+        Args:
+            layer_index: index of the layer in ucell
+            ucell_layer: new material layout of that layer
+
+        Returns:
+            de_ri, de_ti
+        """
+        if self.algo != 'TMM' or self.conv_all is None:
+            raise ValueError('update_layer needs a previous TMM solve')
+
+        self.ucell[layer_index] = ucell_layer
+
+        ucell = put_permittivity_in_ucell(self.ucell[layer_index:layer_index + 1], self.ucell_materials,
+                                          self.mat_table, self.wavelength, type_complex=self.type_complex)
+
+        E_conv_all, o_E_conv_all = (np.array(conv) for conv in self.conv_all)
+        E_conv_layer, o_E_conv_layer = to_conv_mat_pair_piecewise_constant(ucell, self.fourier_order,
+                                                                           type_complex=self.type_complex,
+                                                                           truncation=self.truncation)
+        E_conv_all[layer_index], o_E_conv_all[layer_index] = E_conv_layer[0], o_E_conv_layer[0]
+
+        update = layer_index if self.cascade_states else None
+        self.keep_cascade = True
+        de_ri, de_ti = self.solve(self.wavelength, E_conv_all, o_E_conv_all, update_layer=update)
 
         return de_ri, de_ti
 
-    def calculate_field(self, resolution=None, plot=True):
+    def run_ucell_polarizations(self, psi=None, jones=None):
+        """
+        Solve several incident polarizations at once. The eigenmodes and the cascade do not depend on the polarization,
+        so they are computed once and only the final system gets one right-hand side per polarization.
+
+        Args:
+            psi: polarization angles in degrees (90 for TE, 0 for TM). None for TE and TM.
+            jones: (2, n) complex (TE, TM) amplitudes of the incident waves instead of psi, e.g. for elliptical
+                polarization. Efficiencies are relative to |TE|^2 + |TM|^2 = 1.
+
+        Returns:
+            de_ri, de_ti with a leading polarization axis, and the complex amplitudes (R_s, R_p, T_s, T_p) laid out
+            the same way. The fields of each polarization are left to run_ucell with the matching pol.
+        """
+        if jones is None:
+            psi = np.array((90, 0) if psi is None else psi, dtype=float).reshape(-1) * np.pi / 180
+            jones = np.stack([np.sin(psi), np.cos(psi)])
+
+        E_conv_all, o_E_conv_all = self.ucell_conv(self.wavelength)
+
+        de_ri, de_ti = self.solve(self.wavelength, E_conv_all, o_E_conv_all, jones=jones)
+
+        return de_ri, de_ti, self.amplitudes
+
+    def sweep_thickness(self, layer_index, values):
+        """
+        Solve over the thicknesses of one layer.
+
+        Args:
+            layer_index: index of the layer in thickness
+            values: thicknesses of that layer
+
+        Returns:
+            de_ri, de_ti with a leading axis over values.
+        """
+        return self.sweep_thickness_grid([layer_index], [values])
+
+    def sweep_thickness_grid(self, layer_indices, values_list):
+        """
+        Solve over the grid of thicknesses of several layers.
+        The eigenmodes do not depend on the thickness, so the convolution matrices and eigenmodes are computed once
+        and only the cascade and the final system are repeated at each point.
+
+        Args:
+            layer_indices: indices of the layers in thickness
+            values_list: thicknesses of each of those layers
+
+        Returns:
+            de_ri, de_ti with one leading axis per layer, in the order of layer_indices.
+        """
+        E_conv_all, o_E_conv_all = self.ucell_conv(self.wavelength)
+
+        # the modes are reused through the layer cache; a private one holds them if none is set
+        layer_cache_backup, thickness_backup = self.layer_cache, self.thickness
+        if self.layer_cache is None:
+            self.layer_cache = LayerCache(maxsize=len(thickness_backup))
+
+        de_ri_list, de_ti_list = [], []
+
+        try:
+            for point in product(*values_list):
+                self.thickness = list(thickness_backup)
+                for layer_index, d in zip(layer_indices, point):
+                    self.thickness[layer_index] = d
+
+                de_ri, de_ti = self.solve(self.wavelength, E_conv_all, o_E_conv_all)
+
+                de_ri_list.append(de_ri)
+                de_ti_list.append(de_ti)
+        finally:
+            self.layer_cache, self.thickness = layer_cache_backup, thickness_backup
+            self.conv_all = None  # the cascade states are those of the last point
+
+        shape = tuple(len(values) for values in values_list)
+
+        return np.reshape(de_ri_list, shape + np.shape(de_ri)), np.reshape(de_ti_list, shape + np.shape(de_ti))
+
+    def solve_spectrum(self, wavelengths, batch_size=None):
+        """
+        Solve all wavelengths at once by stacking them on a leading batch axis.
+
+        Args:
+            wavelengths: 1D array of wavelengths
+            batch_size: number of wavelengths solved together. None to solve all of them in one batch.
+
+        Returns:
+            de_ri, de_ti with the wavelength axis first.
+        """
+        if self.algo != 'TMM':
+            raise ValueError
+
+        wavelengths = np.asarray(wavelengths, dtype=float).reshape(-1)
+        batch_size = len(wavelengths) if batch_size is None else batch_size
+
+        wavelength_backup = self.wavelength
+        de_ri_list, de_ti_list = [], []
+
+        try:
+            for i in range(0, len(wavelengths), batch_size):
+                wls = wavelengths[i:i + batch_size]
+
+                # (layer, wavelength, N, N)
+                E_conv_all, o_E_conv_all = self.ucell_conv(wls)
+
+                # per-wavelength scalars broadcast against the harmonic axis
+                self.wavelength = wls[:, None]
+                de_ri, de_ti = self.solve(self.wavelength, E_conv_all, o_E_conv_all)
+
+                de_ri_list.append(de_ri)
+                de_ti_list.append(de_ti)
+        finally:
+            self.wavelength = wavelength_backup
+            self.conv_all = None  # the cascade states are those of the last batch
+
+        return np.concatenate(de_ri_list), np.concatenate(de_ti_list)
+
+    def field_slabs(self, resolution=None, synthesis='dense', components=None, dtype=None, z_step=None, z=None):
+        """
+        calculate_field one layer at a time, from the top layer down, so that only one layer is held in memory.
+
+        Args:
+            resolution, synthesis, z_step, z: as calculate_field
+            components: names of the components to keep, see select_components; e.g. ['|E|2']. None for all.
+            dtype: complex storage dtype, e.g. np.complex64. None for type_complex.
+
+        Yields:
+            (depths, resolution_y, resolution_x, component) array per layer, and per half-space that z reaches
+        """
+        resolution = self._field_resolution(resolution)
+
+        if self.grating_type == 0:
+            slabs = field_slabs_1d(self.wavelength, self.n_I, self.theta, self.fourier_order, self.T1,
+                                   self.layer_info_list, self.period, self.pol, resolution=resolution,
+                                   type_complex=self.type_complex, synthesis=synthesis, z_step=z_step, z=z,
+                                   n_II=self.n_II)
+        elif self.grating_type == 1:
+            slabs = field_slabs_1d_conical(self.wavelength, self.n_I, self.theta, self.phi, self.fourier_order,
+                                           self.T1, self.layer_info_list, self.period, resolution=resolution,
+                                           type_complex=self.type_complex, synthesis=synthesis, z_step=z_step, z=z,
+                                           n_II=self.n_II)
+        else:
+            slabs = field_slabs_2d(self.wavelength, self.n_I, self.theta, self.phi, self.fourier_order, self.T1,
+                                   self.layer_info_list, self.period, resolution=resolution,
+                                   type_complex=self.type_complex, truncation=self.truncation, synthesis=synthesis,
+                                   z_step=z_step, z=z, n_II=self.n_II)
+
+        names = field_components(self.grating_type, self.pol)
+        for slab in slabs:
+            yield select_components(slab, names, components, dtype)
+
+    def save_field(self, path, resolution=None, synthesis='dense', components=None, dtype=None, z_step=None, z=None):
+        """
+        Write calculate_field to a .npy file through a memory map, one layer at a time: the volume is never
+        held in memory.
+
+        Args:
+            path: .npy file to write
+            resolution, synthesis, components, dtype, z_step, z: as field_slabs
+
+        Returns:
+            the memory-mapped array, of shape (depths, resolution_y, resolution_x, component)
+        """
+        resolution_z, resolution_y, resolution_x = self._field_resolution(resolution)
+
+        rows = field_rows(self.layer_info_list, resolution_z, z_step, z)
+
+        res = None
+        row = 0
+        slabs = self.field_slabs(resolution, synthesis=synthesis, components=components, dtype=dtype, z_step=z_step,
+                                 z=z)
+        for slab in slabs:
+            if res is None:
+                shape = (rows, resolution_y, resolution_x, slab.shape[-1])
+                res = np.lib.format.open_memmap(path, mode='w+', dtype=slab.dtype, shape=shape)
+            res[row:row + len(slab)] = slab
+            row += len(slab)
+            res.flush()
+
+        return res
+
+    def field_at(self, x, y, z):
+        """
+        Fields of the last run_ucell at the points (x, y, z), broadcast together, computing only the layers that hold
+        them: e.g. a plane under the structure from x and y grids at one z, or a few probe points. See field_at_points.
+
+        Returns:
+            array of the broadcast shape of x, y and z plus one axis of components, in the order of calculate_field
+        """
+        return field_at_points(self.grating_type, self.wavelength, self.n_I, self.theta, self.phi, self.fourier_order,
+                               self.T1, self.layer_info_list, self.period, x, y, z, pol=self.pol,
+                               type_complex=self.type_complex, truncation=self.truncation, n_II=self.n_II)
+
+    def flux_at_interfaces(self):
+        """
+        Power flowing down through the top of each layer of the last run_ucell, from the top layer down, and through
+        the bottom of the stack, per unit incident power. Computed from the modal amplitudes on the interfaces, without
+        any field grid; see interface_flux.
+        """
+        return interface_flux(self.grating_type, self.wavelength, self.n_I, self.theta, self.phi, self.fourier_order,
+                              self.T1, self.layer_info_list, self.period, pol=self.pol, type_complex=self.type_complex,
+                              truncation=self.truncation)
+
+    def absorption_per_layer(self):
+        """
+        Fraction of the incident power absorbed in each layer of the last run_ucell, from the top layer down: the
+        difference of the fluxes through its top and bottom. They add up to 1 - sum(de_ri) - sum(de_ti).
+        """
+        flux = self.flux_at_interfaces()
+        return flux[:-1] - flux[1:]
+
+    def _field_resolution(self, resolution):
+        if resolution:
+            return resolution
+        return [100, 1, 100] if self.grating_type in (0, 1) else [100, 100, 100]
+
+    def calculate_field(self, resolution=None, plot=True, synthesis='dense', z_step=None, z=None):
+        """
+        Fields of the last run_ucell on a uniform grid in every layer, see field_dist_2d.
+        synthesis is 'dense' (matrix products) or 'fft' (inverse FFT per plane). z_step or z sample z by a step or at
+        given depths through the stack instead of resolution_z per layer, see layer_depths; z may reach into the
+        incidence and transmission half-spaces, negative above the stack and beyond its thickness below it.
+        """
+        resolution = self._field_resolution(resolution)
 
         if self.grating_type == 0:
-            resolution = [100, 1, 100] if not resolution else resolution
             field_cell = field_dist_1d(self.wavelength, self.n_I, self.theta, self.fourier_order, self.T1,
                                        self.layer_info_list, self.period, self.pol, resolution=resolution,
-                                       type_complex=self.type_complex)
+                                       type_complex=self.type_complex, synthesis=synthesis, z_step=z_step, z=z,
+                                       n_II=self.n_II)
         elif self.grating_type == 1:
-            resolution = [100, 1, 100] if not resolution else resolution
             field_cell = field_dist_1d_conical(self.wavelength, self.n_I, self.theta, self.phi, self.fourier_order,
                                                self.T1,
                                                self.layer_info_list, self.period, resolution=resolution,
-                                               type_complex=self.type_complex)
+                                               type_complex=self.type_complex, synthesis=synthesis, z_step=z_step,
+                                               z=z, n_II=self.n_II)
 
         else:
-            resolution = [100, 100, 100] if not resolution else resolution
-            t0 = time.time()
             field_cell = field_dist_2d(self.wavelength, self.n_I, self.theta, self.phi, self.fourier_order, self.T1,
                                        self.layer_info_list, self.period, resolution=resolution,
-                                       type_complex=self.type_complex)
-            print(time.time() - t0)
+                                       type_complex=self.type_complex, truncation=self.truncation,
+                                       synthesis=synthesis, z_step=z_step, z=z, n_II=self.n_II)
         if plot:
             field_plot_zx(field_cell, self.pol)
 
@@ -0,0 +1,161 @@
+import numpy as np
+
+from functools import lru_cache
+from itertools import product
+
+
+def incidence_mirrors(n_I, theta, phi, tol=1E-10):
+    """
+    Mirror planes allowed by the incidence: the x (y) mirror needs no in-plane wavevector along x (y).
+    """
+    mirrors = []
+    if abs(n_I * np.sin(theta) * np.cos(phi)) < tol:
+        mirrors.append('x')
+    if abs(n_I * np.sin(theta) * np.sin(phi)) < tol:
+        mirrors.append('y')
+
+    return tuple(mirrors)
+
+
+def _mirror_permutation(orders, mirror):
+    # index map of m -> -m (x mirror) or n -> -n (y mirror) on the kept harmonics (see fourier_orders_2d)
+    order_x, order_y = orders
+    index = {(m, n): i for i, (m, n) in enumerate(zip(order_x, order_y))}
+
+    if mirror == 'x':
+        return np.array([index[(-m, n)] for m, n in zip(order_x, order_y)])
+    return np.array([index[(m, -n)] for m, n in zip(order_x, order_y)])
+
+
+def _invariant(conv, perm, tol):
+    return np.abs(conv[..., perm[:, None], perm] - conv).max() <= tol * np.abs(conv).max()
+
+
+def _mirror_phase(conv_list, perm, order, tol):
+    """
+    Position of a mirror plane as alpha = 2 * pi * x0 / period (modulo pi), i.e. the phase for which
+    exp(1j * alpha * (m - m')) * conv is invariant under the mirror. None if the layer has no such plane.
+    """
+    diff = order[:, None] - order[None, :]
+
+    # the largest coefficient that is odd in the mirror fixes alpha up to pi / k
+    conv = conv_list[0].reshape((-1,) + conv_list[0].shape[-2:])[0]
+    weight = np.where(diff != 0, np.abs(conv), 0)
+    i, j = np.unravel_index(np.argmax(weight), weight.shape)
+
+    if weight[i, j] <= tol * np.abs(conv).max():
+        candidates = [0.]
+    else:
+        k = diff[i, j]
+        angle = np.angle(conv[perm[i], perm[j]] / conv[i, j])
+        candidates = (angle + 2 * np.pi * np.arange(abs(k))) / (2 * k)
+
+    for alpha in candidates:
+        phase = np.exp(1j * alpha * diff)
+        if all(_invariant(phase * conv, perm, tol) for conv in conv_list):
+            return float(alpha)
+
+    return None
+
+
+def find_mirror_symmetry(E_conv, o_E_conv, orders, mirrors=('x', 'y'), tol=1E-10):
+    """
+    Mirror planes of a 2D layer among `mirrors`, found on its convolution matrices.
+    A plane may sit anywhere in the cell; its position is returned as a phase (see _mirror_phase).
+
+    Returns:
+        tuple of (mirror, alpha) for the planes that hold
+    """
+    order_x, order_y = orders
+
+    symmetry = []
+    for mirror in mirrors:
+        order = order_x if mirror == 'x' else order_y
+        alpha = _mirror_phase((E_conv, o_E_conv), _mirror_permutation(orders, mirror), order, tol)
+        if alpha is not None:
+            symmetry.append((mirror, alpha))
+
+    return tuple(symmetry)
+
+
+def symmetrize_k(orders, Kx, Ky, symmetry):
+    """
+    Kx (Ky) made exactly odd under the x (y) mirror, i.e. without the perturbation that keeps the zeroth order off 0,
+    so that the modes solved per sector are exact modes of the layer.
+    """
+    mirrors = [mirror for mirror, _ in symmetry]
+    if 'x' in mirrors:
+        Kx = (Kx - Kx[..., _mirror_permutation(orders, 'x')]) / 2
+    if 'y' in mirrors:
+        Ky = (Ky - Ky[..., _mirror_permutation(orders, 'y')]) / 2
+
+    return Kx, Ky
+
+
+@lru_cache(maxsize=16)
+def _sector_bases(order_x, order_y, mirrors):
+    orders = np.array(order_x), np.array(order_y)
+    n = len(order_x)
+
+    # signed permutations (index map, sign, power of each mirror) of the group generated by the mirrors.
+    # A mirror acts as blockdiag(P, -P) on the [x; y] halves of the modal vector.
+    group = [(np.arange(2 * n), np.ones(2 * n), ())]
+    for mirror in mirrors:
+        perm = np.tile(_mirror_permutation(orders, mirror), 2) + np.repeat([0, n], n)
+        sign = np.repeat([1., -1.], n)
+        group = [(p, s, powers + (0,)) for p, s, powers in group] \
+            + [(perm[p], sign[p] * s, powers + (1,)) for p, s, powers in group]
+
+    # one representative per orbit; projecting it onto each sector gives that sector's basis vector, if any
+    reps = np.flatnonzero(np.min([p for p, _, _ in group], axis=0) == np.arange(2 * n))
+    cols = np.arange(len(reps))
+
+    bases = []
+    for parity in product((1, -1), repeat=len(mirrors)):
+        basis = np.zeros((2 * n, len(reps)))
+        for p, s, powers in group:
+            character = np.prod([c ** k for c, k in zip(parity, powers)])
+            np.add.at(basis, (p[reps], cols), character * s[reps])
+
+        norm = np.linalg.norm(basis, axis=0)
+        bases.append(basis[:, norm > 0.5] / norm[norm > 0.5])
+
+    return bases
+
+
+def mirror_sector_bases(orders, symmetry):
+    """
+    Orthonormal bases of the symmetry sectors of the 2D layer eigenproblem (size 2 * number of harmonics).
+    The eigenproblem is block diagonal on them: up to 4 blocks, each a quarter of the size.
+
+    Args:
+        orders: (order_x, order_y) of the kept harmonics
+        symmetry: (mirror, alpha) pairs from find_mirror_symmetry
+
+    Returns:
+        list of (2 * number of harmonics, n_sector) matrices
+    """
+    order_x, order_y = orders
+    bases = _sector_bases(tuple(order_x.tolist()), tuple(order_y.tolist()), tuple(mirror for mirror, _ in symmetry))
+
+    alpha = dict(symmetry)
+    if not any(alpha.values()):
+        return bases
+
+    phase = np.tile(np.exp(-1j * (alpha.get('x', 0) * order_x + alpha.get('y', 0) * order_y)), 2)
+
+    return [phase[:, None] * basis for basis in bases]
+
+
+def eig_sectors(a, bases):
+    """
+    eig of a matrix that is block diagonal on the given orthonormal bases, solved one block at a time.
+    """
+    eigenvalues, eigenvectors = [], []
+    for basis in bases:
+        basis = basis.astype(a.dtype)
+        w, v = np.linalg.eig(basis.conj().T @ a @ basis)
+        eigenvalues.append(w)
+        eigenvectors.append(basis @ v)
+
+    return np.concatenate(eigenvalues, axis=-1), np.concatenate(eigenvectors, axis=-1)
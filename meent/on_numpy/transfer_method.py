@@ -1,5 +1,63 @@
 import numpy as np
 
+from .convolution_matrix import fourier_orders_2d
+from .symmetry import eig_sectors
+
+# Diagonal operators (Kx, Ky, Y_I, Z_I, X, F_c, F_s, ...) are carried as their diagonals
+# and applied by broadcasting: diag(d) @ m == d[..., :, None] * m and m @ diag(d) == m * d[..., None, :].
+
+
+def diag(x):
+    # np.diag that also accepts stacked vectors: (..., N) -> (..., N, N)
+    return x[..., None] * np.eye(x.shape[-1], dtype=x.dtype)
+
+
+def solve_left(a, b, a_i=None):
+    # a^-1 @ b without forming the inverse, unless it is already known (e.g. in closed form)
+    if a_i is not None:
+        return a_i @ b
+    return np.linalg.solve(a, b)
+
+
+def solve_right(a, *b_list):
+    # b @ a^-1 for every b in b_list, sharing one LU factorization of a
+    batch_shape = np.broadcast_shapes(a.shape[:-2], *[b.shape[:-2] for b in b_list])
+    b = np.concatenate([np.broadcast_to(b, batch_shape + b.shape[-2:]) for b in b_list], axis=-2)
+
+    x = np.linalg.solve(np.swapaxes(a, -1, -2), np.swapaxes(b, -1, -2))
+    x = np.swapaxes(x, -1, -2)
+
+    return np.split(x, np.cumsum([b.shape[-2] for b in b_list])[:-1], axis=-2)
+
+
+def block_diag(a, b, c, d):
+    # [[diag(a), diag(b)], [diag(c), diag(d)]]
+    return np.block([[diag(a), diag(b)], [diag(c), diag(d)]])
+
+
+def block_diag_inv(a, b, c, d):
+    # inverse of block_diag(a, b, c, d) in closed form
+    det = a * d - b * c
+    return block_diag(d / det, -b / det, -c / det, a / det)
+
+
+def homogeneous_permittivity(E_conv, o_E_conv, tol=1E-10):
+    """
+    Permittivity of a uniform layer, whose convolution matrices are eps * I and I / eps.
+
+    Returns:
+        eps with the batch shape of E_conv (and a trailing axis for broadcasting), or None if the layer is patterned.
+    """
+    eps = E_conv[..., :1, 0]
+    I = np.eye(E_conv.shape[-1])
+
+    if np.abs(E_conv - eps[..., None] * I).max() > tol * np.abs(eps).max():
+        return None
+    if np.abs(o_E_conv - I / eps[..., None]).max() > tol * np.abs(1 / eps).max():
+        return None
+
+    return eps
+
 
 def transfer_1d_1(ff, polarization, k0, n_I, n_II, kx_vector, theta, delta_i0, fourier_order,
                   type_complex=np.complex128):
@@ -12,24 +70,24 @@ def transfer_1d_1(ff, polarization, k0, n_I, n_II, kx_vector, theta, delta_i0, f
     k_I_z = k_I_z.conjugate()
     k_II_z = k_II_z.conjugate()
 
-    Kx = np.diag(kx_vector / k0)
+    Kx = kx_vector / k0
 
     f = np.eye(ff, dtype=type_complex)
 
     if polarization == 0:  # TE
-        Y_I = np.diag(k_I_z / k0)
-        Y_II = np.diag(k_II_z / k0)
+        Y_I = k_I_z / k0
+        Y_II = k_II_z / k0
 
         YZ_I = Y_I
-        g = 1j * Y_II
+        g = diag(1j * Y_II)
         inc_term = 1j * n_I * np.cos(theta) * delta_i0
 
     elif polarization == 1:  # TM
-        Z_I = np.diag(k_I_z / (k0 * n_I ** 2))
-        Z_II = np.diag(k_II_z / (k0 * n_II ** 2))
+        Z_I = k_I_z / (k0 * n_I ** 2)
+        Z_II = k_II_z / (k0 * n_II ** 2)
 
         YZ_I = Z_I
-        g = 1j * Z_II
+        g = diag(1j * Z_II)
         inc_term = 1j * delta_i0 * np.cos(theta) / n_I
 
     else:
@@ -40,30 +98,84 @@ def transfer_1d_1(ff, polarization, k0, n_I, n_II, kx_vector, theta, delta_i0, f
     return kx_vector, Kx, k_I_z, k_II_z, f, YZ_I, g, inc_term, T
 
 
-def transfer_1d_2(k0, q, d, W, V, f, g, fourier_order, T, type_complex=np.complex128):
+def transfer_1d_wv(polarization, Kx, E_conv, o_E_conv, type_complex=np.complex128):
+
+    if polarization == 0:
+        E_conv_i = None
+        A = diag(Kx ** 2) - E_conv
+        eigenvalues, W = np.linalg.eig(A)
+        q = eigenvalues ** 0.5
+
+        V = W * q[..., None, :]
+
+    elif polarization == 1:
+        # E_conv_i is kept explicitly for the field calculation
+        E_conv_i = np.linalg.inv(E_conv)
+        B = Kx[..., :, None] * E_conv_i * Kx[..., None, :] - np.eye(E_conv.shape[-1], dtype=type_complex)
+
+        eigenvalues, W = np.linalg.eig(np.linalg.solve(o_E_conv, B))
+        q = eigenvalues ** 0.5
+
+        V = o_E_conv @ W * q[..., None, :]
+
+    else:
+        raise ValueError
+
+    # W and V are factorized in the cascade (transfer_1d_2)
+    W_i = None
+    V_i = None
+
+    return E_conv_i, q, W, V, W_i, V_i
+
+
+def transfer_1d_wv_homogeneous(polarization, Kx, eps):
+    # uniform layer: A (or o_E_conv_i @ B) is diagonal, so W = I and q is known
+
+    q = (Kx ** 2 - eps) ** 0.5
+    W = diag(np.ones_like(q))
+
+    if polarization == 0:
+        E_conv_i = None
+        V = diag(q)
+        V_i = diag(1 / q)
+
+    elif polarization == 1:
+        E_conv_i = diag(np.ones_like(q) / eps)
+        V = diag(q / eps)
+        V_i = diag(eps / q)
+
+    else:
+        raise ValueError
+
+    return E_conv_i, q, W, V, W, V_i
 
-    X = np.diag(np.exp(-k0 * q * d))
 
-    W_i = np.linalg.inv(W)
-    V_i = np.linalg.inv(V)
+def transfer_1d_2(k0, q, d, W, V, W_i, V_i, f, g, fourier_order, T, type_complex=np.complex128):
 
-    a = 0.5 * (W_i @ f + V_i @ g)
-    b = 0.5 * (W_i @ f - V_i @ g)
+    X = np.exp(-k0 * q * d)
 
-    a_i = np.linalg.inv(a)
+    W_i_f = solve_left(W, f, W_i)
+    V_i_g = solve_left(V, g, V_i)
 
-    f = W @ (np.eye(2 * fourier_order + 1, dtype=type_complex) + X @ b @ a_i @ X)
-    g = V @ (np.eye(2 * fourier_order + 1, dtype=type_complex) - X @ b @ a_i @ X)
-    T = T @ a_i @ X
+    a = 0.5 * (W_i_f + V_i_g)
+    b = 0.5 * (W_i_f - V_i_g)
 
-    return X, f, g, T, a_i, b
+    b_a_i, T_a_i = solve_right(a, b, T)
+
+    X_b_a_i_X = X[..., :, None] * b_a_i * X[..., None, :]
+
+    f = W @ (np.eye(2 * fourier_order + 1, dtype=type_complex) + X_b_a_i_X)
+    g = V @ (np.eye(2 * fourier_order + 1, dtype=type_complex) - X_b_a_i_X)
+    T = T_a_i * X[..., None, :]
+
+    return X, f, g, T, a, b
 
 
 def transfer_1d_3(g1, YZ_I, f1, delta_i0, inc_term, T, k_I_z, k0, n_I, n_II, theta, polarization, k_II_z):
 
-    T1 = np.linalg.inv(g1 + 1j * YZ_I @ f1) @ (1j * YZ_I @ delta_i0 + inc_term)
-    R = f1 @ T1 - delta_i0
-    T = T @ T1
+    T1 = np.linalg.solve(g1 + 1j * YZ_I[..., :, None] * f1, (1j * YZ_I * delta_i0 + inc_term)[..., None])[..., 0]
+    R = (f1 @ T1[..., None])[..., 0] - delta_i0
+    T = (T @ T1[..., None])[..., 0]
 
     de_ri = np.real(R * np.conj(R) * k_I_z / (k0 * n_I * np.cos(theta)))
     if polarization == 0:
@@ -78,10 +190,33 @@ def transfer_1d_3(g1, YZ_I, f1, delta_i0, inc_term, T, k_I_z, k0, n_I, n_II, the
     return de_ri, de_ti, T1
 
 
-def transfer_1d_conical_1(ff, k0, n_I, n_II, kx_vector, theta, phi, type_complex=np.complex128):
+def incidence_rhs(psi, theta, n_I, delta_i0, jones=None):
+    """
+    Right-hand side of the final system (AX=B) of the conical and 2D cascades: the incident plane wave.
 
-    I = np.eye(ff, dtype=type_complex)
-    O = np.zeros((ff, ff), dtype=type_complex)
+    Args:
+        psi: polarization angle (90 deg for TE, 0 for TM), used if jones is None
+        jones: (2, n) complex (TE, TM) amplitudes of n incident waves, e.g. [[1, 0], [0, 1]] for TE and TM together.
+            The system is linear in them, so any polarization is a combination of the TE and TM columns.
+
+    Returns:
+        (4 * number of harmonics, n) matrix with one column per incident wave; a single column for psi
+    """
+    if jones is None:
+        jones = np.array([[np.sin(psi)], [np.cos(psi)]])
+    a_s, a_p = jones
+
+    delta_i0 = delta_i0.reshape(-1, 1)
+
+    return np.concatenate([
+        -a_s * delta_i0,
+        -a_p * np.cos(theta) * delta_i0,
+        -1j * a_s * n_I * np.cos(theta) * delta_i0,
+        1j * n_I * a_p * delta_i0
+    ])
+
+
+def transfer_1d_conical_1(ff, k0, n_I, n_II, kx_vector, theta, phi, type_complex=np.complex128):
 
     # kx_vector = k0 * (n_I * np.sin(theta) * np.cos(phi) - fourier_indices * (wavelength / period[0])
     #                   ).astype(type_complex)
@@ -94,37 +229,43 @@ def transfer_1d_conical_1(ff, k0, n_I, n_II, kx_vector, theta, phi, type_complex
     k_I_z = k_I_z.conjugate()
     k_II_z = k_II_z.conjugate()
 
-    Kx = np.diag(kx_vector / k0)
+    Kx = kx_vector / k0
 
     varphi = np.arctan(ky / kx_vector)
 
-    Y_I = np.diag(k_I_z / k0)
-    Y_II = np.diag(k_II_z / k0)
+    Y_I = k_I_z / k0
+    Y_II = k_II_z / k0
 
-    Z_I = np.diag(k_I_z / (k0 * n_I ** 2))
-    Z_II = np.diag(k_II_z / (k0 * n_II ** 2))
+    Z_I = k_I_z / (k0 * n_I ** 2)
+    Z_II = k_II_z / (k0 * n_II ** 2)
 
-    big_F = np.block([[I, O], [O, 1j * Z_II]])
-    big_G = np.block([[1j * Y_II, O], [O, I]])
+    one = np.ones_like(Y_II)
+    zero = np.zeros_like(Y_II)
+
+    big_F = block_diag(one, zero, zero, 1j * Z_II)
+    big_G = block_diag(1j * Y_II, zero, zero, one)
 
     big_T = np.eye(2 * ff, dtype=type_complex)
 
     return Kx, ky, k_I_z, k_II_z, varphi, Y_I, Y_II, Z_I, Z_II, big_F, big_G, big_T
 
 
-def transfer_1d_conical_2(k0, Kx, ky, E_conv, E_conv_i, o_E_conv_i, ff, d, varphi, big_F, big_G, big_T,
-                          type_complex=np.complex128):
+def transfer_1d_conical_wv(k0, Kx, ky, E_conv, o_E_conv, ff, varphi, type_complex=np.complex128):
 
     I = np.eye(ff, dtype=type_complex)
-    O = np.zeros((ff, ff), dtype=type_complex)
 
-    A = Kx ** 2 - E_conv
-    B = Kx @ E_conv_i @ Kx - I
-    A_i = np.linalg.inv(A)
-    B_i = np.linalg.inv(B)
+    # E_conv_i is kept explicitly for the field calculation
+    E_conv_i = np.linalg.inv(E_conv)
+
+    # per-wavelength scalars need one more axis to scale a stack of matrices
+    ky_m = np.expand_dims(ky, -1)
+    k0_m = np.expand_dims(k0, -1)
 
-    to_decompose_W_1 = ky ** 2 * I + A
-    to_decompose_W_2 = ky ** 2 * I + B @ o_E_conv_i
+    A = diag(Kx ** 2) - E_conv
+    B = Kx[..., :, None] * E_conv_i * Kx[..., None, :] - I
+
+    to_decompose_W_1 = ky_m ** 2 * I + A
+    to_decompose_W_2 = ky_m ** 2 * I + solve_right(o_E_conv, B)[0]
 
     eigenvalues_1, W_1 = np.linalg.eig(to_decompose_W_1)
     eigenvalues_2, W_2 = np.linalg.eig(to_decompose_W_2)
@@ -132,93 +273,131 @@ def transfer_1d_conical_2(k0, Kx, ky, E_conv, E_conv_i, o_E_conv_i, ff, d, varph
     q_1 = eigenvalues_1 ** 0.5
     q_2 = eigenvalues_2 ** 0.5
 
-    Q_1 = np.diag(q_1)
-    Q_2 = np.diag(q_2)
-
-    V_11 = A_i @ W_1 @ Q_1
-    V_12 = (ky / k0) * A_i @ Kx @ W_2
-    V_21 = (ky / k0) * B_i @ Kx @ E_conv_i @ W_1
-    V_22 = B_i @ W_2 @ Q_2
+    # one factorization of A and of B each, for two right-hand sides
+    A_i_rhs = np.linalg.solve(A, np.concatenate([W_1 * q_1[..., None, :], Kx[..., :, None] * W_2], axis=-1))
+    B_i_rhs = np.linalg.solve(B, np.concatenate([Kx[..., :, None] * (E_conv_i @ W_1), W_2 * q_2[..., None, :]],
+                                                axis=-1))
 
-    X_1 = np.diag(np.exp(-k0 * q_1 * d))
-    X_2 = np.diag(np.exp(-k0 * q_2 * d))
+    V_11 = A_i_rhs[..., :ff]
+    V_12 = (ky_m / k0_m) * A_i_rhs[..., ff:]
+    V_21 = (ky_m / k0_m) * B_i_rhs[..., :ff]
+    V_22 = B_i_rhs[..., ff:]
 
-    F_c = np.diag(np.cos(varphi))
-    F_s = np.diag(np.sin(varphi))
+    F_c = np.cos(varphi)[..., :, None]
+    F_s = np.sin(varphi)[..., :, None]
 
-    V_ss = F_c @ V_11
-    V_sp = F_c @ V_12 - F_s @ W_2
-    W_ss = F_c @ W_1 + F_s @ V_21
-    W_sp = F_s @ V_22
-    W_ps = F_s @ V_11
-    W_pp = F_c @ W_2 + F_s @ V_12
-    V_ps = F_c @ V_21 - F_s @ W_1
-    V_pp = F_c @ V_22
+    V_ss = F_c * V_11
+    V_sp = F_c * V_12 - F_s * W_2
+    W_ss = F_c * W_1 + F_s * V_21
+    W_sp = F_s * V_22
+    W_ps = F_s * V_11
+    W_pp = F_c * W_2 + F_s * V_12
+    V_ps = F_c * V_21 - F_s * W_1
+    V_pp = F_c * V_22
 
-    big_I = np.eye(2 * (len(I)), dtype=type_complex)
-    big_X = np.block([[X_1, O], [O, X_2]])
     big_W = np.block([[V_ss, V_sp], [W_ps, W_pp]])
     big_V = np.block([[W_ss, W_sp], [V_ps, V_pp]])
 
-    big_W_i = np.linalg.inv(big_W)
-    big_V_i = np.linalg.inv(big_V)
+    # big_W and big_V are factorized in the cascade (transfer_1d_conical_2)
+    big_W_i = None
+    big_V_i = None
 
-    big_A = 0.5 * (big_W_i @ big_F + big_V_i @ big_G)
-    big_B = 0.5 * (big_W_i @ big_F - big_V_i @ big_G)
+    return E_conv_i, q_1, q_2, W_1, W_2, V_11, V_12, V_21, V_22, big_W, big_V, big_W_i, big_V_i
 
-    big_A_i = np.linalg.inv(big_A)
 
-    big_F = big_W @ (big_I + big_X @ big_B @ big_A_i @ big_X)
-    big_G = big_V @ (big_I - big_X @ big_B @ big_A_i @ big_X)
+def transfer_1d_conical_wv_homogeneous(k0, Kx, ky, eps, varphi):
+    # uniform layer: every block is diagonal, so the modes and the inverses are elementwise
 
-    big_T = big_T @ big_A_i @ big_X
+    kx = Kx
+    a = kx ** 2 - eps
+    b = kx ** 2 / eps - 1
 
-    return big_X, big_F, big_G, big_T, big_A_i, big_B, W_1, W_2, V_11, V_12, V_21, V_22, q_1, q_2
+    q = (ky ** 2 + a) ** 0.5
+    one = np.ones_like(q)
 
+    v_11 = q / a
+    v_12 = (ky / k0) * kx / a
+    v_21 = (ky / k0) * kx / (eps * b)
+    v_22 = q / b
 
-def transfer_1d_conical_3(big_F, big_G, big_T, Z_I, Y_I, psi, theta, ff, delta_i0, k_I_z, k0, n_I, n_II, k_II_z,
+    c = np.cos(varphi)
+    s = np.sin(varphi)
+
+    big_W_diag = (c * v_11, c * v_12 - s, s * v_11, c + s * v_12)
+    big_V_diag = (c + s * v_21, s * v_22, c * v_21 - s, c * v_22)
+
+    return diag(one / eps), q, q, diag(one), diag(one), diag(v_11), diag(v_12), diag(v_21), diag(v_22), \
+        block_diag(*big_W_diag), block_diag(*big_V_diag), block_diag_inv(*big_W_diag), block_diag_inv(*big_V_diag)
+
+
+def transfer_1d_conical_2(k0, d, q_1, q_2, big_W, big_V, big_W_i, big_V_i, ff, big_F, big_G, big_T,
                           type_complex=np.complex128):
 
-    I = np.eye(ff, dtype=type_complex)
-    O = np.zeros((ff, ff), dtype=type_complex)
+    big_I = np.eye(2 * ff, dtype=type_complex)
+    big_X = np.exp(-k0 * np.concatenate([q_1, q_2], axis=-1) * d)
+
+    big_W_i_F = solve_left(big_W, big_F, big_W_i)
+    big_V_i_G = solve_left(big_V, big_G, big_V_i)
+
+    big_A = 0.5 * (big_W_i_F + big_V_i_G)
+    big_B = 0.5 * (big_W_i_F - big_V_i_G)
+
+    big_B_A_i, big_T_A_i = solve_right(big_A, big_B, big_T)
+
+    big_X_B_A_i_X = big_X[..., :, None] * big_B_A_i * big_X[..., None, :]
+
+    big_F = big_W @ (big_I + big_X_B_A_i_X)
+    big_G = big_V @ (big_I - big_X_B_A_i_X)
+
+    big_T = big_T_A_i * big_X[..., None, :]
 
-    big_F_11 = big_F[:ff, :ff]
-    big_F_12 = big_F[:ff, ff:]
-    big_F_21 = big_F[ff:, :ff]
-    big_F_22 = big_F[ff:, ff:]
+    return big_X, big_F, big_G, big_T, big_A, big_B
 
-    big_G_11 = big_G[:ff, :ff]
-    big_G_12 = big_G[:ff, ff:]
-    big_G_21 = big_G[ff:, :ff]
-    big_G_22 = big_G[ff:, ff:]
+
+def transfer_1d_conical_3(big_F, big_G, big_T, Z_I, Y_I, psi, theta, ff, delta_i0, k_I_z, k0, n_I, n_II, k_II_z,
+                          type_complex=np.complex128, jones=None):
+    # jones: see incidence_rhs. With it, efficiencies and amplitudes get a trailing axis, one entry per incident wave.
+
+    batch_shape = big_F.shape[:-2]
+    I = np.broadcast_to(np.eye(ff, dtype=type_complex), batch_shape + (ff, ff))
+    O = np.zeros(batch_shape + (ff, ff), dtype=type_complex)
+
+    big_F_11 = big_F[..., :ff, :ff]
+    big_F_12 = big_F[..., :ff, ff:]
+    big_F_21 = big_F[..., ff:, :ff]
+    big_F_22 = big_F[..., ff:, ff:]
+
+    big_G_11 = big_G[..., :ff, :ff]
+    big_G_12 = big_G[..., :ff, ff:]
+    big_G_21 = big_G[..., ff:, :ff]
+    big_G_22 = big_G[..., ff:, ff:]
 
     # Final Equation in form of AX=B
     final_A = np.block(
         [
             [I, O, -big_F_11, -big_F_12],
-            [O, -1j * Z_I, -big_F_21, -big_F_22],
-            [-1j * Y_I, O, -big_G_11, -big_G_12],
+            [O, diag(-1j * Z_I), -big_F_21, -big_F_22],
+            [diag(-1j * Y_I), O, -big_G_11, -big_G_12],
             [O, I, -big_G_21, -big_G_22],
         ]
     )
 
-    final_B = np.hstack([
-        [-np.sin(psi) * delta_i0],
-        [-np.cos(psi) * np.cos(theta) * delta_i0],
-        [-1j * np.sin(psi) * n_I * np.cos(theta) * delta_i0],
-        [1j * n_I * np.cos(psi) * delta_i0]
-    ]).T
+    final_B = incidence_rhs(psi, theta, n_I, delta_i0, jones)
 
-    final_RT = np.linalg.inv(final_A) @ final_B
+    final_RT = np.linalg.solve(final_A, final_B)
 
-    R_s = final_RT[:ff, :].flatten()
-    R_p = final_RT[ff:2 * ff, :].flatten()
+    R_s = final_RT[..., :ff, :]
+    R_p = final_RT[..., ff:2 * ff, :]
 
-    big_T1 = final_RT[2 * ff:, :]
+    big_T1 = final_RT[..., 2 * ff:, :]
     big_T = big_T @ big_T1
 
-    T_s = big_T[:ff, :].flatten()
-    T_p = big_T[ff:, :].flatten()
+    T_s = big_T[..., :ff, :]
+    T_p = big_T[..., ff:, :]
+
+    k_I_z = k_I_z[..., None]
+    k_II_z = k_II_z[..., None]
+    k0 = np.expand_dims(k0, -1)
 
     de_ri = R_s * np.conj(R_s) * np.real(k_I_z / (k0 * n_I * np.cos(theta))) \
             + R_p * np.conj(R_p) * np.real((k_I_z / n_I ** 2) / (k0 * n_I * np.cos(theta)))
@@ -226,14 +405,22 @@ def transfer_1d_conical_3(big_F, big_G, big_T, Z_I, Y_I, psi, theta, ff, delta_i
     de_ti = T_s * np.conj(T_s) * np.real(k_II_z / (k0 * n_I * np.cos(theta))) \
             + T_p * np.conj(T_p) * np.real((k_II_z / n_II ** 2) / (k0 * n_I * np.cos(theta)))
 
-    return de_ri.real, de_ti.real, big_T1
+    amplitudes = R_s, R_p, T_s, T_p
+    if jones is None:
+        de_ri, de_ti = de_ri[..., 0], de_ti[..., 0]
+        amplitudes = tuple(amplitude[..., 0] for amplitude in amplitudes)
+
+    return de_ri.real, de_ti.real, big_T1, amplitudes
 
 
 def transfer_2d_1(ff, k0, n_I, n_II, kx_vector, period, fourier_indices, theta, phi, wavelength,
-                  type_complex=np.complex128):
+                  type_complex=np.complex128, orders=None):
+    # orders: (order_x, order_y) of the kept harmonics (see fourier_orders_2d); None for the full ff x ff grid.
+    # fourier_indices are the y orders of ky_vector.
 
-    I = np.eye(ff ** 2, dtype=type_complex)
-    O = np.zeros((ff ** 2, ff ** 2), dtype=type_complex)
+    if orders is None:
+        orders = fourier_orders_2d(ff // 2)
+    order_x, order_y = orders
 
     # kx_vector = k0 * (n_I * np.sin(theta) * np.cos(phi) - fourier_indices * (
     #         wavelength / period[0])).astype(type_complex)
@@ -241,158 +428,234 @@ def transfer_2d_1(ff, k0, n_I, n_II, kx_vector, period, fourier_indices, theta,
     ky_vector = k0 * (n_I * np.sin(theta) * np.sin(phi) - fourier_indices * (
             wavelength / period[1])).astype(type_complex)
 
-    k_I_z = (k0 ** 2 * n_I ** 2 - kx_vector ** 2 - ky_vector.reshape((-1, 1)) ** 2) ** 0.5
-    k_II_z = (k0 ** 2 * n_II ** 2 - kx_vector ** 2 - ky_vector.reshape((-1, 1)) ** 2) ** 0.5
+    # wavevector of each kept harmonic
+    kx = kx_vector[..., order_x + kx_vector.shape[-1] // 2]
+    ky = ky_vector[..., order_y + ky_vector.shape[-1] // 2]
+
+    k_I_z = (k0 ** 2 * n_I ** 2 - kx ** 2 - ky ** 2) ** 0.5
+    k_II_z = (k0 ** 2 * n_II ** 2 - kx ** 2 - ky ** 2) ** 0.5
 
-    k_I_z = k_I_z.flatten().conjugate()
-    k_II_z = k_II_z.flatten().conjugate()
+    k_I_z = k_I_z.conjugate()
+    k_II_z = k_II_z.conjugate()
 
-    Kx = np.diag(np.tile(kx_vector, ff).flatten()) / k0
-    Ky = np.diag(np.tile(ky_vector.reshape((-1, 1)), ff).flatten()) / k0
+    Kx = kx / k0
+    Ky = ky / k0
 
-    varphi = np.arctan(ky_vector.reshape((-1, 1)) / kx_vector).flatten()
+    varphi = np.arctan(ky / kx)
 
-    Y_I = np.diag(k_I_z / k0)
-    Y_II = np.diag(k_II_z / k0)
+    Y_I = k_I_z / k0
+    Y_II = k_II_z / k0
 
-    Z_I = np.diag(k_I_z / (k0 * n_I ** 2))
-    Z_II = np.diag(k_II_z / (k0 * n_II ** 2))
+    Z_I = k_I_z / (k0 * n_I ** 2)
+    Z_II = k_II_z / (k0 * n_II ** 2)
 
-    big_F = np.block([[I, O], [O, 1j * Z_II]])
-    big_G = np.block([[1j * Y_II, O], [O, I]])
+    one = np.ones_like(Y_II)
+    zero = np.zeros_like(Y_II)
 
-    big_T = np.eye(ff ** 2 * 2, dtype=type_complex)
+    big_F = block_diag(one, zero, zero, 1j * Z_II)
+    big_G = block_diag(1j * Y_II, zero, zero, one)
+
+    big_T = np.eye(len(order_x) * 2, dtype=type_complex)
 
     return kx_vector, ky_vector, Kx, Ky, k_I_z, k_II_z, varphi, Y_I, Y_II, Z_I, Z_II, big_F, big_G, big_T
 
 
-def transfer_2d_wv(ff, Kx, E_conv_i, Ky, o_E_conv_i, E_conv, type_complex=np.complex128):
+def transfer_2d_wv(ff, Kx, E_conv_i, Ky, o_E_conv_i, E_conv, type_complex=np.complex128, sector_bases=None,
+                   normal_vector=None):
+    # normal_vector: (N_xx, N_xy, N_yy) from to_conv_mat_normal_vector for the normal-vector factorization.
+    # None keeps the fixed rule: inverse rule for Ex and Laurent rule for Ey.
 
-    I = np.eye(ff ** 2, dtype=type_complex)
+    I = np.eye(Kx.shape[-1], dtype=type_complex)
 
-    B = Kx @ E_conv_i @ Kx - I
-    D = Ky @ E_conv_i @ Ky - I
+    Kx_c, Kx_r = Kx[..., :, None], Kx[..., None, :]
+    Ky_c, Ky_r = Ky[..., :, None], Ky[..., None, :]
 
-    S2_from_S = np.block(
-        [
-            [Ky ** 2 + B @ o_E_conv_i, Kx @ (E_conv_i @ Ky @ E_conv - Ky)],
-            [Ky @ (E_conv_i @ Kx @ o_E_conv_i - Kx), Kx ** 2 + D @ E_conv]
-        ])
+    if normal_vector is None:
+        B = Kx_c * E_conv_i * Kx_r - I
+        D = Ky_c * E_conv_i * Ky_r - I
 
-    eigenvalues, W = np.linalg.eig(S2_from_S)
+        S2_from_S = np.block(
+            [
+                [diag(Ky ** 2) + B @ o_E_conv_i, Kx_c * ((E_conv_i * Ky_r) @ E_conv - diag(Ky))],
+                [Ky_c * ((E_conv_i * Kx_r) @ o_E_conv_i - diag(Kx)), diag(Kx ** 2) + D @ E_conv]
+            ])
 
-    q = eigenvalues ** 0.5
+        U1_from_S = np.block(
+            [
+                [diag(-Kx * Ky), diag(Kx ** 2) - E_conv],
+                [o_E_conv_i - diag(Ky ** 2), diag(Ky * Kx)]
+            ]
+        )
 
-    Q = np.diag(q)
-    Q_i = np.linalg.inv(Q)
-    U1_from_S = np.block(
-        [
-            [-Kx @ Ky, Kx ** 2 - E_conv],
-            [o_E_conv_i - Ky ** 2, Ky @ Kx]
-        ]
-    )
-    V = U1_from_S @ W @ Q_i
+    else:
+        # in-plane permittivity tensor: Laurent rule for the tangential and inverse rule for the normal component.
+        # delta and N do not commute; the symmetric product keeps the tensor Hermitian for lossless layers,
+        # which conserves energy.
+        N_xx, N_xy, N_yy = normal_vector
+        delta = E_conv - o_E_conv_i
+
+        eps_xx = E_conv - (delta @ N_xx + N_xx @ delta) / 2
+        eps_xy = -(delta @ N_xy + N_xy @ delta) / 2
+        eps_yy = E_conv - (delta @ N_yy + N_yy @ delta) / 2
+
+        # S2_from_S = P @ Q, with P from the curl of E and Q (= -U1_from_S) from the curl of H
+        P = np.block(
+            [
+                [Kx_c * E_conv_i * Ky_r, I - Kx_c * E_conv_i * Kx_r],
+                [Ky_c * E_conv_i * Ky_r - I, -Ky_c * E_conv_i * Kx_r]
+            ])
+        U1_from_S = np.block(
+            [
+                [diag(-Kx * Ky) - eps_xy, diag(Kx ** 2) - eps_yy],
+                [eps_xx - diag(Ky ** 2), diag(Ky * Kx) + eps_xy]
+            ]
+        )
+
+        S2_from_S = -P @ U1_from_S
+
+    if sector_bases is None:
+        eigenvalues, W = np.linalg.eig(S2_from_S)
+    else:
+        # mirror-symmetric layer: S2_from_S is block diagonal on the symmetry sectors
+        eigenvalues, W = eig_sectors(S2_from_S, sector_bases)
 
-    return W, V, q
+    q = eigenvalues ** 0.5
 
+    V = U1_from_S @ W / q[..., None, :]
 
-def transfer_2d_2(k0, d, W, V, center, q, varphi, I, O, big_F, big_G, big_T, type_complex=np.complex128):
+    return W, V, q
 
-    q1 = q[:center]
-    q2 = q[center:]
 
-    W_11 = W[:center, :center]
-    W_12 = W[:center, center:]
-    W_21 = W[center:, :center]
-    W_22 = W[center:, center:]
+def transfer_2d_big_wv(W, V, center, varphi):
 
-    V_11 = V[:center, :center]
-    V_12 = V[:center, center:]
-    V_21 = V[center:, :center]
-    V_22 = V[center:, center:]
+    W_11 = W[..., :center, :center]
+    W_12 = W[..., :center, center:]
+    W_21 = W[..., center:, :center]
+    W_22 = W[..., center:, center:]
 
-    X_1 = np.diag(np.exp(-k0 * q1 * d))
-    X_2 = np.diag(np.exp(-k0 * q2 * d))
+    V_11 = V[..., :center, :center]
+    V_12 = V[..., :center, center:]
+    V_21 = V[..., center:, :center]
+    V_22 = V[..., center:, center:]
 
-    F_c = np.diag(np.cos(varphi))
-    F_s = np.diag(np.sin(varphi))
+    F_c = np.cos(varphi)[..., :, None]
+    F_s = np.sin(varphi)[..., :, None]
 
-    W_ss = F_c @ W_21 - F_s @ W_11
-    W_sp = F_c @ W_22 - F_s @ W_12
-    W_ps = F_c @ W_11 + F_s @ W_21
-    W_pp = F_c @ W_12 + F_s @ W_22
+    W_ss = F_c * W_21 - F_s * W_11
+    W_sp = F_c * W_22 - F_s * W_12
+    W_ps = F_c * W_11 + F_s * W_21
+    W_pp = F_c * W_12 + F_s * W_22
 
-    V_ss = F_c @ V_11 + F_s @ V_21
-    V_sp = F_c @ V_12 + F_s @ V_22
-    V_ps = F_c @ V_21 - F_s @ V_11
-    V_pp = F_c @ V_22 - F_s @ V_12
+    V_ss = F_c * V_11 + F_s * V_21
+    V_sp = F_c * V_12 + F_s * V_22
+    V_ps = F_c * V_21 - F_s * V_11
+    V_pp = F_c * V_22 - F_s * V_12
 
-    big_I = np.eye(2 * (len(I)), dtype=type_complex)
-    big_X = np.block([[X_1, O], [O, X_2]])
     big_W = np.block([[W_ss, W_sp], [W_ps, W_pp]])
     big_V = np.block([[V_ss, V_sp], [V_ps, V_pp]])
 
-    big_W_i = np.linalg.inv(big_W)
-    big_V_i = np.linalg.inv(big_V)
+    # big_W and big_V are factorized in the cascade (transfer_2d_2)
+    big_W_i = None
+    big_V_i = None
+
+    return W_11, W_12, W_21, W_22, V_11, V_12, V_21, V_22, big_W, big_V, big_W_i, big_V_i
+
+
+def transfer_2d_wv_homogeneous(Kx, Ky, eps, varphi):
+    # uniform layer: S2_from_S is diagonal, so W = I and V, big_W, big_V are made of diagonal blocks
+
+    kx = Kx
+    ky = Ky
+
+    q_half = (kx ** 2 + ky ** 2 - eps) ** 0.5
+    q = np.concatenate([q_half, q_half], axis=-1)
+    one = np.ones_like(q_half)
+    zero = np.zeros_like(q_half)
+
+    v_11 = -kx * ky / q_half
+    v_12 = (kx ** 2 - eps) / q_half
+    v_21 = (eps - ky ** 2) / q_half
+    v_22 = kx * ky / q_half
 
-    big_A = 0.5 * (big_W_i @ big_F + big_V_i @ big_G)
-    big_B = 0.5 * (big_W_i @ big_F - big_V_i @ big_G)
+    c = np.cos(varphi)
+    s = np.sin(varphi)
 
-    big_A_i = np.linalg.inv(big_A)
+    big_W_diag = (-s, c, c, s)
+    big_V_diag = (c * v_11 + s * v_21, c * v_12 + s * v_22, c * v_21 - s * v_11, c * v_22 - s * v_12)
 
-    big_F = big_W @ (big_I + big_X @ big_B @ big_A_i @ big_X)
-    big_G = big_V @ (big_I - big_X @ big_B @ big_A_i @ big_X)
+    return diag(one / eps), q, diag(one), diag(zero), diag(zero), diag(one), \
+        diag(v_11), diag(v_12), diag(v_21), diag(v_22), \
+        block_diag(*big_W_diag), block_diag(*big_V_diag), block_diag_inv(*big_W_diag), block_diag_inv(*big_V_diag)
 
-    big_T = big_T @ big_A_i @ big_X
 
-    return big_X, big_F, big_G, big_T, big_A_i, big_B, W_11, W_12, W_21, W_22, V_11, V_12, V_21, V_22
+def transfer_2d_2(k0, d, q, center, big_W, big_V, big_W_i, big_V_i, big_F, big_G, big_T, type_complex=np.complex128):
+
+    big_I = np.eye(2 * center, dtype=type_complex)
+    big_X = np.exp(-k0 * q * d)
+
+    big_W_i_F = solve_left(big_W, big_F, big_W_i)
+    big_V_i_G = solve_left(big_V, big_G, big_V_i)
+
+    big_A = 0.5 * (big_W_i_F + big_V_i_G)
+    big_B = 0.5 * (big_W_i_F - big_V_i_G)
+
+    big_B_A_i, big_T_A_i = solve_right(big_A, big_B, big_T)
+
+    big_X_B_A_i_X = big_X[..., :, None] * big_B_A_i * big_X[..., None, :]
+
+    big_F = big_W @ (big_I + big_X_B_A_i_X)
+    big_G = big_V @ (big_I - big_X_B_A_i_X)
+
+    big_T = big_T_A_i * big_X[..., None, :]
+
+    return big_X, big_F, big_G, big_T, big_A, big_B
 
 
 def transfer_2d_3(center, big_F, big_G, big_T, Z_I, Y_I, psi, theta, ff, delta_i0, k_I_z, k0, n_I, n_II, k_II_z,
-                  type_complex=np.complex128):
+                  type_complex=np.complex128, jones=None):
+    # jones: see incidence_rhs. With it, efficiencies and amplitudes get a trailing axis, one entry per incident wave.
 
-    I = np.eye(ff ** 2, dtype=type_complex)
-    O = np.zeros((ff ** 2, ff ** 2), dtype=type_complex)
+    batch_shape = big_F.shape[:-2]
+    # center: number of harmonics
+    I = np.broadcast_to(np.eye(center, dtype=type_complex), batch_shape + (center, center))
+    O = np.zeros(batch_shape + (center, center), dtype=type_complex)
 
-    big_F_11 = big_F[:center, :center]
-    big_F_12 = big_F[:center, center:]
-    big_F_21 = big_F[center:, :center]
-    big_F_22 = big_F[center:, center:]
+    big_F_11 = big_F[..., :center, :center]
+    big_F_12 = big_F[..., :center, center:]
+    big_F_21 = big_F[..., center:, :center]
+    big_F_22 = big_F[..., center:, center:]
 
-    big_G_11 = big_G[:center, :center]
-    big_G_12 = big_G[:center, center:]
-    big_G_21 = big_G[center:, :center]
-    big_G_22 = big_G[center:, center:]
+    big_G_11 = big_G[..., :center, :center]
+    big_G_12 = big_G[..., :center, center:]
+    big_G_21 = big_G[..., center:, :center]
+    big_G_22 = big_G[..., center:, center:]
 
     # Final Equation in form of AX=B
     final_A = np.block(
         [
             [I, O, -big_F_11, -big_F_12],
-            [O, -1j * Z_I, -big_F_21, -big_F_22],
-            [-1j * Y_I, O, -big_G_11, -big_G_12],
+            [O, diag(-1j * Z_I), -big_F_21, -big_F_22],
+            [diag(-1j * Y_I), O, -big_G_11, -big_G_12],
             [O, I, -big_G_21, -big_G_22],
         ]
     )
 
-    final_B = np.block(
-        [
-            [-np.sin(psi) * delta_i0],
-            [-np.cos(psi) * np.cos(theta) * delta_i0],
-            [-1j * np.sin(psi) * n_I * np.cos(theta) * delta_i0],
-            [1j * n_I * np.cos(psi) * delta_i0]
-        ]
-    )
+    final_B = incidence_rhs(psi, theta, n_I, delta_i0, jones)
 
-    final_RT = np.linalg.inv(final_A) @ final_B
+    final_RT = np.linalg.solve(final_A, final_B)
 
-    R_s = final_RT[:ff ** 2, :].flatten()
-    R_p = final_RT[ff ** 2:2 * ff ** 2, :].flatten()
+    R_s = final_RT[..., :center, :]
+    R_p = final_RT[..., center:2 * center, :]
 
-    big_T1 = final_RT[2 * ff ** 2:, :]
+    big_T1 = final_RT[..., 2 * center:, :]
     big_T = big_T @ big_T1
 
-    T_s = big_T[:ff ** 2, :].flatten()
-    T_p = big_T[ff ** 2:, :].flatten()
+    T_s = big_T[..., :center, :]
+    T_p = big_T[..., center:, :]
+
+    k_I_z = k_I_z[..., None]
+    k_II_z = k_II_z[..., None]
+    k0 = np.expand_dims(k0, -1)
 
     de_ri = R_s * np.conj(R_s) * np.real(k_I_z / (k0 * n_I * np.cos(theta))) \
             + R_p * np.conj(R_p) * np.real((k_I_z / n_I ** 2) / (k0 * n_I * np.cos(theta)))
@@ -400,5 +663,10 @@ def transfer_2d_3(center, big_F, big_G, big_T, Z_I, Y_I, psi, theta, ff, delta_i
     de_ti = T_s * np.conj(T_s) * np.real(k_II_z / (k0 * n_I * np.cos(theta))) \
             + T_p * np.conj(T_p) * np.real((k_II_z / n_II ** 2) / (k0 * n_I * np.cos(theta)))
 
-    return de_ri.real, de_ti.real, big_T1
+    amplitudes = R_s, R_p, T_s, T_p
+    if jones is None:
+        de_ri, de_ti = de_ri[..., 0], de_ti[..., 0]
+        amplitudes = tuple(amplitude[..., 0] for amplitude in amplitudes)
+
+    return de_ri.real, de_ti.real, big_T1, amplitudes
 
@@ -7,8 +7,9 @@ from copy import deepcopy
 from .primitives import Eig
 from .scattering_method import scattering_1d_1, scattering_1d_2, scattering_1d_3, scattering_2d_1, scattering_2d_wv, \
     scattering_2d_2, scattering_2d_3
-from .transfer_method import transfer_1d_1, transfer_1d_2, transfer_1d_3, transfer_1d_conical_1, transfer_1d_conical_2, \
-    transfer_1d_conical_3, transfer_2d_1, transfer_2d_wv, transfer_2d_2, transfer_2d_3
+from .transfer_method import transfer_1d_1, transfer_1d_wv_homogeneous, transfer_1d_2, transfer_1d_3, \
+    transfer_1d_conical_1, transfer_1d_conical_wv, transfer_1d_conical_wv_homogeneous, transfer_1d_conical_2, \
+    transfer_1d_conical_3, transfer_2d_1, transfer_2d_wv, transfer_2d_wv_homogeneous, transfer_2d_2, transfer_2d_3
 
 
 class _BaseRCWA:
@@ -77,7 +78,7 @@ class _BaseRCWA:
 
         self.kx_vector = kx_vector
 
-    def solve_1d(self, wl, E_conv_all, o_E_conv_all):
+    def solve_1d(self, wl, E_conv_all, o_E_conv_all, homogeneous_layers=None):
 
         self.layer_info_list = []
         self.T1 = None
@@ -98,11 +99,15 @@ class _BaseRCWA:
             Kx, Wg, Vg, Kzg, Wr, Vr, Kzr, Wt, Vt, Kzt, Ar, Br, Sg \
                 = scattering_1d_1(k0, self.n_I, self.n_II, self.theta, self.phi, fourier_indices, self.period,
                                   self.pol, wl=wl)
+            Kx = torch.diag(Kx)  # the modal functions take the diagonal
         else:
             raise ValueError
 
         count = min(len(E_conv_all), len(o_E_conv_all), len(self.thickness))
 
+        # uniform layers skip the eigensolve: see homogeneous_layers
+        homogeneous_layers = homogeneous_layers or (False,) * count
+
         # From the last layer
         for layer_index in range(count)[::-1]:
 
@@ -110,41 +115,48 @@ class _BaseRCWA:
             o_E_conv = o_E_conv_all[layer_index]
             d = self.thickness[layer_index]
 
-            if self.pol == 0:
+            W_i, V_i = None, None
+
+            if homogeneous_layers[layer_index]:
+                E_conv_i, q, W, V, W_i, V_i = transfer_1d_wv_homogeneous(self.pol, Kx, E_conv[0, 0],
+                                                                         device=self.device,
+                                                                         type_complex=self.type_complex)
+
+            elif self.pol == 0:
                 E_conv_i = None
-                A = Kx ** 2 - E_conv
+                A = torch.diag(Kx ** 2) - E_conv
                 # eigenvalues, W = torch.linalg.eig(A)
                 eigenvalues, W = Eig.apply(A)
 
                 q = eigenvalues ** 0.5
 
-                Q = torch.diag(q)
-                V = W @ Q
+                V = W * q[None, :]
 
             elif self.pol == 1:
+                # E_conv_i is kept explicitly for the field calculation
                 E_conv_i = torch.linalg.inv(E_conv)
-                B = Kx @ E_conv_i @ Kx - torch.eye(E_conv.shape[0], device=self.device, dtype=self.type_complex)
-                o_E_conv_i = torch.linalg.inv(o_E_conv)
+                B = Kx[:, None] * E_conv_i * Kx[None, :] \
+                    - torch.eye(E_conv.shape[0], device=self.device, dtype=self.type_complex)
 
                 # eigenvalues, W = torch.linalg.eig(o_E_conv_i @ B)
-                eigenvalues, W = Eig.apply(o_E_conv_i @ B)
+                eigenvalues, W = Eig.apply(torch.linalg.solve(o_E_conv, B))
                 q = eigenvalues ** 0.5
 
-                Q = torch.diag(q)
-                V = o_E_conv @ W @ Q
+                V = o_E_conv @ W * q[None, :]
 
             else:
                 raise ValueError
 
             if self.algo == 'TMM':
-                X, f, g, T, a_i, b = transfer_1d_2(k0, q, d, W, V, f, g, self.fourier_order, T,
-                                                   device=self.device, type_complex=self.type_complex)
+                X, f, g, T, a, b = transfer_1d_2(k0, q, d, W, V, f, g, self.fourier_order, T,
+                                                   device=self.device, type_complex=self.type_complex,
+                                                   W_i=W_i, V_i=V_i)
 
-                layer_info = [E_conv_i, q, W, X, a_i, b, d]
+                layer_info = [E_conv_i, q, W, X, a, b, d]
                 self.layer_info_list.append(layer_info)
 
             elif self.algo == 'SMM':
-                A, B, S_dict, Sg = scattering_1d_2(W, Wg, V, Vg, d, k0, Q, Sg)
+                A, B, S_dict, Sg = scattering_1d_2(W, Wg, V, Vg, d, k0, torch.diag(q), Sg)
             else:
                 raise ValueError
 
@@ -162,7 +174,7 @@ class _BaseRCWA:
         return de_ri, de_ti
 
     # TODO: scattering method
-    def solve_1d_conical(self, wl, E_conv_all, o_E_conv_all):
+    def solve_1d_conical(self, wl, E_conv_all, o_E_conv_all, homogeneous_layers=None):
 
         self.layer_info_list = []
         self.T1 = None
@@ -186,6 +198,9 @@ class _BaseRCWA:
 
         count = min(len(E_conv_all), len(o_E_conv_all), len(self.thickness))
 
+        # uniform layers skip the eigensolve: see homogeneous_layers
+        homogeneous_layers = homogeneous_layers or (False,) * count
+
         # From the last layer
         for layer_index in range(count)[::-1]:
 
@@ -194,16 +209,20 @@ class _BaseRCWA:
             d = self.thickness[layer_index]
 
         # for e_conv, o_e_conv, d in zip(E_conv_all[::-1], o_E_conv_all[::-1], self.thickness[::-1]):
-            E_conv_i = torch.linalg.inv(E_conv)
-            o_E_conv_i = torch.linalg.inv(o_E_conv)
 
             if self.algo == 'TMM':
-                big_X, big_F, big_G, big_T, big_A_i, big_B, W_1, W_2, V_11, V_12, V_21, V_22, q_1, q_2\
-                    = transfer_1d_conical_2(k0, Kx, ky, E_conv, E_conv_i, o_E_conv_i, self.ff, d,
-                                                            varphi, big_F, big_G, big_T,
-                                                            device=self.device, type_complex=self.type_complex)
+                if homogeneous_layers[layer_index]:
+                    modes = transfer_1d_conical_wv_homogeneous(k0, Kx, ky, E_conv[0, 0], varphi)
+                else:
+                    modes = transfer_1d_conical_wv(k0, Kx, ky, E_conv, o_E_conv, self.ff, varphi,
+                                                   device=self.device, type_complex=self.type_complex)
+                E_conv_i, q_1, q_2, W_1, W_2, V_11, V_12, V_21, V_22, big_W, big_V, big_W_i, big_V_i = modes
 
-                layer_info = [E_conv_i, q_1, q_2, W_1, W_2, V_11, V_12, V_21, V_22, big_X, big_A_i, big_B, d]
+                big_X, big_F, big_G, big_T, big_A, big_B \
+                    = transfer_1d_conical_2(k0, d, q_1, q_2, big_W, big_V, big_W_i, big_V_i, self.ff,
+                                            big_F, big_G, big_T, device=self.device, type_complex=self.type_complex)
+
+                layer_info = [E_conv_i, q_1, q_2, W_1, W_2, V_11, V_12, V_21, V_22, big_X, big_A, big_B, d]
                 self.layer_info_list.append(layer_info)
 
             elif self.algo == 'SMM':
@@ -224,7 +243,7 @@ class _BaseRCWA:
 
         return de_ri, de_ti
 
-    def solve_2d(self, wavelength, E_conv_all, o_E_conv_all):
+    def solve_2d(self, wavelength, E_conv_all, o_E_conv_all, homogeneous_layers=None):
 
         self.layer_info_list = []
         self.T1 = None
@@ -234,9 +253,6 @@ class _BaseRCWA:
         delta_i0 = torch.zeros((self.ff ** 2, 1), device=self.device, dtype=self.type_complex)
         delta_i0[self.ff ** 2 // 2, 0] = 1
 
-        I = torch.eye(self.ff ** 2, device=self.device, dtype=self.type_complex)
-        O = torch.zeros((self.ff ** 2, self.ff ** 2), device=self.device, dtype=self.type_complex)
-
         center = self.ff ** 2
 
         k0 = 2 * np.pi / wavelength
@@ -253,6 +269,9 @@ class _BaseRCWA:
 
         count = min(len(E_conv_all), len(o_E_conv_all), len(self.thickness))
 
+        # uniform layers skip the eigensolve: see homogeneous_layers
+        homogeneous_layers = homogeneous_layers or (False,) * count
+
         # From the last layer
         for layer_index in range(count)[::-1]:
 
@@ -260,19 +279,28 @@ class _BaseRCWA:
             o_E_conv = o_E_conv_all[layer_index]
             d = self.thickness[layer_index]
 
-            E_conv_i = torch.linalg.inv(E_conv)
-            o_E_conv_i = torch.linalg.inv(o_E_conv)
+            homogeneous = self.algo == 'TMM' and homogeneous_layers[layer_index]
+
+            if homogeneous:
+                E_conv_i, q, W, V, big_W_i, big_V_i = transfer_2d_wv_homogeneous(Kx, Ky, E_conv[0, 0], varphi,
+                                                                                 device=self.device,
+                                                                                 type_complex=self.type_complex)
+            else:
+                E_conv_i = torch.linalg.inv(E_conv)
+                o_E_conv_i = torch.linalg.inv(o_E_conv)
 
             if self.algo == 'TMM':  # TODO: MERGE W V part
-                W, V, q = transfer_2d_wv(self.ff, Kx, E_conv_i, Ky, o_E_conv_i, E_conv,
-                                         device=self.device, type_complex=self.type_complex)
+                if not homogeneous:
+                    W, V, q = transfer_2d_wv(self.ff, Kx, E_conv_i, Ky, o_E_conv_i, E_conv,
+                                             device=self.device, type_complex=self.type_complex)
+                    big_W_i, big_V_i = None, None
 
-                big_X, big_F, big_G, big_T, big_A_i, big_B, \
+                big_X, big_F, big_G, big_T, big_A, big_B, \
                 W_11, W_12, W_21, W_22, V_11, V_12, V_21, V_22 \
-                    = transfer_2d_2(k0, d, W, V, center, q, varphi, I, O, big_F, big_G, big_T, device=self.device,
-                                    type_complex=self.type_complex)
+                    = transfer_2d_2(k0, d, W, V, center, q, varphi, big_F, big_G, big_T, device=self.device,
+                                    type_complex=self.type_complex, big_W_i=big_W_i, big_V_i=big_V_i)
 
-                layer_info = [E_conv_i, q, W_11, W_12, W_21, W_22, V_11, V_12, V_21, V_22, big_X, big_A_i, big_B, d]
+                layer_info = [E_conv_i, q, W_11, W_12, W_21, W_22, V_11, V_12, V_21, V_22, big_X, big_A, big_B, d]
                 self.layer_info_list.append(layer_info)
 
             elif self.algo == 'SMM':
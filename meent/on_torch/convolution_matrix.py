@@ -1,25 +1,31 @@
 import torch
 import numpy as np
 
-from os import walk
-from scipy.io import loadmat
-from pathlib import Path
+from functools import lru_cache
+
+from ..material_table import material_table, material_dispersion
 
 
 def put_permittivity_in_ucell(ucell, mat_list, mat_table, wl, device=torch.device('cpu'), type_complex=torch.complex128):
+    """
+    Permittivity of each cell of ucell, an array of indices into mat_list.
+    Each material is evaluated once and looked up by index; wl may be an array of wavelengths,
+    in which case its axes come first: (..., Z, Y, X). Materials given as tensors keep their gradient.
+    """
+    permittivity = []
+    for material in mat_list:
+        if type(material) == str:
+            eps = find_nk_index(material, mat_table, wl) ** 2
+        elif isinstance(material, torch.Tensor):
+            eps = material ** 2
+        else:
+            eps = torch.as_tensor(np.asarray(material) ** 2)  # through numpy to keep double precision
+        permittivity.append(torch.broadcast_to(eps.to(device).type(type_complex), np.shape(wl)))
 
-    res = torch.zeros(ucell.shape, device=device).type(type_complex)
+    # (..., material)
+    permittivity = torch.stack(permittivity, dim=-1)
 
-    for z in range(ucell.shape[0]):
-        for y in range(ucell.shape[1]):
-            for x in range(ucell.shape[2]):
-                material = mat_list[ucell[z, y, x]]
-                if type(material) == str:
-                    res[z, y, x] = find_nk_index(material, mat_table, wl) ** 2
-                else:
-                    res[z, y, x] = material ** 2
-
-    return res
+    return permittivity[..., torch.as_tensor(ucell, device=device).long()]
 
 
 def put_permittivity_in_ucell_object(ucell_size, mat_list, obj_list, mat_table, wl, device=torch.device('cpu'),
@@ -37,45 +43,21 @@ def put_permittivity_in_ucell_object(ucell_size, mat_list, obj_list, mat_table,
 
 
 def find_nk_index(material, mat_table, wl):
-    if material[-6:] == '__real':
-        material = material[:-6]
-        n_only = True
-    else:
-        n_only = False
-
-    mat_data = mat_table[material.upper()]
+    # wl may be a tensor of wavelengths, also one that requires grad
+    dispersion = material_dispersion(material, mat_table)
 
-    n_index = np.interp(wl, mat_data[:, 0], mat_data[:, 1])
+    wl = torch.as_tensor(wl, dtype=torch.float64)
+    x0, y0, slope = (torch.as_tensor(a, device=wl.device) for a in (dispersion.x0, dispersion.y0, dispersion.slope))
 
-    if n_only:
-        return n_index
+    index = torch.searchsorted(torch.as_tensor(dispersion.wavelength, device=wl.device), wl.reshape(-1), right=True)
+    index = index.reshape(wl.shape)
 
-    k_index = np.interp(wl, mat_data[:, 0], mat_data[:, 2])
-    nk = n_index + 1j * k_index
-
-    return nk
+    return y0[index] + slope[index] * (wl - x0[index])
 
 
 def read_material_table(nk_path=None):
-    mat_table = {}
-
-    if nk_path is None:
-        nk_path = str(Path(__file__).resolve().parent.parent) + '/nk_data'
-
-    full_path_list, name_list, _ = [], [], []
-    for (dirpath, dirnames, filenames) in walk(nk_path):
-        full_path_list.extend([f'{dirpath}/{filename}' for filename in filenames])
-        name_list.extend(filenames)
-    for path, name in zip(full_path_list, name_list):
-        if name[-3:] == 'txt':
-            data = np.loadtxt(path, skiprows=1)
-            mat_table[name[:-4].upper()] = data
-
-        elif name[-3:] == 'mat':
-            data = loadmat(path)
-            data = np.array([data['WL'], data['n'], data['k']])[:, :, 0].T
-            mat_table[name[:-4].upper()] = data
-    return mat_table
+    # shared with the other backends, and loaded lazily: see meent.material_table
+    return material_table(nk_path)
 
 
 def cell_compression(cell, device=torch.device('cpu'), type_complex=torch.complex128):
@@ -161,48 +143,46 @@ def fft_piecewise_constant(cell, fourier_order, device=torch.device('cpu'), type
     return f_coeffs_xy.T
 
 
+@lru_cache(maxsize=16)
+def conv_index(fourier_order, shape):
+    """
+    Flat gather index of the convolution matrix in fftshifted Fourier coefficients of shape (y, x):
+    entry (i, j) points at the coefficient of the order difference between harmonics i and j.
+    Computed once per order and shape, for the few most recent ones; y of 1 for 1D. Kept on the CPU so that the
+    cache does not hold device memory; gather_conv moves it.
+    """
+    order = np.arange(-fourier_order, fourier_order + 1)
+
+    if shape[0] == 1:  # 1D
+        order_x, order_y = order, np.zeros_like(order)
+    else:
+        order_y, order_x = (o.flatten() for o in np.meshgrid(order, order, indexing='ij'))
+
+    center_y, center_x = shape[0] // 2, shape[1] // 2
+    index = (center_y + order_y[:, None] - order_y[None, :]) * shape[1] + center_x + order_x[:, None] - order_x[None, :]
+
+    return torch.as_tensor(index, dtype=torch.long)
+
+
+def gather_conv(f_coeffs, fourier_order, device=torch.device('cpu')):
+    # convolution matrices of fftshifted coefficients (..., y, x)
+    index = conv_index(fourier_order, tuple(f_coeffs.shape[-2:])).to(device)
+
+    return f_coeffs.reshape(f_coeffs.shape[:-2] + (-1,))[..., index]
+
+
 def to_conv_mat_piecewise_constant(pmt, fourier_order, device=torch.device('cpu'), type_complex=torch.complex128):
 
     if len(pmt.shape) == 2:
         print('shape is 2')
         raise ValueError
-    ff = 2 * fourier_order + 1
 
-    if pmt.shape[1] == 1:  # 1D
-        res = torch.zeros((pmt.shape[0], ff, ff), device=device).type(type_complex)
-
-        for i, layer in enumerate(pmt):
-            f_coeffs = fft_piecewise_constant(layer, fourier_order, device=device, type_complex=type_complex)
-            center = f_coeffs.shape[1] // 2
-            conv_idx = torch.arange(-ff + 1, ff, 1, device=device).type(torch.long)
-            conv_idx = circulant(conv_idx, device)
-            e_conv = f_coeffs[0, center + conv_idx]
-            res[i] = e_conv
-
-    else:  # 2D
-        # attention on the order of axis (Z Y X)
-        res = torch.zeros((pmt.shape[0], ff ** 2, ff ** 2), device=device).type(type_complex)
-
-        for i, layer in enumerate(pmt):
-            f_coeffs = fft_piecewise_constant(layer, fourier_order, device=device, type_complex=type_complex)
-            center = torch.div(torch.tensor(f_coeffs.shape, device=device), 2, rounding_mode='trunc')
-
-            conv_idx = torch.arange(-ff + 1, ff, 1, device=device).type(torch.long)
-            conv_idx = circulant(conv_idx, device)
-            conv_i = conv_idx.repeat_interleave(ff, dim=1).type(torch.long)
-            conv_i = conv_i.repeat_interleave(ff, dim=0)
-            conv_j = conv_idx.repeat(ff, ff).type(torch.long)
-            e_conv = f_coeffs[center[0] + conv_i, center[1] + conv_j]
-            res[i] = e_conv
-
-    # import matplotlib.pyplot as plt
-    #
-    # plt.figure()
-    # plt.imshow(abs(res[0]), cmap='jet')
-    # plt.colorbar()
-    # plt.show()
-    #
-    return res
+    # attention on the order of axis (Z Y X)
+    f_coeffs = torch.stack([fft_piecewise_constant(layer, fourier_order, device=device, type_complex=type_complex)
+                            for layer in pmt])
+    res = gather_conv(f_coeffs, fourier_order, device)
+
+    return res.type(type_complex)
 
 
 def to_conv_mat(pmt, fourier_order, device=torch.device('cpu'), type_complex=torch.complex128):
@@ -212,69 +192,25 @@ def to_conv_mat(pmt, fourier_order, device=torch.device('cpu'), type_complex=tor
         raise ValueError
     ff = 2 * fourier_order + 1
 
-    if pmt.shape[1] == 1:  # 1D
-        res = torch.zeros((pmt.shape[0], ff, ff), device=device).type(type_complex)
-
-        # extend array for FFT
-        minimum_pattern_size = 2 * ff
-        if pmt.shape[2] < minimum_pattern_size:
-            n = minimum_pattern_size // pmt.shape[2]
-            pmt = pmt.repeat_interleave(n+1, dim=2)
-
-        for i, layer in enumerate(pmt):
-            f_coeffs = torch.fft.fftshift(torch.fft.fftn(layer / (layer.size(0)*layer.size(1))))
-            center = f_coeffs.shape[1] // 2
-
-            conv_idx = torch.arange(-ff + 1, ff, 1, device=device).type(torch.long)
-            conv_idx = circulant(conv_idx, device)
-            e_conv = f_coeffs[0, center + conv_idx]
-            res[i] = e_conv
-
-    else:  # 2D
-        res = torch.zeros((pmt.shape[0], ff ** 2, ff ** 2), device=device).type(type_complex)
-
-        # extend array
-        minimum_pattern_size = 2 * ff
-        if pmt.shape[1] < minimum_pattern_size:
-            n = minimum_pattern_size // pmt.shape[1]
-            pmt = pmt.repeat_interleave(n+1, dim=1)
-        if pmt.shape[2] < minimum_pattern_size:
-            n = minimum_pattern_size // pmt.shape[2]
-            pmt = pmt.repeat_interleave(n+1, dim=2)
-
-        for i, layer in enumerate(pmt):
-            f_coeffs = torch.fft.fftshift(torch.fft.fft2(layer / (layer.size(0)*layer.size(1))))
-            center = torch.div(torch.tensor(f_coeffs.shape, device=device), 2, rounding_mode='trunc')
-
-            conv_idx = torch.arange(-ff + 1, ff, 1, device=device).type(torch.long)
-            conv_idx = circulant(conv_idx, device)
-
-            conv_i = conv_idx.repeat_interleave(ff, dim=1).type(torch.long)
-            conv_i = conv_i.repeat_interleave(ff, dim=0)
-            conv_j = conv_idx.repeat(ff, ff).type(torch.long)
-            e_conv = f_coeffs[center[0] + conv_i, center[1] + conv_j]
-            res[i] = e_conv
-
-    # import matplotlib.pyplot as plt
-    #
-    # plt.figure()
-    # plt.imshow(abs(res[0]), cmap='jet')
-    # plt.colorbar()
-    # plt.show()
+    # extend array for FFT
+    minimum_pattern_size = 2 * ff
+    if pmt.shape[1] != 1 and pmt.shape[1] < minimum_pattern_size:  # 2D
+        n = minimum_pattern_size // pmt.shape[1]
+        pmt = pmt.repeat_interleave(n+1, dim=1)
+    if pmt.shape[2] < minimum_pattern_size:
+        n = minimum_pattern_size // pmt.shape[2]
+        pmt = pmt.repeat_interleave(n+1, dim=2)
 
-    return res
+    # all layers at once
+    f_coeffs = torch.fft.fftshift(torch.fft.fft2(pmt / (pmt.size(1) * pmt.size(2))), dim=(-2, -1))
+    res = gather_conv(f_coeffs, fourier_order, device)
+
+    return res.type(type_complex)
 
 
 def circulant(c, device=torch.device('cpu')):
-    # TODO: need device?
 
     center = c.shape[0] // 2
-    circ = torch.zeros((center + 1, center + 1), device=device).type(torch.long)
-
-    for r in range(center+1):
-        idx = torch.arange(r, r - center - 1, -1, device=device)
-
-        assign_value = c[center + idx]
-        circ[r] = assign_value
+    idx = torch.arange(center + 1, device=device)
 
-    return circ
+    return c[center + idx[:, None] - idx[None, :]]
@@ -4,6 +4,8 @@ import torch
 import numpy as np
 import matplotlib.pyplot as plt
 
+from functools import partial
+
 
 def field_distribution(grating_type, *args, **kwargs):
     if grating_type == 0:
@@ -16,230 +18,620 @@ def field_distribution(grating_type, *args, **kwargs):
 
 
 def field_dist_1d(wavelength, n_I, theta, fourier_order, T1, layer_info_list, period, pol, resolution=(100, 1, 100),
-                  device='cpu', type_complex=torch.complex128):
+                  device='cpu', type_complex=torch.complex128, synthesis='dense', z_step=None, z=None, n_II=1.):
 
     k0 = 2 * np.pi / wavelength
     fourier_indices = torch.arange(-fourier_order, fourier_order + 1, device=device)
 
     kx_vector = k0 * (n_I * np.sin(theta) - fourier_indices * (wavelength / period[0])).type(type_complex)
-    Kx = torch.diag(kx_vector / k0)
+    Kx = kx_vector / k0
 
     resolution_z, resolution_y, resolution_x = resolution
+    x = torch.arange(resolution_x, device=device, dtype=torch.float64) * period[0] / resolution_x
+
+    field_cell = torch.zeros((field_rows(layer_info_list, resolution_z, z_step, z), resolution_y, resolution_x, 3)
+                             ).type(type_complex)
+
+    coefficients = partial(field_coefficients_1d, pol, k0, Kx)
+    half_space = partial(half_space_coefficients, 0, pol, k0, Kx, 0)
+
+    slabs = slab_coefficients(coefficients, half_space, layer_info_list, T1,
+                              layer_depths(layer_info_list, resolution_z, z_step, z, device=device),
+                              *half_space_depths(layer_info_list, z, device=device), n_I=n_I, n_II=n_II,
+                              incidence=fourier_order)
+    row = 0
+
+    # From the incidence half-space, if z reaches it, and the first layer
+    for coeffs in slabs:
+
+        # the field does not depend on y
+        if synthesis == 'fft':
+            field_cell[row:row + len(coeffs)] = \
+                fourier_series_grid(coeffs, fourier_indices, 0 * fourier_indices, kx_vector[fourier_order], 0,
+                                    (period[0], 1), (1, resolution_x))
+        elif synthesis == 'dense':
+            field_cell[row:row + len(coeffs)] = \
+                fourier_series_1d(coeffs, kx_vector, x)[:, None]
+        else:
+            raise ValueError
+        row += len(coeffs)
 
-    field_cell = torch.zeros((resolution_z * len(layer_info_list), resolution_y, resolution_x, 3)).type(type_complex)
+    return field_cell
 
-    T_layer = T1
 
-    # From the first layer
-    for idx_layer, (E_conv_i, q, W, X, a_i, b, d) in enumerate(layer_info_list[::-1]):
+def field_dist_1d_conical(wavelength, n_I, theta, phi, fourier_order, T1, layer_info_list, period, resolution=(100, 1, 100),
+                          device='cpu', type_complex=torch.complex128, synthesis='dense', z_step=None, z=None,
+                          n_II=1.):
 
-        c1 = T_layer[:, None]
-        c2 = b @ a_i @ X @ T_layer[:, None]
+    k0 = 2 * np.pi / wavelength
+    fourier_indices = torch.arange(-fourier_order, fourier_order + 1, device=device)
 
-        Q = torch.diag(q)
+    kx_vector = k0 * (n_I * torch.sin(theta) * torch.cos(phi) - fourier_indices * (
+            wavelength / period[0])).type(type_complex)
+    ky = k0 * n_I * torch.sin(theta) * torch.sin(phi)
 
-        if pol == 0:
-            V = W @ Q
+    Kx = kx_vector / k0
 
+    resolution_z, resolution_y, resolution_x = resolution
+    x = torch.arange(resolution_x, device=device, dtype=torch.float64) * period[0] / resolution_x
+
+    field_cell = torch.zeros((field_rows(layer_info_list, resolution_z, z_step, z), resolution_y, resolution_x, 6)
+                             ).type(type_complex)
+
+    coefficients = partial(field_coefficients_1d_conical, k0, Kx, ky / k0)
+    half_space = partial(half_space_coefficients, 1, 0, k0, Kx, ky / k0)
+
+    slabs = slab_coefficients(coefficients, half_space, layer_info_list, T1,
+                              layer_depths(layer_info_list, resolution_z, z_step, z, device=device),
+                              *half_space_depths(layer_info_list, z, device=device), n_I=n_I, n_II=n_II,
+                              incidence=fourier_order)
+    row = 0
+
+    # From the incidence half-space, if z reaches it, and the first layer
+    for coeffs in slabs:
+
+        # evaluated at y = 0 for every y
+        if synthesis == 'fft':
+            field_cell[row:row + len(coeffs)] = \
+                fourier_series_grid(coeffs, fourier_indices, 0 * fourier_indices, kx_vector[fourier_order], 0,
+                                    (period[0], 1), (1, resolution_x))
+        elif synthesis == 'dense':
+            field_cell[row:row + len(coeffs)] = \
+                fourier_series_1d(coeffs, kx_vector, x)[:, None]
         else:
-            V = E_conv_i @ W @ Q
-            EKx = E_conv_i @ Kx
+            raise ValueError
+        row += len(coeffs)
 
-        for k in range(resolution_z):
-            z = k / resolution_z * d
+    return field_cell
 
-            if pol == 0:  # TE
-                Sy = W @ (expm(-k0 * Q * z) @ c1 + expm(k0 * Q * (z - d)) @ c2)
-                Ux = V @ (-expm(-k0 * Q * z) @ c1 + expm(k0 * Q * (z - d)) @ c2)
 
-                f_here = (-1j) * Kx @ Sy
+def field_dist_2d(wavelength, n_I, theta, phi, fourier_order, T1, layer_info_list, period, resolution=(100, 100, 100),
+                  device='cpu', type_complex=torch.complex128, synthesis='dense', z_step=None, z=None, n_II=1.):
 
-                for j in range(resolution_y):
-                    for i in range(resolution_x):
-                        x = i * period[0] / resolution_x
+    k0 = 2 * np.pi / wavelength
+    fourier_indices = torch.arange(-fourier_order, fourier_order + 1, device=device)
+    ff = 2 * fourier_order + 1
 
-                        Ey = Sy.T @ torch.exp(-1j * kx_vector.reshape((-1, 1)) * x)
-                        Hx = -1j * Ux.T @ torch.exp(-1j * kx_vector.reshape((-1, 1)) * x)
-                        Hz = f_here.T @ torch.exp(-1j * kx_vector.reshape((-1, 1)) * x)
+    kx_vector = k0 * (n_I * np.sin(theta) * np.cos(phi) - fourier_indices * (
+            wavelength / period[0])).type(type_complex)
+    ky_vector = k0 * (n_I * np.sin(theta) * np.sin(phi) - fourier_indices * (
+            wavelength / period[1])).type(type_complex)
 
-                        field_cell[resolution_z * idx_layer + k, j, i] = torch.tensor([Ey, Hx, Hz])
-            else:  # TM
-                Uy = W @ (expm(-k0 * Q * z) @ c1 + expm(k0 * Q * (z - d)) @ c2)
-                Sx = V @ (-expm(-k0 * Q * z) @ c1 + expm(k0 * Q * (z - d)) @ c2)
+    # order and wavevector of each harmonic, y major
+    order_x, order_y = fourier_indices.tile(ff), fourier_indices.repeat_interleave(ff)
+    kx_vector = kx_vector.tile(ff).flatten()
+    ky_vector = ky_vector.reshape((-1, 1)).tile(ff).flatten()
 
-                f_here = (-1j) * EKx @ Uy  # there is a better option for convergence
+    Kx = kx_vector / k0
+    Ky = ky_vector / k0
 
-                for j in range(resolution_y):
-                    for i in range(resolution_x):
-                        x = i * period[0] / resolution_x
+    resolution_z, resolution_y, resolution_x = resolution
+    x = torch.arange(resolution_x, device=device, dtype=torch.float64) * period[0] / resolution_x
+    y = torch.arange(resolution_y, device=device, dtype=torch.float64) * period[1] / resolution_y
+
+    field_cell = torch.zeros((field_rows(layer_info_list, resolution_z, z_step, z), resolution_y, resolution_x, 6)
+                             ).type(type_complex)
+
+    coefficients = partial(field_coefficients_2d, k0, Kx, Ky)
+    half_space = partial(half_space_coefficients, 2, 0, k0, Kx, Ky)
+
+    slabs = slab_coefficients(coefficients, half_space, layer_info_list, T1,
+                              layer_depths(layer_info_list, resolution_z, z_step, z, device=device),
+                              *half_space_depths(layer_info_list, z, device=device), n_I=n_I, n_II=n_II,
+                              incidence=fourier_order * ff + fourier_order)
+    row = 0
+
+    # From the incidence half-space, if z reaches it, and the first layer
+    for coeffs in slabs:
+
+        if synthesis == 'fft':
+            field_cell[row:row + len(coeffs)] = \
+                fourier_series_grid(coeffs, order_x, order_y, kx_vector[fourier_order * ff + fourier_order],
+                                    ky_vector[fourier_order * ff + fourier_order], period, (resolution_y, resolution_x))
+        elif synthesis == 'dense':
+            field_cell[row:row + len(coeffs)] = \
+                fourier_series_2d(coeffs, order_x, order_y, kx_vector, ky_vector, x, y)
+        else:
+            raise ValueError
+        row += len(coeffs)
 
-                        Hy = Uy.T @ torch.exp(-1j * kx_vector.reshape((-1, 1)) * x)
-                        Ex = 1j * Sx.T @ torch.exp(-1j * kx_vector.reshape((-1, 1)) * x)
-                        Ez = f_here.T @ torch.exp(-1j * kx_vector.reshape((-1, 1)) * x)
+    return field_cell
 
-                        field_cell[resolution_z * idx_layer + k, j, i] = torch.tensor([Hy, Ex, Ez])
 
-        T_layer = a_i @ X @ T_layer
+def locate_layers(layer_info_list, z):
+    """
+    Layer of each depth z below the top of the first layer, counted from the top layer down, and the depth of the top
+    of each layer and of the transmission half-space. A depth on an interface belongs to the layer below, the bottom
+    of the stack to the last layer; depths above the stack get -1, those below it the number of layers.
+    The layers are found without gradient; the tops keep that of the thicknesses.
+    """
+    thickness = [layer_info[-1] for layer_info in layer_info_list[::-1]]
+    top = [0]
+    for d in thickness:
+        top.append(top[-1] + d)
+
+    edges = np.array([float(torch.as_tensor(depth).detach()) for depth in top])
+
+    z = torch.as_tensor(z).detach().cpu().numpy()
+    layer = np.where(z > edges[-1], len(thickness), np.searchsorted(edges[:-1], z, side='right') - 1)
+
+    return layer, top
+
+
+def layer_depths(layer_info_list, resolution_z=100, z_step=None, z=None, device='cpu'):
+    """
+    Depths of the field samples in each layer below its top, from the top layer down.
+
+    Args:
+        resolution_z: uniform samples per layer, whatever its thickness. Used when z_step and z are None.
+        z_step: one sample every z_step through the whole stack from its top, so that a thin layer gets few samples
+            and the step is the same across interfaces
+        z: ascending depths below the top of the first layer, each sampled in the layer holding it (see locate_layers).
+            Those outside the stack are left to half_space_depths.
+
+    Returns:
+        list of tensors of depths, one per layer
+    """
+    if z_step is None and z is None:
+        return [torch.arange(resolution_z, device=device, dtype=torch.float64) / resolution_z * layer_info[-1]
+                for layer_info in layer_info_list[::-1]]
+
+    if z is None:
+        z = np.arange(0, sum(float(torch.as_tensor(layer_info[-1]).detach()) for layer_info in layer_info_list), z_step)
+    z = torch.as_tensor(z, device=device, dtype=torch.float64)
+    if torch.any(torch.diff(z) < 0):
+        raise ValueError('z must be ascending')
+
+    layer, top = locate_layers(layer_info_list, z)
+    layer = torch.as_tensor(layer, device=device)
+
+    return [z[layer == idx_layer] - top[idx_layer] for idx_layer in range(len(layer_info_list))]
+
+
+def half_space_depths(layer_info_list, z=None, device='cpu'):
+    """
+    The depths z (see layer_depths) above and below the stack, as signed distances from its top and bottom:
+    negative in the incidence half-space, positive in the transmission one. Empty when z is None.
+    """
+    if z is None:
+        return torch.zeros(0, device=device, dtype=torch.float64), torch.zeros(0, device=device, dtype=torch.float64)
+
+    z = torch.as_tensor(z, device=device, dtype=torch.float64)
+    layer, top = locate_layers(layer_info_list, z)
+    layer = torch.as_tensor(layer, device=device)
+
+    return z[layer == -1], z[layer == len(layer_info_list)] - top[-1]
+
+
+def field_rows(layer_info_list, resolution_z=100, z_step=None, z=None):
+    # number of depths of field_dist_*, in the layers and the half-spaces
+    if z is not None:
+        return len(z)
+    return sum(len(depth) for depth in layer_depths(layer_info_list, resolution_z, z_step))
+
+
+def slab_coefficients(coefficients, half_space, layer_info_list, T1, depths, above=(), below=(), n_I=1., n_II=1.,
+                      incidence=0):
+    """
+    Fourier coefficients of the fields of each layer at its depths, from the top layer down, preceded by those of the
+    incidence half-space at the distances above and followed by those of the transmission half-space at the distances
+    below, when there are any. The half-spaces take the fields on the outer interfaces of the stack.
+
+    Args:
+        coefficients: field_coefficients_* with the arguments before layer_info given
+        half_space: half_space_coefficients with the arguments before eps given
+        depths: see layer_depths
+        above, below: see half_space_depths
+        incidence: index of the incident harmonic
+    """
+    surface = torch.zeros(1, device=T1.device, dtype=torch.float64)
+
+    if len(above):
+        interface, _ = coefficients(layer_info_list[-1], T1, surface)
+        yield half_space(n_I ** 2, interface[0], above, incidence)
+
+    T_layer = T_last = T1
+    for layer_info, depth in zip(layer_info_list[::-1], depths):
+        coeffs, T_next = coefficients(layer_info, T_layer, depth)
+        yield coeffs
+        T_layer, T_last = T_next, T_layer
+
+    if len(below):
+        interface, _ = coefficients(layer_info_list[0], T_last, surface + layer_info_list[0][-1])
+        yield half_space(n_II ** 2, interface[0], below)
+
+
+def field_at_points(grating_type, wavelength, n_I, theta, phi, fourier_order, T1, layer_info_list, period, x, y, z,
+                    pol=0, device='cpu', type_complex=torch.complex128, n_II=1.):
+    """
+    Fields at arbitrary points, for monitors such as planes, lines or probes. Only the layers holding some of the
+    points are evaluated, each at the depths of its own points, and the layers below the deepest point are not visited.
+
+    Args:
+        x, y, z: coordinates, broadcast together. z is the depth below the top of the first layer; a point on an
+            interface belongs to the layer below, as in field_dist_2d. Points above or below the stack are in the
+            incidence or transmission half-space, see half_space_coefficients. The incidence phase in y is included,
+            unlike in field_dist_1d_conical.
+
+    Returns:
+        tensor of the broadcast shape of the coordinates plus one axis of components, in the order of field_dist_*
+    """
+    k0 = 2 * np.pi / wavelength
+    fourier_indices = torch.arange(-fourier_order, fourier_order + 1, device=device)
 
-    return field_cell
+    if grating_type == 2:
+        ff = 2 * fourier_order + 1
+        order_x, order_y = fourier_indices.tile(ff), fourier_indices.repeat_interleave(ff)
+    else:
+        order_x, order_y = fourier_indices, 0 * fourier_indices
+    if grating_type == 0:
+        phi = 0
 
+    theta, phi = torch.as_tensor(theta), torch.as_tensor(phi)
 
-def field_dist_1d_conical(wavelength, n_I, theta, phi, fourier_order, T1, layer_info_list, period, resolution=(100, 1, 100),
-                          device='cpu', type_complex=torch.complex128):
+    kx_vector = k0 * (n_I * torch.sin(theta) * torch.cos(phi) - order_x * (wavelength / period[0])).type(type_complex)
+    ky_vector = k0 * (n_I * torch.sin(theta) * torch.sin(phi) - order_y * (wavelength / period[-1])).type(type_complex)
+
+    Kx = kx_vector / k0
+    Ky = ky_vector / k0
 
+    if grating_type == 0:
+        coefficients = partial(field_coefficients_1d, pol, k0, Kx)
+    elif grating_type == 1:
+        coefficients = partial(field_coefficients_1d_conical, k0, Kx, Ky[0])
+    else:
+        coefficients = partial(field_coefficients_2d, k0, Kx, Ky)
+    half_space = partial(half_space_coefficients, grating_type, pol, k0, Kx, Ky[0] if grating_type == 1 else Ky)
+
+    x, y, z = torch.broadcast_tensors(*(torch.as_tensor(a, device=device, dtype=torch.float64) for a in (x, y, z)))
+    shape = z.shape
+    x, y, z = x.flatten(), y.flatten(), z.flatten()
+
+    # the region of each point, from -1 above the stack to len(layer_info_list) below it
+    layer, top = locate_layers(layer_info_list, z)
+    regions = range(-1, len(layer_info_list) + 1)
+
+    # the points of a plane share their depth, one product per depth,
+    index = [torch.as_tensor(np.nonzero(layer == region)[0], device=device) for region in regions]
+    depth, inverse, counts = zip(*[torch.unique(z[idx], return_inverse=True, return_counts=True) for idx in index])
+    depth = [depth_region - top[max(region, 0)] for region, depth_region in zip(regions, depth)]
+
+    slabs = slab_coefficients(coefficients, half_space, layer_info_list, T1, depth[1:-1], depth[0], depth[-1],
+                              n_I=n_I, n_II=n_II, incidence=int(torch.nonzero((order_x == 0) & (order_y == 0))[0]))
+    visited = [region for region in regions if region <= layer.max(initial=-1)
+               and (len(depth[region + 1]) or 0 <= region < len(layer_info_list))]
+
+    field = torch.zeros((len(z), 3 if grating_type == 0 else 6), device=device, dtype=type_complex)
+
+    for region, coeffs in zip(visited, slabs):
+        idx, idx_inverse, idx_counts = index[region + 1], inverse[region + 1], counts[region + 1]
+
+        # and those of a grid their x and y
+        x_value, index_x = torch.unique(x[idx], return_inverse=True)
+        y_value, index_y = torch.unique(y[idx], return_inverse=True)
+        phase = (torch.exp(-1j * x_value[:, None] * kx_vector)[index_x]
+                 * torch.exp(-1j * y_value[:, None] * ky_vector)[index_y]).type(coeffs.dtype)
+        parts = torch.split(torch.argsort(idx_inverse, stable=True), idx_counts.tolist())
+        for coeffs_depth, part in zip(coeffs, parts):
+            field[idx[part]] = (phase[part] @ coeffs_depth).type(type_complex)
+
+    return field.reshape(shape + field.shape[-1:])
+
+
+def interface_flux(grating_type, wavelength, n_I, theta, phi, fourier_order, T1, layer_info_list, period, pol=0,
+                   device='cpu', type_complex=torch.complex128):
+    """
+    Power flowing down through the top of each layer, from the top layer down, and through the bottom of the stack,
+    per unit incident power: 1 - sum(de_ri) on top and sum(de_ti) at the bottom. By Parseval, the z-component of the
+    Poynting vector averaged over a period is a sum over the harmonics of the field coefficients on the interface, so
+    it takes one product per interface and no field synthesis.
+
+    Returns:
+        tensor of len(layer_info_list) + 1 fluxes
+    """
     k0 = 2 * np.pi / wavelength
     fourier_indices = torch.arange(-fourier_order, fourier_order + 1, device=device)
 
-    kx_vector = k0 * (n_I * torch.sin(theta) * torch.cos(phi) - fourier_indices * (
-            wavelength / period[0])).type(type_complex)
-    ky = k0 * n_I * torch.sin(theta) * torch.sin(phi)
+    if grating_type == 2:
+        ff = 2 * fourier_order + 1
+        order_x, order_y = fourier_indices.tile(ff), fourier_indices.repeat_interleave(ff)
+    else:
+        order_x, order_y = fourier_indices, 0 * fourier_indices
+    if grating_type == 0:
+        phi = 0
 
-    Kx = torch.diag(kx_vector / k0)
+    theta, phi = torch.as_tensor(theta), torch.as_tensor(phi)
 
-    resolution_z, resolution_y, resolution_x = resolution
-    field_cell = torch.zeros((resolution_z * len(layer_info_list), resolution_y, resolution_x, 6)).type(type_complex)
+    Kx = (n_I * torch.sin(theta) * torch.cos(phi) - order_x * (wavelength / period[0])).type(type_complex)
+    Ky = (n_I * torch.sin(theta) * torch.sin(phi) - order_y * (wavelength / period[-1])).type(type_complex)
+
+    if grating_type == 0:
+        coefficients = partial(field_coefficients_1d, pol, k0, Kx)
+    elif grating_type == 1:
+        coefficients = partial(field_coefficients_1d_conical, k0, Kx, Ky[0])
+    else:
+        coefficients = partial(field_coefficients_2d, k0, Kx, Ky)
 
-    T_layer = T1
+    # the top of each layer, and the bottom of the last one
+    surface = torch.zeros(1, device=T1.device, dtype=torch.float64)
+    depths = [surface] * (len(layer_info_list) - 1) + [torch.cat([surface, surface + layer_info_list[0][-1]])]
+    interfaces = torch.cat(list(slab_coefficients(coefficients, None, layer_info_list, T1, depths)))
 
-    big_I = torch.eye((len(T1)), device=device, dtype=type_complex)
+    if grating_type == 0:
+        if pol == 0:  # TE: Ey, Hx
+            flux = -interfaces[..., 0] * interfaces[..., 1].conj()
+        else:  # TM: Hy, Ex
+            flux = interfaces[..., 1] * interfaces[..., 0].conj()
+    else:
+        flux = interfaces[..., 0] * interfaces[..., 4].conj() - interfaces[..., 1] * interfaces[..., 3].conj()
+    flux = flux.real.sum(-1)
 
-    # From the first layer
-    for idx_layer, [E_conv_i, q_1, q_2, W_1, W_2, V_11, V_12, V_21, V_22, big_X, big_A_i, big_B, d] \
-            in enumerate(layer_info_list[::-1]):
+    # that of the incident wave, of unit E (H for TM)
+    incident = n_I * torch.cos(theta) if grating_type or pol == 0 else torch.cos(theta) / n_I
 
-        c = torch.cat([big_I, big_B @ big_A_i @ big_X])  @ T_layer
+    return flux / incident
 
-        cut = len(c) // 4
 
-        c1_plus = c[0*cut:1*cut]
-        c2_plus = c[1*cut:2*cut]
-        c1_minus = c[2*cut:3*cut]
-        c2_minus = c[3*cut:4*cut]
+def field_coefficients_1d(pol, k0, Kx, layer_info, T_layer, z):
+    """
+    Fourier coefficients of the fields of one layer of a 1D grating at depths z below its top:
+    (Ey, Hx, Hz) for TE, (Hy, Ex, Ez) for TM.
 
-        big_Q1 = torch.diag(q_1)
-        big_Q2 = torch.diag(q_2)
+    Returns:
+        (z, harmonics, 3) coefficients, and T_layer of the next layer
+    """
+    E_conv_i, q, W, X, a, b, d = layer_info
 
-        for k in range(resolution_z):
-            z = k / resolution_z * d
+    T_next = torch.linalg.solve(a, X * T_layer)
 
-            Sx = W_2 @ (expm(-k0 * big_Q2 * z) @ c2_plus + expm(k0 * big_Q2 * (z-d)) @ c2_minus)
+    c1 = T_layer[:, None]
+    c2 = b @ T_next[:, None]
 
-            Sy = V_11 @ (expm(-k0 * big_Q1 * z) @ c1_plus + expm(k0 * big_Q1 * (z-d)) @ c1_minus) \
-                 + V_12 @ (expm(-k0 * big_Q2 * z) @ c2_plus + expm(k0 * big_Q2 * (z-d)) @ c2_minus)
+    # diagonal propagators, (harmonics, z)
+    X_plus = torch.exp(-k0 * q[:, None] * z)
+    X_minus = torch.exp(k0 * q[:, None] * (z - d))
 
-            Ux = W_1 @ (-expm(-k0 * big_Q1 * z) @ c1_plus + expm(k0 * big_Q1 * (z-d)) @ c1_minus)
+    if pol == 0:  # TE
+        V = W * q
 
-            Uy = V_21 @ (-expm(-k0 * big_Q1 * z) @ c1_plus + expm(k0 * big_Q1 * (z-d)) @ c1_minus) \
-                 + V_22 @ (-expm(-k0 * big_Q2 * z) @ c2_plus + expm(k0 * big_Q2 * (z-d)) @ c2_minus)
+        Sy = W @ (X_plus * c1 + X_minus * c2)
+        Ux = V @ (-X_plus * c1 + X_minus * c2)
 
-            Sz = -1j * E_conv_i @ (Kx @ Uy - ky * Ux)
+        coeffs = [Sy, -1j * Ux, -1j * Kx[:, None] * Sy]
 
-            Uz = -1j * (Kx @ Sy - ky * Sx)
+    else:  # TM
+        EKx = E_conv_i * Kx
+        # the solver's o_E_conv @ W * q, from its eigenproblem o_E_conv @ W * q ** 2 = (Kx E_conv_i Kx - I) @ W
+        V = (Kx[:, None] * EKx - torch.eye(len(Kx), device=W.device)) @ W / q
 
-            for j in range(resolution_y):
-                for i in range(resolution_x):
-                    x = i * period[0] / resolution_x
+        Uy = W @ (X_plus * c1 + X_minus * c2)
+        Sx = V @ (-X_plus * c1 + X_minus * c2)
 
-                    exp_K = torch.exp(-1j*kx_vector.reshape((-1, 1)) * x)
+        coeffs = [Uy, 1j * Sx, -1j * EKx @ Uy]  # there is a better option for convergence
 
-                    Ex = Sx @ exp_K
-                    Ey = Sy @ exp_K
-                    Ez = Sz @ exp_K
+    return torch.stack(coeffs, dim=-1).swapaxes(0, 1), T_next
 
-                    Hx = -1j * Ux @ exp_K
-                    Hy = -1j * Uy @ exp_K
-                    Hz = -1j * Uz @ exp_K
 
-                    field_cell[resolution_z * idx_layer + k, j, i] = torch.tensor([Ex, Ey, Ez, Hx, Hy, Hz])
+def field_coefficients_1d_conical(k0, Kx, Ky, layer_info, T_layer, z):
+    """
+    Fourier coefficients of Ex, Ey, Ez, Hx, Hy, Hz of one layer of a conical 1D grating at depths z below its top.
 
-        T_layer = big_A_i @ big_X @ T_layer
+    Returns:
+        (z, harmonics, 6) coefficients, and T_layer of the next layer
+    """
+    E_conv_i, q_1, q_2, W_1, W_2, V_11, V_12, V_21, V_22, big_X, big_A, big_B, d = layer_info
 
-    return field_cell
+    T_next = torch.linalg.solve(big_A, big_X * T_layer)
+    c1_plus, c2_plus, c1_minus, c2_minus = torch.cat([T_layer, big_B @ T_next]).reshape((4, -1, 1))
 
+    # diagonal propagators, (harmonics, z)
+    X1_plus, X1_minus = torch.exp(-k0 * q_1[:, None] * z), torch.exp(k0 * q_1[:, None] * (z-d))
+    X2_plus, X2_minus = torch.exp(-k0 * q_2[:, None] * z), torch.exp(k0 * q_2[:, None] * (z-d))
 
-def field_dist_2d(wavelength, n_I, theta, phi, fourier_order, T1, layer_info_list, period, resolution=(100, 100, 100),
-                  device='cpu', type_complex=torch.complex128):
+    Sx = W_2 @ (X2_plus * c2_plus + X2_minus * c2_minus)
 
-    k0 = 2 * np.pi / wavelength
-    fourier_indices = torch.arange(-fourier_order, fourier_order + 1, device=device)
-    ff = 2 * fourier_order + 1
+    Sy = V_11 @ (X1_plus * c1_plus + X1_minus * c1_minus) \
+        + V_12 @ (X2_plus * c2_plus + X2_minus * c2_minus)
 
-    kx_vector = k0 * (n_I * np.sin(theta) * np.cos(phi) - fourier_indices * (
-            wavelength / period[0])).type(type_complex)
-    ky_vector = k0 * (n_I * np.sin(theta) * np.sin(phi) - fourier_indices * (
-            wavelength / period[1])).type(type_complex)
+    Ux = W_1 @ (-X1_plus * c1_plus + X1_minus * c1_minus)
 
-    Kx = torch.diag(kx_vector.tile(ff).flatten() / k0)
-    Ky = torch.diag(ky_vector.reshape((-1, 1)).tile(ff).flatten() / k0)
+    Uy = V_21 @ (-X1_plus * c1_plus + X1_minus * c1_minus) \
+        + V_22 @ (-X2_plus * c2_plus + X2_minus * c2_minus)
 
-    resolution_z, resolution_y, resolution_x = resolution
-    field_cell = torch.zeros((resolution_z * len(layer_info_list), resolution_y, resolution_x, 6)).type(type_complex)
+    Sz = -1j * E_conv_i @ (Kx[:, None] * Uy - Ky * Ux)
 
-    T_layer = T1
+    Uz = -1j * (Kx[:, None] * Sy - Ky * Sx)
 
-    big_I = torch.eye((len(T1)), device=device, dtype=type_complex)
+    coeffs = [Sx, Sy, Sz, -1j * Ux, -1j * Uy, -1j * Uz]
 
-    # From the first layer
-    for idx_layer, (E_conv_i, q, W_11, W_12, W_21, W_22, V_11, V_12, V_21, V_22, big_X, big_A_i, big_B, d)\
-            in enumerate(layer_info_list[::-1]):
+    return torch.stack(coeffs, dim=-1).swapaxes(0, 1), T_next
 
-        c = torch.cat([big_I, big_B @ big_A_i @ big_X])  @ T_layer
 
-        cut = len(c) // 4
+def field_coefficients_2d(k0, Kx, Ky, layer_info, T_layer, z):
+    """
+    Fourier coefficients of Ex, Ey, Ez, Hx, Hy, Hz of one layer of a 2D grating at depths z below its top.
 
-        c1_plus = c[0*cut:1*cut]
-        c2_plus = c[1*cut:2*cut]
-        c1_minus = c[2*cut:3*cut]
-        c2_minus = c[3*cut:4*cut]
+    Returns:
+        (z, harmonics, 6) coefficients, and T_layer of the next layer
+    """
+    E_conv_i, q, W_11, W_12, W_21, W_22, V_11, V_12, V_21, V_22, big_X, big_A, big_B, d = layer_info
 
-        q_1 = q[:len(q)//2]
-        q_2 = q[len(q)//2:]
-        big_Q1 = torch.diag(q_1)
-        big_Q2 = torch.diag(q_2)
+    T_next = torch.linalg.solve(big_A, big_X[:, None] * T_layer)
+    c1_plus, c2_plus, c1_minus, c2_minus = torch.cat([T_layer, big_B @ T_next]).reshape((4, -1, 1))
 
-        for k in range(resolution_z):
-            z = k / resolution_z * d
+    q_1 = q[:len(q)//2, None]
+    q_2 = q[len(q)//2:, None]
 
-            Sx = W_11 @ (expm(-k0 * big_Q1 * z) @ c1_plus + expm(k0 * big_Q1 * (z-d)) @ c1_minus) \
-                 + W_12 @ (expm(-k0 * big_Q2 * z) @ c2_plus + expm(k0 * big_Q2 * (z-d)) @ c2_minus)
+    # diagonal propagators, (harmonics, z)
+    X1_plus, X1_minus = torch.exp(-k0 * q_1 * z), torch.exp(k0 * q_1 * (z-d))
+    X2_plus, X2_minus = torch.exp(-k0 * q_2 * z), torch.exp(k0 * q_2 * (z-d))
 
-            Sy = W_21 @ (expm(-k0 * big_Q1 * z) @ c1_plus + expm(k0 * big_Q1 * (z-d)) @ c1_minus) \
-                 + W_22 @ (expm(-k0 * big_Q2 * z) @ c2_plus + expm(k0 * big_Q2 * (z-d)) @ c2_minus)
+    Sx = W_11 @ (X1_plus * c1_plus + X1_minus * c1_minus) \
+        + W_12 @ (X2_plus * c2_plus + X2_minus * c2_minus)
 
-            Ux = V_11 @ (-expm(-k0 * big_Q1 * z) @ c1_plus + expm(k0 * big_Q1 * (z-d)) @ c1_minus) \
-                 + V_12 @ (-expm(-k0 * big_Q2 * z) @ c2_plus + expm(k0 * big_Q2 * (z-d)) @ c2_minus)
+    Sy = W_21 @ (X1_plus * c1_plus + X1_minus * c1_minus) \
+        + W_22 @ (X2_plus * c2_plus + X2_minus * c2_minus)
 
-            Uy = V_21 @ (-expm(-k0 * big_Q1 * z) @ c1_plus + expm(k0 * big_Q1 * (z-d)) @ c1_minus) \
-                 + V_22 @ (-expm(-k0 * big_Q2 * z) @ c2_plus + expm(k0 * big_Q2 * (z-d)) @ c2_minus)
+    Ux = V_11 @ (-X1_plus * c1_plus + X1_minus * c1_minus) \
+        + V_12 @ (-X2_plus * c2_plus + X2_minus * c2_minus)
 
-            Sz = -1j * E_conv_i @ (Kx @ Uy - Ky @ Ux)
+    Uy = V_21 @ (-X1_plus * c1_plus + X1_minus * c1_minus) \
+        + V_22 @ (-X2_plus * c2_plus + X2_minus * c2_minus)
 
-            Uz = -1j * (Kx @ Sy - Ky @ Sx)
+    Sz = -1j * E_conv_i @ (Kx[:, None] * Uy - Ky[:, None] * Ux)
 
-            for j in range(resolution_y):
-                y = j * period[1] / resolution_y
+    Uz = -1j * (Kx[:, None] * Sy - Ky[:, None] * Sx)
 
-                for i in range(resolution_x):
+    coeffs = [Sx, Sy, Sz, -1j * Ux, -1j * Uy, -1j * Uz]
 
-                    x = i * period[0] / resolution_x
+    return torch.stack(coeffs, dim=-1).swapaxes(0, 1), T_next
 
-                    exp_K = torch.exp(-1j*kx_vector.reshape((1, -1)) * x) * torch.exp(-1j*ky_vector.reshape((-1, 1)) * y)
-                    exp_K = exp_K.flatten()
 
-                    Ex = Sx.T @ exp_K
-                    Ey = Sy.T @ exp_K
-                    Ez = Sz.T @ exp_K
+def half_space_coefficients(grating_type, pol, k0, Kx, Ky, eps, interface, z, incidence=None):
+    """
+    Fourier coefficients of the fields in the incidence or transmission half-space, of permittivity eps, at signed
+    distances z from its interface with the stack: negative above the stack, positive below it.
 
-                    Hx = -1j * Ux.T @ exp_K
-                    Hy = -1j * Uy.T @ exp_K
-                    Hz = -1j * Uz.T @ exp_K
+    Each harmonic is a pair of plane waves there, going up and down. Only the waves leaving the stack are kept, and
+    the incident one above it: these are the Rayleigh expansions of the reflected and transmitted orders, so no
+    padding layer is needed to see them. As in the solver, their amplitudes follow from the tangential E on the
+    interface (H for TM), minus the incident wave above the stack.
 
-                    field_cell[resolution_z * idx_layer + k, j, i] = torch.tensor([Ex, Ey, Ez, Hx, Hy, Hz])
+    Args:
+        interface: (harmonics, components) coefficients on the interface, from field_coefficients_*
+        incidence: index of the incident harmonic above the stack, None below it
 
-        T_layer = big_A_i @ big_X @ T_layer
+    Returns:
+        (z, harmonics, components) coefficients
+    """
+    q = (Kx ** 2 + Ky ** 2 - eps) ** 0.5
+    # the down-going wave decays, or propagates with kz = -1j * k0 * q > 0
+    q = torch.where((q.real == 0) & (q.imag < 0), -q, q)
 
-    return field_cell
+    one, zero = torch.ones_like(q), torch.zeros_like(q)
+
+    # as in a uniform layer, per harmonic: even = M_even @ (c_plus + c_minus), odd = M_odd @ (c_minus - c_plus)
+    if grating_type == 0:
+        M_even = one[:, None, None]
+        M_odd = (q if pol == 0 else q / eps)[:, None, None]
+        even, odd = interface[:, :1], (1j if pol == 0 else -1j) * interface[:, 1:2]
+    else:
+        if grating_type == 1:
+            a, b = Kx ** 2 - eps, Kx ** 2 / eps - 1
+            M_even = [[zero, one], [q / a, Ky * Kx / a]]
+            M_odd = [[one, zero], [Ky * Kx / (eps * b), q / b]]
+        else:
+            M_even = [[one, zero], [zero, one]]
+            M_odd = [[-Kx * Ky / q, (Kx ** 2 - eps) / q], [(eps - Ky ** 2) / q, Kx * Ky / q]]
+        M_even, M_odd = (torch.stack([torch.stack(row, dim=-1) for row in M], dim=-2) for M in (M_even, M_odd))
+        even, odd = interface[:, :2], 1j * interface[:, 3:5]
+
+    c_sum = torch.linalg.solve(M_even, even[..., None])[..., 0]
+
+    z = z[:, None, None]
+    q = q[:, None]
+    if incidence is None:  # below the stack, going down
+        plus = c_sum * torch.exp(-k0 * q * z)
+        minus = torch.zeros_like(plus)
+    else:  # above it, going up, and the incident wave, whose exponent alone is taken not to overflow the others
+        incident = (torch.arange(len(q), device=q.device) == incidence)[:, None]
+        if grating_type == 0:  # unit amplitude, as delta_i0 in the solver
+            c_plus = incident * torch.ones_like(c_sum)
+        else:
+            c_plus = incident * (c_sum - torch.linalg.solve(M_odd, odd[..., None])[..., 0]) / 2
+        plus = c_plus * torch.exp(-k0 * torch.where(incident, q, torch.zeros_like(q)) * z)
+        minus = (c_sum - c_plus) * torch.exp(k0 * q * z)
+
+    even = (M_even @ (plus + minus)[..., None])[..., 0]
+    odd = (M_odd @ (minus - plus)[..., None])[..., 0]
+
+    if grating_type == 0:
+        if pol == 0:  # TE
+            Sy, Ux = even[..., 0], odd[..., 0]
+            coeffs = [Sy, -1j * Ux, -1j * Kx * Sy]
+        else:  # TM
+            Uy, Sx = even[..., 0], odd[..., 0]
+            coeffs = [Uy, 1j * Sx, -1j * Kx / eps * Uy]
+    else:
+        Sx, Sy = even[..., 0], even[..., 1]
+        Ux, Uy = odd[..., 0], odd[..., 1]
+        Sz = -1j / eps * (Kx * Uy - Ky * Ux)
+        Uz = -1j * (Kx * Sy - Ky * Sx)
+        coeffs = [Sx, Sy, Sz, -1j * Ux, -1j * Uy, -1j * Uz]
+
+    return torch.stack(coeffs, dim=-1)
+
+
+def fourier_series_1d(coeffs, kx_vector, x):
+    # (..., harmonics, component) to (..., x, component), in one product
+    exp_K = torch.exp(-1j * kx_vector[:, None] * x)
+
+    return (coeffs.swapaxes(-1, -2) @ exp_K).swapaxes(-1, -2)
+
+
+def fourier_series_2d(coeffs, order_x, order_y, kx_vector, ky_vector, x, y):
+    # (..., harmonics, component) to (..., y, x, component).
+    # The basis is separable: scattered onto their (order_y, order_x) grid, the harmonics take two products.
+    index_x, index_y = order_x - order_x.min(), order_y - order_y.min()
+
+    exp_x = torch.zeros((index_x.max() + 1, len(x)), dtype=coeffs.dtype, device=coeffs.device)
+    exp_x[index_x] = torch.exp(-1j * kx_vector[:, None] * x).type(coeffs.dtype)
+    exp_y = torch.zeros((len(y), index_y.max() + 1), dtype=coeffs.dtype, device=coeffs.device)
+    exp_y[:, index_y] = torch.exp(-1j * y[:, None] * ky_vector).type(coeffs.dtype)
+
+    grid = torch.zeros(coeffs.shape[:-2] + coeffs.shape[-1:] + (index_y.max() + 1, index_x.max() + 1),
+                       dtype=coeffs.dtype, device=coeffs.device)
+    grid[..., index_y, index_x] = coeffs.swapaxes(-1, -2)
+
+    return torch.movedim(exp_y @ grid @ exp_x, -3, -1)
+
+
+
+def fourier_series_grid(coeffs, order_x, order_y, kx0, ky0, period, shape):
+    """
+    fourier_series_2d on the uniform (y, x) grid of the given shape over one period, by inverse FFT.
+    The wavevector of order (m, n) is (kx0 - 2 pi m / period[0], ky0 - 2 pi n / period[1]), so on this grid its
+    exponential is the offset phase exp(-1j (kx0 x + ky0 y)) times a DFT kernel: the coefficients are added into
+    a spectrum of the grid shape, orders beyond the grid onto their alias, and each plane takes one ifft2.
+
+    Returns:
+        (..., y, x, component)
+    """
+    resolution_y, resolution_x = shape
+
+    index = (order_y % resolution_y) * resolution_x + order_x % resolution_x
+    spectrum = torch.zeros(coeffs.shape[:-2] + coeffs.shape[-1:] + (resolution_y * resolution_x,),
+                           dtype=coeffs.dtype, device=coeffs.device)
+    spectrum.index_add_(-1, index.to(coeffs.device), coeffs.swapaxes(-1, -2))
+
+    spectrum = spectrum.reshape(spectrum.shape[:-1] + (resolution_y, resolution_x))
+    res = torch.fft.ifft2(spectrum, norm='forward')
+
+    x = torch.arange(resolution_x, device=coeffs.device, dtype=torch.float64) * period[0] / resolution_x
+    y = torch.arange(resolution_y, device=coeffs.device, dtype=torch.float64) * period[1] / resolution_y
+    res = res * torch.exp(-1j * (kx0 * x + ky0 * y[:, None])).type(res.dtype)
 
+    return torch.movedim(res, -3, -1)
 
 def field_plot_zx(field_cell, pol=0, plot_indices=(1, 1, 1, 1, 1, 1), y_slice=0, z_slice=-1, zx=True, yx=True):
 
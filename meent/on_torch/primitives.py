@@ -41,3 +41,20 @@ class Eig(torch.autograd.Function):
             grad = torch.real(grad)
 
         return grad
+
+
+def homogeneous_layers(ucell):
+    """
+    Which layers of ucell are uniform, from its values before the solve. The solvers take the closed form of those
+    layers from this description, read once per run instead of a device sync per layer.
+
+    Returns:
+        tuple of bool per layer, or None when ucell requires grad: every layer then takes Eig.
+    """
+    if ucell is None or (isinstance(ucell, torch.Tensor) and ucell.requires_grad):
+        return None
+
+    ucell = torch.as_tensor(ucell)
+    ucell = ucell.reshape(len(ucell), -1)
+
+    return tuple((ucell == ucell[:, :1]).all(dim=1).tolist())
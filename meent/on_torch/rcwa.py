@@ -4,7 +4,9 @@ import torch
 
 from ._base import _BaseRCWA
 from .convolution_matrix import to_conv_mat, put_permittivity_in_ucell, read_material_table
-from .field_distribution import field_dist_1d, field_dist_2d, field_plot_zx, field_dist_1d_conical
+from .primitives import homogeneous_layers
+from .field_distribution import field_dist_1d, field_dist_2d, field_plot_zx, field_dist_1d_conical, field_at_points, \
+    interface_flux
 
 
 class RCWATorch(_BaseRCWA):
@@ -24,18 +26,16 @@ class RCWATorch(_BaseRCWA):
         self.mat_table = read_material_table()
         self.layer_info_list = []
 
-    def solve(self, wavelength, e_conv_all, o_e_conv_all):
-
-        # TODO: !handle uniform layer
+    def solve(self, wavelength, e_conv_all, o_e_conv_all, homogeneous_layers=None):
 
         self.get_kx_vector()
 
         if self.grating_type == 0:
-            de_ri, de_ti = self.solve_1d(wavelength, e_conv_all, o_e_conv_all)
+            de_ri, de_ti = self.solve_1d(wavelength, e_conv_all, o_e_conv_all, homogeneous_layers)
         elif self.grating_type == 1:
-            de_ri, de_ti = self.solve_1d_conical(wavelength, e_conv_all, o_e_conv_all)
+            de_ri, de_ti = self.solve_1d_conical(wavelength, e_conv_all, o_e_conv_all, homogeneous_layers)
         elif self.grating_type == 2:
-            de_ri, de_ti = self.solve_2d(wavelength, e_conv_all, o_e_conv_all)
+            de_ri, de_ti = self.solve_2d(wavelength, e_conv_all, o_e_conv_all, homogeneous_layers)
         else:
             raise ValueError
 
@@ -49,30 +49,66 @@ class RCWATorch(_BaseRCWA):
         E_conv_all = to_conv_mat(ucell, self.fourier_order, self.device, type_complex=self.type_complex)
         o_E_conv_all = to_conv_mat(1 / ucell, self.fourier_order, self.device, type_complex=self.type_complex)
 
-        de_ri, de_ti = self.solve(self.wavelength, E_conv_all, o_E_conv_all)
+        de_ri, de_ti = self.solve(self.wavelength, E_conv_all, o_E_conv_all, homogeneous_layers(self.ucell))
 
         return de_ri, de_ti
 
-    def calculate_field(self, resolution=None, plot=True):
+    def calculate_field(self, resolution=None, plot=True, synthesis='dense', z_step=None, z=None):
+        """
+        Fields of the last run_ucell on a uniform grid in every layer.
+        synthesis is 'dense' (matrix products) or 'fft' (inverse FFT per plane). z_step or z sample z by a step or at
+        given depths through the stack instead of resolution_z per layer, see layer_depths; z may reach into the
+        incidence and transmission half-spaces, negative above the stack and beyond its thickness below it.
+        """
 
         if self.grating_type == 0:
             resolution = [100, 1, 100] if not resolution else resolution
             field_cell = field_dist_1d(self.wavelength, self.n_I, self.theta, self.fourier_order, self.T1,
                                        self.layer_info_list, self.period, self.pol, resolution=resolution,
-                                       device=self.device, type_complex=self.type_complex)
+                                       device=self.device, type_complex=self.type_complex, synthesis=synthesis,
+                                       z_step=z_step, z=z, n_II=self.n_II)
         elif self.grating_type == 1:
             resolution = [100, 1, 100] if not resolution else resolution
             field_cell = field_dist_1d_conical(self.wavelength, self.n_I, self.theta, self.phi, self.fourier_order,
                                                self.T1, self.layer_info_list, self.period, resolution=resolution,
-                                               device=self.device, type_complex=self.type_complex)
+                                               device=self.device, type_complex=self.type_complex, synthesis=synthesis,
+                                               z_step=z_step, z=z, n_II=self.n_II)
 
         else:
             resolution = [100, 100, 100] if not resolution else resolution
             field_cell = field_dist_2d(self.wavelength, self.n_I, self.theta, self.phi, self.fourier_order, self.T1,
                                        self.layer_info_list, self.period, resolution=resolution,
-                                       device=self.device, type_complex=self.type_complex)
+                                       device=self.device, type_complex=self.type_complex, synthesis=synthesis,
+                                       z_step=z_step, z=z, n_II=self.n_II)
 
         if plot:
             field_plot_zx(field_cell, self.pol)
 
         return field_cell
+
+    def field_at(self, x, y, z):
+        """
+        Fields of the last run_ucell at the points (x, y, z), broadcast together, computing only the layers that hold
+        them: e.g. a plane under the structure from x and y grids at one z, or a few probe points. See field_at_points.
+        """
+        return field_at_points(self.grating_type, self.wavelength, self.n_I, self.theta, self.phi, self.fourier_order,
+                               self.T1, self.layer_info_list, self.period, x, y, z, pol=self.pol, device=self.device,
+                               type_complex=self.type_complex, n_II=self.n_II)
+
+    def flux_at_interfaces(self):
+        """
+        Power flowing down through the top of each layer of the last run_ucell, from the top layer down, and through
+        the bottom of the stack, per unit incident power. Computed from the modal amplitudes on the interfaces, without
+        any field grid; see interface_flux.
+        """
+        return interface_flux(self.grating_type, self.wavelength, self.n_I, self.theta, self.phi, self.fourier_order,
+                              self.T1, self.layer_info_list, self.period, pol=self.pol, device=self.device,
+                              type_complex=self.type_complex)
+
+    def absorption_per_layer(self):
+        """
+        Fraction of the incident power absorbed in each layer of the last run_ucell, from the top layer down: the
+        difference of the fluxes through its top and bottom. They add up to 1 - sum(de_ri) - sum(de_ti).
+        """
+        flux = self.flux_at_interfaces()
+        return flux[:-1] - flux[1:]
@@ -2,6 +2,37 @@ import torch
 
 from .primitives import Eig
 
+# Diagonal operators (Kx, Ky, Y_I, Z_I, X, F_c, F_s, ...) are carried as their diagonals
+# and applied by broadcasting: diag(d) @ m == d[:, None] * m and m @ diag(d) == m * d[None, :].
+
+
+def solve_right(a, *b_list):
+    # b @ a^-1 for every b in b_list, sharing one LU factorization of a
+    b = torch.cat(b_list, dim=0)
+    x = torch.linalg.solve(a.T, b.T).T
+
+    return torch.split(x, [b.shape[0] for b in b_list], dim=0)
+
+
+def solve_left(a, b, a_i=None):
+    # a^-1 @ b without forming the inverse, unless it is already known (e.g. in closed form)
+    if a_i is not None:
+        return a_i @ b
+    return torch.linalg.solve(a, b)
+
+
+def block_diag(a, b, c, d):
+    # [[diag(a), diag(b)], [diag(c), diag(d)]]
+    return torch.cat([
+        torch.cat([torch.diag(a), torch.diag(b)], dim=1),
+        torch.cat([torch.diag(c), torch.diag(d)], dim=1)])
+
+
+def block_diag_inv(a, b, c, d):
+    # inverse of block_diag(a, b, c, d) in closed form
+    det = a * d - b * c
+    return block_diag(d / det, -b / det, -c / det, a / det)
+
 
 def transfer_1d_1(ff, polarization, k0, n_I, n_II, kx_vector, theta, delta_i0, fourier_order,
                   device='cpu', type_complex=torch.complex128):
@@ -14,24 +45,24 @@ def transfer_1d_1(ff, polarization, k0, n_I, n_II, kx_vector, theta, delta_i0, f
     k_I_z = torch.conj(k_I_z)
     k_II_z = torch.conj(k_II_z)
 
-    Kx = torch.diag(kx_vector / k0)
+    Kx = kx_vector / k0
 
     f = torch.eye(ff, device=device, dtype=type_complex)
 
     if polarization == 0:  # TE
-        Y_I = torch.diag(k_I_z / k0)
-        Y_II = torch.diag(k_II_z / k0)
+        Y_I = k_I_z / k0
+        Y_II = k_II_z / k0
 
         YZ_I = Y_I
-        g = 1j * Y_II
+        g = torch.diag(1j * Y_II)
         inc_term = 1j * n_I * torch.cos(theta) * delta_i0
 
     elif polarization == 1:  # TM
-        Z_I = torch.diag(k_I_z / (k0 * n_I ** 2))
-        Z_II = torch.diag(k_II_z / (k0 * n_II ** 2))
+        Z_I = k_I_z / (k0 * n_I ** 2)
+        Z_II = k_II_z / (k0 * n_II ** 2)
 
         YZ_I = Z_I
-        g = 1j * Z_II
+        g = torch.diag(1j * Z_II)
         inc_term = 1j * delta_i0 * torch.cos(theta) / n_I
 
     else:
@@ -42,28 +73,53 @@ def transfer_1d_1(ff, polarization, k0, n_I, n_II, kx_vector, theta, delta_i0, f
     return kx_vector, Kx, k_I_z, k_II_z, f, YZ_I, g, inc_term, T
 
 
-def transfer_1d_2(k0, q, d, W, V, f, g, fourier_order, T, device='cpu', type_complex=torch.complex128):
+def transfer_1d_wv_homogeneous(polarization, Kx, eps, device='cpu', type_complex=torch.complex128):
+    # uniform layer: A (or o_E_conv_i @ B) is diagonal, so W = I and q is known
 
-    X = torch.diag(torch.exp(-k0 * q * d))
+    q = (Kx ** 2 - eps) ** 0.5
+    W = torch.eye(len(q), device=device, dtype=type_complex)
 
-    W_i = torch.linalg.inv(W)
-    V_i = torch.linalg.inv(V)
+    if polarization == 0:
+        E_conv_i = None
+        V = torch.diag(q)
+        V_i = torch.diag(1 / q)
 
-    a = 0.5 * (W_i @ f + V_i @ g)
-    b = 0.5 * (W_i @ f - V_i @ g)
+    elif polarization == 1:
+        E_conv_i = torch.diag(torch.ones_like(q) / eps)
+        V = torch.diag(q / eps)
+        V_i = torch.diag(eps / q)
 
-    a_i = torch.linalg.inv(a)
+    else:
+        raise ValueError
 
-    f = W @ (torch.eye(2 * fourier_order + 1, device=device, dtype=type_complex) + X @ b @ a_i @ X)
-    g = V @ (torch.eye(2 * fourier_order + 1, device=device, dtype=type_complex) - X @ b @ a_i @ X)
-    T = T @ a_i @ X
+    return E_conv_i, q, W, V, W, V_i
 
-    return X, f, g, T, a_i, b
+
+def transfer_1d_2(k0, q, d, W, V, f, g, fourier_order, T, device='cpu', type_complex=torch.complex128,
+                  W_i=None, V_i=None):
+
+    X = torch.exp(-k0 * q * d)
+
+    W_i_f = solve_left(W, f, W_i)
+    V_i_g = solve_left(V, g, V_i)
+
+    a = 0.5 * (W_i_f + V_i_g)
+    b = 0.5 * (W_i_f - V_i_g)
+
+    b_a_i, T_a_i = solve_right(a, b, T)
+
+    X_b_a_i_X = X[:, None] * b_a_i * X[None, :]
+
+    f = W @ (torch.eye(2 * fourier_order + 1, device=device, dtype=type_complex) + X_b_a_i_X)
+    g = V @ (torch.eye(2 * fourier_order + 1, device=device, dtype=type_complex) - X_b_a_i_X)
+    T = T_a_i * X[None, :]
+
+    return X, f, g, T, a, b
 
 
 def transfer_1d_3(g1, YZ_I, f1, delta_i0, inc_term, T, k_I_z, k0, n_I, n_II, theta, polarization, k_II_z):
 
-    T1 = torch.linalg.inv(g1 + 1j * YZ_I @ f1) @ (1j * YZ_I @ delta_i0 + inc_term)
+    T1 = torch.linalg.solve(g1 + 1j * YZ_I[:, None] * f1, 1j * YZ_I * delta_i0 + inc_term)
     R = f1 @ T1 - delta_i0
     T = T @ T1
 
@@ -96,26 +152,26 @@ def transfer_1d_conical_1(ff, k0, n_I, n_II, kx_vector, theta, phi, device='cpu'
     k_I_z = torch.conj(k_I_z.flatten())
     k_II_z = torch.conj(k_II_z.flatten())
 
-    Kx = torch.diag(kx_vector / k0)
+    Kx = kx_vector / k0
 
     varphi = torch.arctan(ky / kx_vector)
 
-    Y_I = torch.diag(k_I_z / k0)
-    Y_II = torch.diag(k_II_z / k0)
+    Y_I = k_I_z / k0
+    Y_II = k_II_z / k0
 
-    Z_I = torch.diag(k_I_z / (k0 * n_I ** 2))
-    Z_II = torch.diag(k_II_z / (k0 * n_II ** 2))
+    Z_I = k_I_z / (k0 * n_I ** 2)
+    Z_II = k_II_z / (k0 * n_II ** 2)
 
     big_F = torch.cat(
         [
             torch.cat([I, O], dim=1),
-            torch.cat([O, 1j * Z_II], dim=1),
+            torch.cat([O, torch.diag(1j * Z_II)], dim=1),
         ]
     )
 
     big_G = torch.cat(
         [
-            torch.cat([1j * Y_II, O], dim=1),
+            torch.cat([torch.diag(1j * Y_II), O], dim=1),
             torch.cat([O, I], dim=1),
         ]
     )
@@ -125,16 +181,15 @@ def transfer_1d_conical_1(ff, k0, n_I, n_II, kx_vector, theta, phi, device='cpu'
     return Kx, ky, k_I_z, k_II_z, varphi, Y_I, Y_II, Z_I, Z_II, big_F, big_G, big_T
 
 
-def transfer_1d_conical_2(k0, Kx, ky, E_conv, E_i, o_E_conv_i, ff, d, varphi, big_F, big_G, big_T,
-                          device='cpu', type_complex=torch.complex128):
+def transfer_1d_conical_wv(k0, Kx, ky, E_conv, o_E_conv, ff, varphi, device='cpu', type_complex=torch.complex128):
 
     I = torch.eye(ff, device=device, dtype=type_complex)
-    O = torch.zeros((ff, ff), device=device, dtype=type_complex)
 
-    A = Kx ** 2 - E_conv
-    B = Kx @ E_i @ Kx - I
-    A_i = torch.linalg.inv(A)
-    B_i = torch.linalg.inv(B)
+    E_conv_i = torch.linalg.inv(E_conv)
+    o_E_conv_i = torch.linalg.inv(o_E_conv)
+
+    A = torch.diag(Kx ** 2) - E_conv
+    B = Kx[:, None] * E_conv_i * Kx[None, :] - I
 
     to_decompose_W_1 = ky ** 2 * I + A
     to_decompose_W_2 = ky ** 2 * I + B @ o_E_conv_i
@@ -148,34 +203,26 @@ def transfer_1d_conical_2(k0, Kx, ky, E_conv, E_i, o_E_conv_i, ff, d, varphi, bi
     q_1 = eigenvalues_1 ** 0.5
     q_2 = eigenvalues_2 ** 0.5
 
-    Q_1 = torch.diag(q_1)
-    Q_2 = torch.diag(q_2)
-
-    V_11 = A_i @ W_1 @ Q_1
-    V_12 = (ky / k0) * A_i @ Kx @ W_2
-    V_21 = (ky / k0) * B_i @ Kx @ E_i @ W_1
-    V_22 = B_i @ W_2 @ Q_2
-
-    X_1 = torch.diag(torch.exp(-k0 * q_1 * d))
-    X_2 = torch.diag(torch.exp(-k0 * q_2 * d))
+    # one factorization of A and of B each, for two right-hand sides
+    A_i_rhs = torch.linalg.solve(A, torch.cat([W_1 * q_1[None, :], Kx[:, None] * W_2], dim=1))
+    B_i_rhs = torch.linalg.solve(B, torch.cat([Kx[:, None] * (E_conv_i @ W_1), W_2 * q_2[None, :]], dim=1))
 
-    F_c = torch.diag(torch.cos(varphi))
-    F_s = torch.diag(torch.sin(varphi))
+    V_11 = A_i_rhs[:, :ff]
+    V_12 = (ky / k0) * A_i_rhs[:, ff:]
+    V_21 = (ky / k0) * B_i_rhs[:, :ff]
+    V_22 = B_i_rhs[:, ff:]
 
-    V_ss = F_c @ V_11
-    V_sp = F_c @ V_12 - F_s @ W_2
-    W_ss = F_c @ W_1 + F_s @ V_21
-    W_sp = F_s @ V_22
-    W_ps = F_s @ V_11
-    W_pp = F_c @ W_2 + F_s @ V_12
-    V_ps = F_c @ V_21 - F_s @ W_1
-    V_pp = F_c @ V_22
+    F_c = torch.cos(varphi)[:, None]
+    F_s = torch.sin(varphi)[:, None]
 
-    big_I = torch.eye(2 * (len(I)), device=device, dtype=type_complex)
-
-    big_X = torch.cat([
-        torch.cat([X_1, O], dim=1),
-        torch.cat([O, X_2], dim=1)])
+    V_ss = F_c * V_11
+    V_sp = F_c * V_12 - F_s * W_2
+    W_ss = F_c * W_1 + F_s * V_21
+    W_sp = F_s * V_22
+    W_ps = F_s * V_11
+    W_pp = F_c * W_2 + F_s * V_12
+    V_ps = F_c * V_21 - F_s * W_1
+    V_pp = F_c * V_22
 
     big_W = torch.cat([
         torch.cat([V_ss, V_sp], dim=1),
@@ -185,21 +232,61 @@ def transfer_1d_conical_2(k0, Kx, ky, E_conv, E_i, o_E_conv_i, ff, d, varphi, bi
         torch.cat([W_ss, W_sp],  dim=1),
         torch.cat([V_ps, V_pp], dim=1)])
 
-    big_W_i = torch.linalg.inv(big_W)
-    big_V_i = torch.linalg.inv(big_V)
+    # big_W and big_V are factorized in the cascade (transfer_1d_conical_2)
+    big_W_i = None
+    big_V_i = None
+
+    return E_conv_i, q_1, q_2, W_1, W_2, V_11, V_12, V_21, V_22, big_W, big_V, big_W_i, big_V_i
+
+
+def transfer_1d_conical_wv_homogeneous(k0, Kx, ky, eps, varphi):
+    # uniform layer: every block is diagonal, so the modes and the inverses are elementwise
+
+    kx = Kx
+    a = kx ** 2 - eps
+    b = kx ** 2 / eps - 1
+
+    q = (ky ** 2 + a) ** 0.5
+    one = torch.ones_like(q)
+
+    v_11 = q / a
+    v_12 = (ky / k0) * kx / a
+    v_21 = (ky / k0) * kx / (eps * b)
+    v_22 = q / b
+
+    c = torch.cos(varphi)
+    s = torch.sin(varphi)
+
+    big_W_diag = (c * v_11, c * v_12 - s, s * v_11, c + s * v_12)
+    big_V_diag = (c + s * v_21, s * v_22, c * v_21 - s, c * v_22)
+
+    return torch.diag(one / eps), q, q, torch.diag(one), torch.diag(one), \
+        torch.diag(v_11), torch.diag(v_12), torch.diag(v_21), torch.diag(v_22), \
+        block_diag(*big_W_diag), block_diag(*big_V_diag), block_diag_inv(*big_W_diag), block_diag_inv(*big_V_diag)
+
+
+def transfer_1d_conical_2(k0, d, q_1, q_2, big_W, big_V, big_W_i, big_V_i, ff, big_F, big_G, big_T,
+                          device='cpu', type_complex=torch.complex128):
+
+    big_I = torch.eye(2 * ff, device=device, dtype=type_complex)
+    big_X = torch.exp(-k0 * torch.cat([q_1, q_2]) * d)
+
+    big_W_i_F = solve_left(big_W, big_F, big_W_i)
+    big_V_i_G = solve_left(big_V, big_G, big_V_i)
 
+    big_A = 0.5 * (big_W_i_F + big_V_i_G)
+    big_B = 0.5 * (big_W_i_F - big_V_i_G)
 
-    big_A = 0.5 * (big_W_i @ big_F + big_V_i @ big_G)
-    big_B = 0.5 * (big_W_i @ big_F - big_V_i @ big_G)
+    big_B_A_i, big_T_A_i = solve_right(big_A, big_B, big_T)
 
-    big_A_i = torch.linalg.inv(big_A)
+    big_X_B_A_i_X = big_X[:, None] * big_B_A_i * big_X[None, :]
 
-    big_F = big_W @ (big_I + big_X @ big_B @ big_A_i @ big_X)
-    big_G = big_V @ (big_I - big_X @ big_B @ big_A_i @ big_X)
+    big_F = big_W @ (big_I + big_X_B_A_i_X)
+    big_G = big_V @ (big_I - big_X_B_A_i_X)
 
-    big_T = big_T @ big_A_i @ big_X
+    big_T = big_T_A_i * big_X[None, :]
 
-    return big_X, big_F, big_G, big_T, big_A_i, big_B, W_1, W_2, V_11, V_12, V_21, V_22, q_1, q_2
+    return big_X, big_F, big_G, big_T, big_A, big_B
 
 
 def transfer_1d_conical_3(big_F, big_G, big_T, Z_I, Y_I, psi, theta, ff, delta_i0, k_I_z, k0, n_I, n_II, k_II_z,
@@ -221,8 +308,8 @@ def transfer_1d_conical_3(big_F, big_G, big_T, Z_I, Y_I, psi, theta, ff, delta_i
     final_A = torch.cat(
         [
             torch.cat([I, O, -big_F_11, -big_F_12], dim=1),
-            torch.cat([O, -1j * Z_I, -big_F_21, -big_F_22], dim=1),
-            torch.cat([-1j * Y_I, O, -big_G_11, -big_G_12], dim=1),
+            torch.cat([O, torch.diag(-1j * Z_I), -big_F_21, -big_F_22], dim=1),
+            torch.cat([torch.diag(-1j * Y_I), O, -big_G_11, -big_G_12], dim=1),
             torch.cat([O, I, -big_G_21, -big_G_22], dim=1),
         ]
     )
@@ -234,7 +321,7 @@ def transfer_1d_conical_3(big_F, big_G, big_T, Z_I, Y_I, psi, theta, ff, delta_i
         1j * n_I * torch.cos(psi) * delta_i0
     ])
 
-    final_RT = torch.linalg.inv(final_A) @ final_B
+    final_RT = torch.linalg.solve(final_A, final_B)
 
     R_s = final_RT[:ff].flatten()
     R_p = final_RT[ff:2 * ff].flatten()
@@ -272,27 +359,27 @@ def transfer_2d_1(ff, k0, n_I, n_II, kx_vector, period, fourier_indices, theta,
     k_I_z = torch.conj(k_I_z.flatten())
     k_II_z = torch.conj(k_II_z.flatten())
 
-    Kx = torch.diag(kx_vector.tile(ff).flatten() / k0)
-    Ky = torch.diag(ky_vector.reshape((-1, 1)).tile(ff).flatten() / k0)
+    Kx = kx_vector.tile(ff).flatten() / k0
+    Ky = ky_vector.reshape((-1, 1)).tile(ff).flatten() / k0
 
     varphi = torch.arctan(ky_vector.reshape((-1, 1)) / kx_vector).flatten()
 
-    Y_I = torch.diag(k_I_z / k0)
-    Y_II = torch.diag(k_II_z / k0)
+    Y_I = k_I_z / k0
+    Y_II = k_II_z / k0
 
-    Z_I = torch.diag(k_I_z / (k0 * n_I ** 2))
-    Z_II = torch.diag(k_II_z / (k0 * n_II ** 2))
+    Z_I = k_I_z / (k0 * n_I ** 2)
+    Z_II = k_II_z / (k0 * n_II ** 2)
 
     big_F = torch.cat(
         [
             torch.cat([I, O], dim=1),
-            torch.cat([O, 1j * Z_II], dim=1),
+            torch.cat([O, torch.diag(1j * Z_II)], dim=1),
         ]
     )
 
     big_G = torch.cat(
         [
-            torch.cat([1j * Y_II, O], dim=1),
+            torch.cat([torch.diag(1j * Y_II), O], dim=1),
             torch.cat([O, I], dim=1),
         ]
     )
@@ -306,37 +393,65 @@ def transfer_2d_wv(ff, Kx, E_conv_i, Ky, o_E_conv_i, E_conv, device='cpu', type_
 
     I = torch.eye(ff ** 2, device=device, dtype=type_complex)
 
-    B = Kx @ E_conv_i @ Kx - I
-    D = Ky @ E_conv_i @ Ky - I
+    Kx_c, Kx_r = Kx[:, None], Kx[None, :]
+    Ky_c, Ky_r = Ky[:, None], Ky[None, :]
+
+    B = Kx_c * E_conv_i * Kx_r - I
+    D = Ky_c * E_conv_i * Ky_r - I
 
     S2_from_S = torch.cat(
         [
-            torch.cat([Ky ** 2 + B @ o_E_conv_i, Kx @ (E_conv_i @ Ky @ E_conv - Ky)], dim=1),
-            torch.cat([Ky @ (E_conv_i @ Kx @ o_E_conv_i - Kx), Kx ** 2 + D @ E_conv], dim=1)
+            torch.cat([torch.diag(Ky ** 2) + B @ o_E_conv_i, Kx_c * ((E_conv_i * Ky_r) @ E_conv - torch.diag(Ky))],
+                      dim=1),
+            torch.cat([Ky_c * ((E_conv_i * Kx_r) @ o_E_conv_i - torch.diag(Kx)), torch.diag(Kx ** 2) + D @ E_conv],
+                      dim=1)
         ])
 
     eigenvalues, W = Eig.apply(S2_from_S)
 
     q = eigenvalues ** 0.5
 
-    Q = torch.diag(q)
-    Q_i = torch.linalg.inv(Q)
     U1_from_S = torch.cat(
         [
-            torch.cat([-Kx @ Ky, Kx ** 2 - E_conv], dim=1),
-            torch.cat([o_E_conv_i - Ky ** 2, Ky @ Kx], dim=1)
+            torch.cat([torch.diag(-Kx * Ky), torch.diag(Kx ** 2) - E_conv], dim=1),
+            torch.cat([o_E_conv_i - torch.diag(Ky ** 2), torch.diag(Ky * Kx)], dim=1)
         ]
     )
-    V = U1_from_S @ W @ Q_i
+    V = U1_from_S @ W / q[None, :]
 
     return W, V, q
 
 
-def transfer_2d_2(k0, d, W, V, center, q, varphi, I, O, big_F, big_G, big_T, device='cpu',
-                  type_complex=torch.complex128):
+def transfer_2d_wv_homogeneous(Kx, Ky, eps, varphi, device='cpu', type_complex=torch.complex128):
+    # uniform layer: S2_from_S is diagonal, so W = I, V is made of diagonal blocks
+    # and so are big_W and big_V, whose inverses are elementwise
+
+    kx = Kx
+    ky = Ky
+
+    q_half = (kx ** 2 + ky ** 2 - eps) ** 0.5
+    q = torch.cat([q_half, q_half])
+    one = torch.ones_like(q_half)
+
+    v_11 = -kx * ky / q_half
+    v_12 = (kx ** 2 - eps) / q_half
+    v_21 = (eps - ky ** 2) / q_half
+    v_22 = kx * ky / q_half
+
+    c = torch.cos(varphi)
+    s = torch.sin(varphi)
 
-    q1 = q[:center]
-    q2 = q[center:]
+    big_W_diag = (-s, c, c, s)
+    big_V_diag = (c * v_11 + s * v_21, c * v_12 + s * v_22, c * v_21 - s * v_11, c * v_22 - s * v_12)
+
+    W = torch.eye(2 * len(q_half), device=device, dtype=type_complex)
+    V = block_diag(v_11, v_12, v_21, v_22)
+
+    return torch.diag(one / eps), q, W, V, block_diag_inv(*big_W_diag), block_diag_inv(*big_V_diag)
+
+
+def transfer_2d_2(k0, d, W, V, center, q, varphi, big_F, big_G, big_T, device='cpu',
+                  type_complex=torch.complex128, big_W_i=None, big_V_i=None):
 
     W_11 = W[:center, :center]
     W_12 = W[:center, center:]
@@ -348,27 +463,22 @@ def transfer_2d_2(k0, d, W, V, center, q, varphi, I, O, big_F, big_G, big_T, dev
     V_21 = V[center:, :center]
     V_22 = V[center:, center:]
 
-    X_1 = torch.diag(torch.exp(-k0 * q1 * d))
-    X_2 = torch.diag(torch.exp(-k0 * q2 * d))
-
-    F_c = torch.diag(torch.cos(varphi))
-    F_s = torch.diag(torch.sin(varphi))
+    F_c = torch.cos(varphi)[:, None]
+    F_s = torch.sin(varphi)[:, None]
 
-    W_ss = F_c @ W_21 - F_s @ W_11
-    W_sp = F_c @ W_22 - F_s @ W_12
-    W_ps = F_c @ W_11 + F_s @ W_21
-    W_pp = F_c @ W_12 + F_s @ W_22
+    W_ss = F_c * W_21 - F_s * W_11
+    W_sp = F_c * W_22 - F_s * W_12
+    W_ps = F_c * W_11 + F_s * W_21
+    W_pp = F_c * W_12 + F_s * W_22
 
-    V_ss = F_c @ V_11 + F_s @ V_21
-    V_sp = F_c @ V_12 + F_s @ V_22
-    V_ps = F_c @ V_21 - F_s @ V_11
-    V_pp = F_c @ V_22 - F_s @ V_12
+    V_ss = F_c * V_11 + F_s * V_21
+    V_sp = F_c * V_12 + F_s * V_22
+    V_ps = F_c * V_21 - F_s * V_11
+    V_pp = F_c * V_22 - F_s * V_12
 
-    big_I = torch.eye(2 * (len(I)), device=device, dtype=type_complex)
+    big_I = torch.eye(2 * center, device=device, dtype=type_complex)
 
-    big_X = torch.cat([
-        torch.cat([X_1, O], dim=1),
-        torch.cat([O, X_2], dim=1)])
+    big_X = torch.exp(-k0 * q * d)
 
     big_W = torch.cat([
         torch.cat([W_ss, W_sp], dim=1),
@@ -378,20 +488,22 @@ def transfer_2d_2(k0, d, W, V, center, q, varphi, I, O, big_F, big_G, big_T, dev
         torch.cat([V_ss, V_sp],  dim=1),
         torch.cat([V_ps, V_pp], dim=1)])
 
-    big_W_i = torch.linalg.inv(big_W)
-    big_V_i = torch.linalg.inv(big_V)
+    big_W_i_F = solve_left(big_W, big_F, big_W_i)
+    big_V_i_G = solve_left(big_V, big_G, big_V_i)
+
+    big_A = 0.5 * (big_W_i_F + big_V_i_G)
+    big_B = 0.5 * (big_W_i_F - big_V_i_G)
 
-    big_A = 0.5 * (big_W_i @ big_F + big_V_i @ big_G)
-    big_B = 0.5 * (big_W_i @ big_F - big_V_i @ big_G)
+    big_B_A_i, big_T_A_i = solve_right(big_A, big_B, big_T)
 
-    big_A_i = torch.linalg.inv(big_A)
+    big_X_B_A_i_X = big_X[:, None] * big_B_A_i * big_X[None, :]
 
-    big_F = big_W @ (big_I + big_X @ big_B @ big_A_i @ big_X)
-    big_G = big_V @ (big_I - big_X @ big_B @ big_A_i @ big_X)
+    big_F = big_W @ (big_I + big_X_B_A_i_X)
+    big_G = big_V @ (big_I - big_X_B_A_i_X)
 
-    big_T = big_T @ big_A_i @ big_X
+    big_T = big_T_A_i * big_X[None, :]
 
-    return big_X, big_F, big_G, big_T, big_A_i, big_B, W_11, W_12, W_21, W_22, V_11, V_12, V_21, V_22
+    return big_X, big_F, big_G, big_T, big_A, big_B, W_11, W_12, W_21, W_22, V_11, V_12, V_21, V_22
 
 
 def transfer_2d_3(center, big_F, big_G, big_T, Z_I, Y_I, psi, theta, ff, delta_i0, k_I_z, k0, n_I, n_II, k_II_z,
@@ -414,8 +526,8 @@ def transfer_2d_3(center, big_F, big_G, big_T, Z_I, Y_I, psi, theta, ff, delta_i
     final_A = torch.cat(
         [
             torch.cat([I, O, -big_F_11, -big_F_12], dim=1),
-            torch.cat([O, -1j * Z_I, -big_F_21, -big_F_22], dim=1),
-            torch.cat([-1j * Y_I, O, -big_G_11, -big_G_12], dim=1),
+            torch.cat([O, torch.diag(-1j * Z_I), -big_F_21, -big_F_22], dim=1),
+            torch.cat([torch.diag(-1j * Y_I), O, -big_G_11, -big_G_12], dim=1),
             torch.cat([O, I, -big_G_21, -big_G_22], dim=1),
         ]
     )
@@ -429,7 +541,7 @@ def transfer_2d_3(center, big_F, big_G, big_T, Z_I, Y_I, psi, theta, ff, delta_i
         ]
     )
 
-    final_RT = torch.linalg.inv(final_A) @ final_B
+    final_RT = torch.linalg.solve(final_A, final_B)
 
     R_s = final_RT[:ff ** 2, :].flatten()
     R_p = final_RT[ff ** 2:2 * ff ** 2, :].flatten()